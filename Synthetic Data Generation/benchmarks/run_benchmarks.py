@@ -0,0 +1,388 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+import argparse
+import atexit
+import contextlib
+import io
+import itertools
+import json
+import os
+import platform
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime as dt
+from pathlib import Path
+import numpy as np
+import pandas as pd
+import yaml
+
+BENCHMARK_PATH = Path(__file__).resolve().parent
+SRC_PATH = BENCHMARK_PATH.parent / 'src'
+sys.path.insert(0, str(SRC_PATH))
+from graph_dataset import GraphDataset
+from simulation_anomalylabels import simulate_anomaly_labels
+from simulation_continuous import get_cont_ts_df, populate_flow_all_nodes
+from simulation_categorical import get_cat_ts_df
+from simulation_binary import get_binary_ts_df
+from topology_generator import generate_topology, write_topology_json
+import main as main_module
+
+START_TIME = pd.Timestamp('2022-06-01 00:00:00')
+N_SOURCES = 2
+FANOUT = 3
+
+
+def get_anomaly_labels(duration_days=None, freq=None) -> tuple:
+    """Helper function to simulate the anomaly labels of a benchmark case, with the default config of the repo"""
+    return simulate_anomaly_labels(**get_anomaly_labels_kwargs(duration_days, freq))
+
+
+def get_anomaly_labels_kwargs(duration_days=None, freq=None) -> dict:
+    """Helper function to get the keyword arguments of function simulate_anomaly_labels() for a benchmark case"""
+    return {'num_simulated_anomaly_ts': 1, \
+            'time_range_lst': [get_time_range(duration_days)], \
+            'freq_lst': [freq], \
+            'start_of_day_range_lst': [['07:00:00', '09:00:00']], \
+            'end_of_day_range_lst': [['16:00:00', '17:00:00']], \
+            'surge_occurrence_range_lst': [[10, 10]], \
+            'surge_length_range_lst': [[20, 20]]}
+
+
+def get_time_range(duration_days=None) -> list:
+    """Helper function to get the time range of a benchmark case"""
+    return [str(START_TIME), str(START_TIME + pd.Timedelta(days=duration_days))]
+
+
+def get_tree_topology(n_nodes=None) -> tuple:
+    """Helper function to get the topology table and the twins of each model of a benchmark case, a tree fed by N_SOURCES source twins"""
+    return generate_topology(n_nodes=n_nodes, shape='tree', n_sources=N_SOURCES, fan_out=FANOUT)
+
+
+def get_gd(n_nodes=None) -> GraphDataset:
+    """Helper function to get the graph of a benchmark case"""
+    topo_df, model_twins_dic = get_tree_topology(n_nodes=n_nodes)
+    return GraphDataset(topo_df=topo_df, \
+                        relationship_to_flow='isParent', \
+                        simulated_nodes=model_twins_dic['sourcemachine'])
+
+
+# Each setup function builds the inputs of a benchmark case, then returns the function to time
+def setup_generate_topology(n_nodes=None, shape=None):
+    return lambda: generate_topology(n_nodes=n_nodes, shape=shape, n_sources=N_SOURCES, fan_out=FANOUT, redundant_ratio=0.01, seed=2022)
+
+
+def setup_simulate_anomaly_labels(duration_days=None, freq=None):
+    return lambda: get_anomaly_labels(duration_days=duration_days, freq=freq)
+
+
+def setup_populate_flow_all_nodes(n_nodes=None, duration_days=None, freq=None):
+    gd = get_gd(n_nodes=n_nodes)
+    n_timestamps = len(pd.date_range(*get_time_range(duration_days), freq=freq))
+    supply_mat = np.zeros((n_nodes, n_timestamps))
+    supply_mat[:N_SOURCES] = np.random.uniform(5, 10, (N_SOURCES, n_timestamps))
+    # Build the flow operator cached on gd beforehand, as it is built once per run
+    gd.get_flow_operator()
+    return lambda: populate_flow_all_nodes(gd=gd, supply_mat=supply_mat)
+
+
+def setup_get_cont_ts_df(n_nodes=None, duration_days=None, freq=None):
+    gd = get_gd(n_nodes=n_nodes)
+    anomaly_label_lst, surge_start_end_indices_lst = get_anomaly_labels(duration_days=duration_days, freq=freq)
+    return lambda: get_cont_ts_df(unique_anomaly_label=True, \
+                                  anomaly_label_lst=anomaly_label_lst, \
+                                  surge_start_end_indices_lst=surge_start_end_indices_lst, \
+                                  simulate_surge_lst=[True] * N_SOURCES, \
+                                  surge_ratio_range_lst=[[5, 10]] * N_SOURCES, \
+                                  normal_mean_range_lst=[[6, 7]] * N_SOURCES, \
+                                  normal_std_lst=[0.5] * N_SOURCES, \
+                                  gd=gd, \
+                                  key_name='water_flow', \
+                                  missing_ratio=0.1, \
+                                  value_noise=True, \
+                                  timestamp_noise=False, \
+                                  surge_with_decay=False)
+
+
+def setup_get_cat_ts_df(n_keys=None, duration_days=None, freq=None):
+    anomaly_label_lst, _ = get_anomaly_labels(duration_days=duration_days, freq=freq)
+    return lambda: get_cat_ts_df(anomaly_label_lst=anomaly_label_lst, \
+                                 num_simulated_ts=n_keys, \
+                                 freq_lst=[freq] * n_keys, \
+                                 id_name_lst=[f'N{i:05d}' for i in range(n_keys)], \
+                                 key_name_lst=['PowerLevel'] * n_keys, \
+                                 cat_names_lst=[['High', 'Mid', 'Low']] * n_keys, \
+                                 cat_ratio_lst=[[0.333, 0.333, 0.333]] * n_keys, \
+                                 missing_ratio_lst=[0.8] * n_keys, \
+                                 timestamp_noise_lst=[False] * n_keys)
+
+
+def setup_get_binary_ts_df(n_keys=None, duration_days=None, freq=None):
+    return lambda: get_binary_ts_df(num_simulated_ts=n_keys, \
+                                    time_range_lst=[get_time_range(duration_days)] * n_keys, \
+                                    freq_lst=[freq] * n_keys, \
+                                    id_name_lst=[f'N{i:05d}' for i in range(n_keys)], \
+                                    key_name_lst=['Status'] * n_keys, \
+                                    start_of_day_range_lst=[['07:00:00', '09:00:00']] * n_keys, \
+                                    end_of_day_range_lst=[['16:00:00', '17:00:00']] * n_keys, \
+                                    on_occurrence_range_lst=[[100, 100]] * n_keys, \
+                                    on_length_range_lst=[[5, 10]] * n_keys, \
+                                    missing_ratio_lst=[0.1] * n_keys, \
+                                    timestamp_noise_lst=[False] * n_keys)
+
+
+def setup_main(n_nodes=None, n_keys=None, duration_days=None, freq=None):
+    """Run main() end-to-end with the config of the repo, on a tree topology, n_keys continuous keys, and outputs written to a temporary folder"""
+    with open(SRC_PATH / 'config.yaml', 'r') as stream:
+        config = yaml.safe_load(stream)
+    work_path = Path(tempfile.mkdtemp(prefix='benchmark_main_'))
+    atexit.register(shutil.rmtree, work_path, ignore_errors=True)
+    topo_df, model_twins_dic = get_tree_topology(n_nodes=n_nodes)
+    topo_json_file = work_path / 'topology.json'
+    write_topology_json(topo_df=topo_df, topo_json_file=topo_json_file)
+    source_nodes = model_twins_dic['sourcemachine']
+    config.update({'plot': False, \
+                   'save': True, \
+                   'experiment_name': 'benchmark'})
+    config['init_graph_kwargs'].update({'topo_json_file': str(topo_json_file), \
+                                        'simulated_nodes': source_nodes, \
+                                        'model_twins_dic': model_twins_dic, \
+                                        'models_json_folder': str((SRC_PATH / config['init_graph_kwargs']['models_json_folder']).resolve())})
+    config['simulate_anomaly_labels_kwargs'] = get_anomaly_labels_kwargs(duration_days, freq)
+    # Repeat the first continuous key n_keys times
+    continuous_kwargs = config['simulate_ts_kwargs_continuous']
+    for name, value in continuous_kwargs.items():
+        if name.endswith('_lst'):
+            continuous_kwargs[name] = [value[0]] * n_keys
+    continuous_kwargs['key_name_lst'] = [f'flow_{i}' for i in range(n_keys)]
+    for profile in ['categorical', 'binary']:
+        profile_kwargs = config[f'simulate_ts_kwargs_{profile}']
+        profile_kwargs['freq_lst'] = [freq] * profile_kwargs['num_simulated_ts']
+        profile_kwargs['id_name_lst'] = [source_nodes[i % N_SOURCES] for i in range(profile_kwargs['num_simulated_ts'])]
+        if 'time_range_lst' in profile_kwargs:
+            profile_kwargs['time_range_lst'] = [get_time_range(duration_days)] * profile_kwargs['num_simulated_ts']
+    # main() writes into '../data/synthetic_data/', relative to the working directory
+    run_path = work_path / 'src'
+    run_path.mkdir()
+
+    def run_main():
+        cwd = os.getcwd()
+        os.chdir(run_path)
+        try:
+            main_module.main(**config)
+        finally:
+            os.chdir(cwd)
+    return run_main
+
+
+BENCHMARK_SETUP_DIC = {'generate_topology': setup_generate_topology, \
+                       'simulate_anomaly_labels': setup_simulate_anomaly_labels, \
+                       'populate_flow_all_nodes': setup_populate_flow_all_nodes, \
+                       'get_cont_ts_df': setup_get_cont_ts_df, \
+                       'get_cat_ts_df': setup_get_cat_ts_df, \
+                       'get_binary_ts_df': setup_get_binary_ts_df, \
+                       'main': setup_main}
+
+
+def get_case_lst(benchmark_config=None, repeat=3, case_filter=None) -> list:
+    """
+    List the benchmark cases, one per combination of the parameters swept by each benchmark.
+
+    Parameters
+    ----------
+    benchmark_config : parameter values swept by each benchmark, keyed by benchmark name, along with an optional number of timed runs 'repeat',
+        dict of dict
+    repeat : number of timed runs of the benchmarks without their own,
+        int, default=3
+    case_filter : regular expression to select the cases by id, or None for all cases,
+        str, default=None
+
+    Return
+    ----------
+    case_lst : benchmark cases as (case id, benchmark name, parameters, number of timed runs),
+        list of tuple
+    """
+    case_lst = []
+    for benchmark_name, sweep_dic in benchmark_config.items():
+        if benchmark_name not in BENCHMARK_SETUP_DIC:
+            raise KeyError(f"Unknown benchmark '{benchmark_name}', please use one of {list(BENCHMARK_SETUP_DIC)}")
+        sweep_dic = dict(sweep_dic)
+        benchmark_repeat = sweep_dic.pop('repeat', repeat)
+        for values in itertools.product(*sweep_dic.values()):
+            params = dict(zip(sweep_dic.keys(), values))
+            case_id = benchmark_name + '[' + ','.join(f'{name}={value}' for name, value in params.items()) + ']'
+            if case_filter is None or re.search(case_filter, case_id):
+                case_lst.append((case_id, benchmark_name, params, benchmark_repeat))
+    return case_lst
+
+
+def run_case(benchmark_name=None, params=None, repeat=3) -> dict:
+    """
+    Run a benchmark case: the best wall time of repeated runs, then the peak memory allocated by a separate run traced by tracemalloc
+    (which slows the run down). Each run is seeded the same way, with the progress printed by the generators discarded.
+
+    Parameters
+    ----------
+    benchmark_name : name of the benchmark,
+        str
+    params : parameters of the case,
+        dict
+    repeat : number of timed runs,
+        int, default=3
+
+    Return
+    ----------
+    result : best and median wall time in seconds, and peak memory in MB,
+        dict
+    """
+    with contextlib.redirect_stdout(io.StringIO()):
+        np.random.seed(2022)
+        func = BENCHMARK_SETUP_DIC[benchmark_name](**params)
+        wall_time_lst = []
+        for _ in range(repeat):
+            np.random.seed(2022)
+            start = time.perf_counter()
+            func()
+            wall_time_lst.append(time.perf_counter() - start)
+        np.random.seed(2022)
+        tracemalloc.start()
+        try:
+            func()
+            peak_bytes = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+    return {'wall_s': min(wall_time_lst), \
+            'wall_median_s': float(np.median(wall_time_lst)), \
+            'peak_mb': peak_bytes / 2**20}
+
+
+def compare_to_baseline(result_dic=None, baseline_dic=None, tolerance=0.25, min_time_diff_s=0.05) -> pd.DataFrame:
+    """
+    Compare the results to a baseline, flagging the cases slower, or allocating more memory, than the baseline by more than tolerance.
+    Slowdowns shorter than min_time_diff_s are ignored as timing noise.
+
+    Parameters
+    ----------
+    result_dic : results of each case, keyed by case id,
+        dict of dict
+    baseline_dic : baseline results of each case, keyed by case id, cases missing from the baseline are not flagged,
+        dict of dict
+    tolerance : relative increase of wall time or peak memory flagged as a regression,
+        float, default=0.25
+    min_time_diff_s : smallest increase of wall time flagged as a regression,
+        float, default=0.05
+
+    Return
+    ----------
+    compare_df : wall time and peak memory of each case against the baseline, with the flag 'regression',
+        pd.DataFrame
+    """
+    compare_df = pd.DataFrame.from_dict(result_dic, orient='index')[['wall_s', 'peak_mb']]
+    baseline_df = pd.DataFrame.from_dict(baseline_dic, orient='index', columns=['wall_s', 'peak_mb']).reindex(compare_df.index)
+    compare_df['base_wall_s'] = baseline_df['wall_s']
+    compare_df['base_peak_mb'] = baseline_df['peak_mb']
+    compare_df['wall_ratio'] = compare_df['wall_s'] / compare_df['base_wall_s']
+    compare_df['peak_ratio'] = compare_df['peak_mb'] / compare_df['base_peak_mb']
+    compare_df['regression'] = ((compare_df['wall_ratio'] > 1 + tolerance) & \
+                                (compare_df['wall_s'] - compare_df['base_wall_s'] > min_time_diff_s)) | \
+                               (compare_df['peak_ratio'] > 1 + tolerance)
+    return compare_df
+
+
+def get_run_info() -> dict:
+    """Helper function to describe the code and machine the benchmarks ran on"""
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=BENCHMARK_PATH, \
+                                capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {'time': dt.now().isoformat(timespec='seconds'), \
+            'commit': commit, \
+            'machine': platform.node(), \
+            'platform': platform.platform(), \
+            'python': platform.python_version(), \
+            'numpy': np.__version__, \
+            'pandas': pd.__version__}
+
+
+def run_benchmarks(config_file=None, \
+                   case_filter=None, \
+                   history_file=None, \
+                   baseline_file=None, \
+                   save_baseline=False) -> pd.DataFrame:
+    """
+    Run the benchmark cases, append their results to the history, and compare them to the baseline.
+
+    Parameters
+    ----------
+    config_file : yaml file of the parameter sweeps and settings (repeat, tolerance, min_time_diff_s),
+        str
+    case_filter : regular expression to select the cases by id, or None for all cases, exiting with code 2 if it matches no case,
+        str, default=None
+    history_file : json lines file to which each run appends its results,
+        str
+    baseline_file : json file of the baseline results,
+        str
+    save_baseline : whether to save the results as the baseline, merged into the existing baseline if any,
+        bool, default=False
+
+    Return
+    ----------
+    compare_df : wall time and peak memory of each case against the baseline, with the flag 'regression',
+        pd.DataFrame
+    """
+    with open(config_file, 'r') as stream:
+        config = yaml.safe_load(stream)
+    case_lst = get_case_lst(benchmark_config=config['benchmarks'], repeat=config['repeat'], case_filter=case_filter)
+    if len(case_lst) == 0:
+        print(f"No cases matched the filter '{case_filter}'.")
+        sys.exit(2)
+    result_dic = {}
+    for case_id, benchmark_name, params, repeat in case_lst:
+        result_dic[case_id] = run_case(benchmark_name=benchmark_name, params=params, repeat=repeat)
+        print(f"{case_id}: {result_dic[case_id]['wall_s']:.3f}s, {result_dic[case_id]['peak_mb']:.1f}MB")
+
+    Path(history_file).parent.mkdir(parents=True, exist_ok=True)
+    with open(history_file, 'a') as f:
+        f.write(json.dumps({**get_run_info(), 'results': result_dic}) + '\n')
+
+    baseline_dic = {}
+    if os.path.exists(baseline_file):
+        with open(baseline_file, 'r') as f:
+            baseline_dic = json.load(f)['results']
+    compare_df = compare_to_baseline(result_dic=result_dic, \
+                                     baseline_dic=baseline_dic, \
+                                     tolerance=config['tolerance'], \
+                                     min_time_diff_s=config['min_time_diff_s'])
+    if save_baseline:
+        with open(baseline_file, 'w') as f:
+            json.dump({**get_run_info(), 'results': {**baseline_dic, **result_dic}}, f, indent=2)
+    return compare_df
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the wall time and peak memory of the synthetic data generator, '
+                                                 'and flag regressions against a stored baseline.')
+    parser.add_argument('--config', default=str(BENCHMARK_PATH / 'benchmarks.yaml'), help='yaml file of the parameter sweeps')
+    parser.add_argument('--filter', default=None, help='regular expression selecting the cases by id, e.g. "get_cont_ts_df|main"')
+    parser.add_argument('--history', default=str(BENCHMARK_PATH / 'results' / 'history.jsonl'), help='json lines file of the results of every run')
+    parser.add_argument('--baseline', default=str(BENCHMARK_PATH / 'results' / 'baseline.json'), help='json file of the baseline results')
+    parser.add_argument('--save-baseline', action='store_true', help='save the results as the new baseline')
+    args = parser.parse_args()
+
+    compare_df = run_benchmarks(config_file=args.config, \
+                                case_filter=args.filter, \
+                                history_file=args.history, \
+                                baseline_file=args.baseline, \
+                                save_baseline=args.save_baseline)
+    with pd.option_context('display.max_rows', None, 'display.max_columns', None, 'display.max_colwidth', None, 'display.width', 250):
+        print(compare_df.round(3))
+    if compare_df['regression'].any():
+        print(f"{compare_df['regression'].sum()} regressions against the baseline:")
+        print('\n'.join(compare_df.index[compare_df['regression']]))
+        sys.exit(1)
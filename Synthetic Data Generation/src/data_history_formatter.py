@@ -1,5 +1,13 @@
+import numpy as np
 import pandas as pd
 from datetime import datetime as dt
+from utils.utils_output import ShardedCsvWriter, write_table_chunk, format_timestamps, TIMESTAMP_UNIT_NS
+
+SERVICE_ID = 'temporary-adt.api.wcus.digitaltwins.azure.net'
+DATA_HISTORY_COLUMNS = ['TimeStamp', 'SourceTimeStamp', 'ServiceId', 'Id', \
+                        'ModelId', 'Key', 'Value', 'RelationshipTarget', 'RelationshipId']
+# Number of rows formatted and written at once by DataHistoryWriter
+DEFAULT_BATCH_ROWS = 100000
 
 def data_history_formatter(df=None) -> pd.DataFrame:
     """
@@ -15,9 +23,123 @@ def data_history_formatter(df=None) -> pd.DataFrame:
     df_dh : Data formatted as the same as ADT Data History,
         pd.DataFrame
     """
-    df_dh = df.rename(columns={'Timestamp': 'SourceTimeStamp'})
-    df_dh['TimeStamp'] = dt.now()
-    df_dh['ServiceId'] = 'temporary-adt.api.wcus.digitaltwins.azure.net'
-    df_dh = df_dh.reindex(columns = ['TimeStamp', 'SourceTimeStamp', 'ServiceId', 'Id', \
-                                     'ModelId', 'Key', 'Value', 'RelationshipTarget', 'RelationshipId'])
-    return df_dh
+    return format_data_history(df=df, time_stamp=dt.now())
+
+
+def format_data_history(df=None, time_stamp=None, timestamps_as_str=False, timestamp_unit='us') -> pd.DataFrame:
+    """
+    Format data as the same as ADT Data History, from the columns of df without copying df as a whole.
+
+    Parameters
+    ----------
+    df: Synthetic data directly generated from main.py,
+        pd.DataFrame
+    time_stamp: time of ingestion shared by all rows (TimeStamp),
+        datetime
+    timestamps_as_str: whether to format TimeStamp and SourceTimeStamp as strings with function format_timestamps(), e.g. before writing csv,
+        bool, default=False
+    timestamp_unit: unit of the timestamps formatted as strings, the time of ingestion being floored to it, one of 'D', 's', 'ms', 'us' or 'ns',
+        str, default='us'
+
+    Return
+    ----------
+    df_dh : Data formatted as the same as ADT Data History,
+        pd.DataFrame
+    """
+    source_time_stamp = df['Timestamp'].values
+    time_stamp = pd.Timestamp(time_stamp)
+    if timestamps_as_str:
+        source_time_stamp = format_timestamps(source_time_stamp, unit=timestamp_unit)
+        time_stamp = format_timestamps(np.array([time_stamp.floor(pd.Timedelta(TIMESTAMP_UNIT_NS[timestamp_unit])).to_datetime64()]), \
+                                       unit=timestamp_unit)[0]
+    return pd.DataFrame({'TimeStamp': time_stamp, \
+                         'SourceTimeStamp': source_time_stamp, \
+                         'ServiceId': SERVICE_ID, \
+                         'Id': df['Id'].values, \
+                         'ModelId': df['ModelId'].values, \
+                         'Key': df['Key'].values, \
+                         'Value': df['Value'].values, \
+                         'RelationshipTarget': np.nan, \
+                         'RelationshipId': np.nan}, index=df.index, columns=DATA_HISTORY_COLUMNS)
+
+
+class DataHistoryWriter(object):
+    def __init__(self, \
+                 file_path=None, \
+                 output_format='csv', \
+                 partition_by_id=False, \
+                 compression=None, \
+                 max_shard_mb=None, \
+                 batch_rows=DEFAULT_BATCH_ROWS, \
+                 timestamp_unit='us') -> None:
+        """
+        Writer of the update stream in ADT Data History format, formatting and writing it in batches of a bounded number of rows,
+        so that the formatted table is never held in memory as a whole. Time chunks of the update stream are written one after another with write().
+
+        Parameters
+        ----------
+        file_path : path of the output without extension, e.g. '../data/synthetic_data/v1/update_stream_dh_v1',
+            str
+        output_format : 'csv' for csv files, or 'parquet' for a Parquet dataset (with typed timestamps, see function write_table_chunk()),
+            str, default='csv'
+        partition_by_id : whether to also partition the Parquet dataset by Id,
+            bool, default=False
+        compression : compression of csv files, None, 'gzip' or 'zstd' (requires zstandard),
+            str, default=None
+        max_shard_mb : size of the csv text (before compression) of each csv file, e.g. as recommended for ADX bulk ingestion,
+            or None to write a single csv file (see ShardedCsvWriter),
+            float, default=None
+        batch_rows : number of rows formatted and written at once,
+            int, default=100000
+        timestamp_unit : unit of the timestamps of csv files, shared by all batches so that the whole output has the same timestamp format,
+            one of 's', 'ms', 'us' (enough for the timestamp noise, see function get_timestamp_noise()) or 'ns' (full precision),
+            a unit coarser than the source timestamps raising a ValueError,
+            str, default='us'
+
+        Return
+        ----------
+        None
+        """
+        if output_format not in ['csv', 'parquet']:
+            raise ValueError(f"Unknown output_format '{output_format}', please use 'csv' or 'parquet'")
+        if timestamp_unit not in TIMESTAMP_UNIT_NS:
+            raise ValueError(f"Unknown timestamp_unit '{timestamp_unit}', please use one of {list(TIMESTAMP_UNIT_NS)}")
+        self.file_path = file_path
+        self.output_format = output_format
+        self.partition_by_id = partition_by_id
+        self.batch_rows = batch_rows
+        self.timestamp_unit = timestamp_unit
+        self.csv_writer = ShardedCsvWriter(file_path=file_path, compression=compression, max_shard_mb=max_shard_mb) \
+                          if output_format == 'csv' else None
+        self.written_file_lst = []
+
+    def write(self, \
+              df=None) -> None:
+        """
+        Format a time chunk of the update stream and write it, batch by batch, all with the same time of ingestion (TimeStamp).
+
+        Parameters
+        ----------
+        df: Synthetic data directly generated from main.py,
+            pd.DataFrame
+
+        Return
+        ----------
+        None
+        """
+        time_stamp = dt.now()
+        for start in range(0, df.shape[0], self.batch_rows):
+            df_dh = format_data_history(df=df.iloc[start: start + self.batch_rows], \
+                                        time_stamp=time_stamp, \
+                                        timestamps_as_str=self.csv_writer is not None, \
+                                        timestamp_unit=self.timestamp_unit)
+            if self.csv_writer is not None:
+                self.csv_writer.write(df_dh)
+            else:
+                write_table_chunk(df_dh, self.file_path, self.written_file_lst, output_format=self.output_format, \
+                                  timestamp_col='SourceTimeStamp', partition_by_id=self.partition_by_id)
+
+    def close(self) -> None:
+        """Close the csv file being written"""
+        if self.csv_writer is not None:
+            self.csv_writer.close()
@@ -6,6 +6,10 @@ import pandas as pd
 pd.options.mode.chained_assignment = None
 import matplotlib.pyplot as plt
 import networkx as nx
+from utils.utils_flow import get_adjacency_csr, get_flow_matrix_from_adjacency, FlowOperator
+
+# Color of each relationship on plots
+EDGE_COLOR_MAP = {'isParent': 'black', 'isRedundant': 'orange'}
 
 class GraphDataset(object):
     def __init__(self, \
@@ -15,6 +19,8 @@ class GraphDataset(object):
         """
         Base class for generation a graph object.
         Initialize the GraphDataset object with topology dataframe, relationship selected for topology flow, and the list of source nodes to simulate time-series.
+        The graph is held as a compact CSR adjacency per relationship over nodes sorted by id (node_ids, with the index node_index mapping ids back to positions),
+        which keeps memory and construction time linear in the number of relationships. The networkx graph G is only built on first use, e.g. by plot_graph().
 
         Parameters
         ----------
@@ -38,7 +44,90 @@ class GraphDataset(object):
         self.topo_df = topo_df
         self.relationship_to_flow = relationship_to_flow
         self.simulated_nodes = simulated_nodes
-        self.G = self.get_graph()
+
+    @property
+    def topo_df(self) -> pd.DataFrame:
+        return self._topo_df
+
+    @topo_df.setter
+    def topo_df(self, topo_df) -> None:
+        self._topo_df = topo_df
+        self.invalidate()
+
+    @property
+    def G(self) -> nx.DiGraph:
+        if self._G is None:
+            self._G = self.get_graph()
+        return self._G
+
+    @property
+    def n_nodes(self) -> int:
+        return len(self.node_ids)
+
+    def _build_adjacency(self) -> None:
+        """
+        Build the sorted node ids, the index mapping them back to positions, and the CSR adjacency of each relationship from topo_df,
+        i.e. the targets of node i through a relationship are node_ids[indices[indptr[i]:indptr[i+1]]] with (indptr, indices)=adjacency_dic[relationship].
+        """
+        self.node_ids = np.sort(pd.unique(np.concatenate([self.topo_df['sourceId'].values, self.topo_df['targetId'].values])).astype(object))
+        self.node_index = pd.Index(self.node_ids)
+        source_idx = self.node_index.get_indexer(self.topo_df['sourceId'])
+        target_idx = self.node_index.get_indexer(self.topo_df['targetId'])
+        relationship_codes, relationship_names = pd.factorize(self.topo_df['relationshipName'], sort=True)
+        self.adjacency_dic = {relationship: get_adjacency_csr(source_idx=source_idx[relationship_codes == i], \
+                                                              target_idx=target_idx[relationship_codes == i], \
+                                                              n_nodes=self.n_nodes) \
+                              for i, relationship in enumerate(relationship_names)}
+        self._G = None
+
+    def invalidate(self) -> None:
+        """
+        Rebuild the graph from topo_df and drop the flow operators cached for the previous topology.
+        Called when topo_df is reassigned, and to be called after modifying topo_df in place.
+        """
+        self._flow_operator_dic = {}
+        self._build_adjacency()
+
+    def get_adjacency(self, \
+                      relationship=None) -> tuple:
+        """
+        Get the adjacency of the nodes through a relationship in CSR format.
+
+        Parameters
+        ----------
+        relationship : relationship name,
+            str (e.g. 'isParent')
+
+        Return
+        ----------
+        indptr : offsets of the targets of each node, of length n_nodes+1,
+            np.array of int
+        indices : positions of the targets of all nodes in node_ids,
+            np.array of int
+        """
+        if relationship not in self.adjacency_dic:
+            return np.zeros(self.n_nodes + 1, dtype=np.int32), np.zeros(0, dtype=np.int32)
+        return self.adjacency_dic[relationship]
+
+    def get_node_indices(self, \
+                         node_lst=None) -> np.array:
+        """
+        Look up the position of nodes in node_ids, i.e. their row in the supply and solution matrices.
+
+        Parameters
+        ----------
+        node_lst : node ids,
+            list of str (e.g. ['A', 'B'])
+
+        Return
+        ----------
+        node_indices : position of each node,
+            np.array of int
+        """
+        node_indices = self.node_index.get_indexer(node_lst)
+        if (node_indices < 0).any():
+            raise KeyError(f'Nodes not found in the topology: {list(np.asarray(node_lst, dtype=object)[node_indices < 0])}')
+        return node_indices
 
     def get_graph(self) -> nx.Graph:
         """
@@ -50,19 +139,114 @@ class GraphDataset(object):
         """
         # Create a directed graph and sort the order of nodes
         G = nx.DiGraph()
-        G.add_nodes_from(sorted(list(set(list(self.topo_df['sourceId'])+list(self.topo_df['targetId'])))))
+        G.add_nodes_from(self.node_ids)
 
         # Add edges of the graph and set relationship attribute and color for each edge
-        edge_color_map = {'isParent': 'black', 'isRedundant': 'orange'}
-        topo_df_gb = self.topo_df.groupby('relationshipName')
-        for gb_key in topo_df_gb.groups.keys():
-            sub_topo_df = topo_df_gb.get_group(gb_key)
-            G.add_edges_from(list(zip(sub_topo_df['sourceId'], sub_topo_df['targetId'])), \
-                             color=edge_color_map[gb_key], 
-                             relationship=gb_key)
+        for relationship, (indptr, indices) in self.adjacency_dic.items():
+            source_idx = np.repeat(np.arange(self.n_nodes), np.diff(indptr))
+            G.add_edges_from(zip(self.node_ids[source_idx], self.node_ids[indices]), \
+                             color=EDGE_COLOR_MAP[relationship], 
+                             relationship=relationship)
         # Save the graph for the object
         return G
 
+    def get_flow_operator(self, \
+                          relationship_to_flow=None) -> FlowOperator:
+        """
+        Get the operator propagating the supply of source nodes top-down through the topology flow.
+        The operator is built once per relationship and cached, the cache is invalidated when topo_df is reassigned,
+        or by calling invalidate() after modifying topo_df in place.
+
+        Parameters
+        ----------
+        relationship_to_flow : relationship used for topology top-down flow, if not given then use the one specified in class initiation,
+            str (e.g. 'isParent'), optional
+
+        Return
+        ----------
+        flow_operator : operator with nodes ordered as self.node_ids,
+            FlowOperator
+        """
+        relationship_to_flow = relationship_to_flow or self.relationship_to_flow
+        if relationship_to_flow not in self._flow_operator_dic:
+            indptr, indices = self.get_adjacency(relationship_to_flow)
+            self._flow_operator_dic[relationship_to_flow] = FlowOperator(flow_mat=get_flow_matrix_from_adjacency(indptr=indptr, indices=indices))
+        return self._flow_operator_dic[relationship_to_flow]
+
+    def set_flow_operator(self, \
+                          flow_operator=None, \
+                          relationship_to_flow=None) -> None:
+        """
+        Cache an operator built elsewhere for the current topology (e.g. restored in a worker process), so that it is not rebuilt.
+
+        Parameters
+        ----------
+        flow_operator : operator with nodes ordered as self.node_ids,
+            FlowOperator
+        relationship_to_flow : relationship used for topology top-down flow, if not given then use the one specified in class initiation,
+            str (e.g. 'isParent'), optional
+
+        Return
+        ----------
+        None
+        """
+        relationship_to_flow = relationship_to_flow or self.relationship_to_flow
+        self._flow_operator_dic[relationship_to_flow] = flow_operator
+
+    def set_twin_models(self, \
+                        model_twins_dic=None, \
+                        model_json_dic=None) -> None:
+        """
+        Build the lookup from each twin to the @id of its DTDL model, used by get_model_ids().
+        A twin listed under several models is assigned to the last one.
+
+        Parameters
+        ----------
+        model_twins_dic : twins of each model, keyed by model displayName,
+            dict of list of str (e.g. {'sourcemachine': ['A', 'B'], 'feedmachine': ['C', 'D']})
+        model_json_dic : DTDL model definition, keyed by model displayName,
+            dict of dict
+
+        Return
+        ----------
+        None
+        """
+        missing_models = [model_name for model_name in model_twins_dic if model_name not in model_json_dic]
+        if len(missing_models) > 0:
+            raise KeyError(f'No DTDL model definition found for models: {missing_models}')
+        twin_model_dic = {twin: model_json_dic[model_name]['@id'] \
+                          for model_name, twins in model_twins_dic.items() for twin in twins}
+        self.model_ids = pd.Index(sorted(set(twin_model_dic.values())))
+        self.twin_model_codes = pd.Series(self.model_ids.get_indexer(list(twin_model_dic.values())), \
+                                          index=pd.Index(list(twin_model_dic.keys())))
+        self._unknown_twins = set()
+
+    def get_model_ids(self, \
+                      ids=None) -> pd.Categorical:
+        """
+        Look up the @id of the DTDL model of each twin in a column of Ids, mapping only the distinct Ids and then their codes.
+        Twins without model get a missing ModelId, and are reported once in bulk.
+
+        Parameters
+        ----------
+        ids : column of twin Ids,
+            pd.Series
+
+        Return
+        ----------
+        model_ids : ModelId of each row, with the @id of all models as categories,
+            pd.Categorical
+        """
+        id_codes, unique_ids = pd.factorize(ids)
+        unique_model_codes = self.twin_model_codes.reindex(unique_ids).fillna(-1).values.astype(np.int64)
+        unknown_twins = set(unique_ids[unique_model_codes == -1]) - self._unknown_twins
+        if len(unknown_twins) > 0:
+            print(f'{len(unknown_twins)} twins are not listed in model_twins_dic and get no ModelId: {sorted(unknown_twins)}')
+            self._unknown_twins |= unknown_twins
+        # Codes of missing Ids (-1) are kept as -1, i.e. missing
+        model_codes = np.append(unique_model_codes, -1)[id_codes]
+        return pd.Categorical.from_codes(model_codes, categories=self.model_ids)
+
     def plot_graph(self, \
                    sln_mat=None) -> None:
         """
@@ -8,16 +8,82 @@ import os
 import sys
 from pathlib import Path
 import yaml
+import json
 sys.path.append(str(Path(os.getcwd()).parent) + '\src')
 from graph_dataset import GraphDataset
-from simulation_anomalylabels import simulate_anomaly_labels
-from simulation_continuous import get_cont_ts_df
-from simulation_categorical import get_cat_ts_df
-from simulation_monotonic import get_monotonic_ts_df
-from simulation_binary import get_binary_ts_df
-from pattern_anomalies import get_pattern_anomalies
-from data_history_formatter import data_history_formatter
-from utils.utils_data_generation import generate_relationship_json, plot_ts
+from simulation_anomalylabels import simulate_anomaly_labels, write_anomaly_label_csv
+from simulation_parallel import get_unit_lst, UnitRunner
+from pattern_anomalies import add_pattern_anomalies
+from data_history_formatter import data_history_formatter, DataHistoryWriter
+from utils.utils_data_generation import generate_relationship_json, plot_ts, get_chunk_ranges, get_chunk_positions, merge_sorted_streams, \
+                                        get_freq_ns
+from utils.utils_output import write_table_chunk, get_timestamp_unit, TIMESTAMP_UNIT_NS
+
+def get_graph_dataset(init_graph_kwargs=None) -> GraphDataset:
+    """
+    Create the graph object from the topology table and the DTDL models.
+
+    Parameters
+    ----------
+    init_graph_kwargs: keyword arguments for initiate graph object,
+        dict
+
+    Return
+    ----------
+    gd : an instance of GraphDataset object, with the model of each twin,
+        GraphDataset
+    """
+    # #### Step 1.1. Ingest Topology Table
+    # Create a sample topology table
+    with open(init_graph_kwargs['topo_json_file'], 'r') as f:
+        topo_json = json.load(f)
+    topo_df = pd.DataFrame(list(topo_json.values())[0])
+
+    # #### Step 1.2. Convert Tabular Topology into Graph
+    # Instantiate a GraphDataset object with topology given
+    gd = GraphDataset(topo_df=topo_df, \
+                      relationship_to_flow=init_graph_kwargs['relationship_to_flow'], \
+                      simulated_nodes=init_graph_kwargs['simulated_nodes'])
+
+    # #### Step 1.3. Read in DTDL Models
+    model_json_dic = {}
+    for i in os.listdir(init_graph_kwargs['models_json_folder']):
+        with open(os.path.join(init_graph_kwargs['models_json_folder'], i), 'r') as f:
+            model_json = yaml.safe_load(f)
+        model_name = model_json['displayName']
+        model_json_dic[model_name] = model_json
+    # Look up the model of each twin
+    gd.set_twin_models(model_twins_dic=init_graph_kwargs['model_twins_dic'], model_json_dic=model_json_dic)
+    return gd
+
+
+def get_csv_timestamp_unit(profiles_included=None, simulate_anomaly_labels_kwargs=None, simulate_ts_kwargs_dic=None) -> str:
+    """
+    Get the unit of the timestamps of all csv outputs, the coarsest one (at least seconds) representing exactly the start and frequency
+    of every time grid simulated, and the timestamp noise (drawn in whole microseconds) if any key has timestamp noise.
+
+    Parameters
+    ----------
+    profiles_included: list of data profiles included in synthetic data,
+        list of str
+    simulate_anomaly_labels_kwargs: keyword arguments for anomaly label generation,
+        dict
+    simulate_ts_kwargs_dic: keyword arguments for synthetic data generation of each data profile,
+        dict
+
+    Return
+    ----------
+    timestamp_unit : unit of the timestamps, one of 's', 'us' or 'ns' (see function format_timestamps()),
+        str
+    """
+    kwargs_lst = [simulate_anomaly_labels_kwargs] + [simulate_ts_kwargs_dic[profile] for profile in profiles_included]
+    grid_ns_lst = [pd.Timestamp(time_range[0]).value for kwargs in kwargs_lst for time_range in kwargs.get('time_range_lst', [])] \
+                  + [get_freq_ns(freq) for kwargs in kwargs_lst for freq in kwargs.get('freq_lst', [])]
+    if any(any(kwargs.get('timestamp_noise_lst', [])) for kwargs in kwargs_lst):
+        grid_ns_lst.append(TIMESTAMP_UNIT_NS['us'])
+    timestamp_unit = get_timestamp_unit(np.array(grid_ns_lst))
+    return 's' if timestamp_unit == 'D' else timestamp_unit
+
 
 def main(
     experiment_name=None, \
@@ -32,7 +98,14 @@ def main(
     simulate_ts_kwargs_categorical=None, \
     simulate_ts_kwargs_monotonic=None, \
     simulate_ts_kwargs_binary=None, \
-    data_history_format=True
+    data_history_format=True, \
+    data_history_kwargs=None, \
+    chunk_freq=None, \
+    n_workers=None, \
+    output_format='csv', \
+    partition_by_id=False, \
+    rng_per_series=False, \
+    timestamp_unit=None
     ) -> None:
     """
     Main function for synthetic data generation.
@@ -59,6 +132,29 @@ def main(
         dict
     data_history_format : indicate whether to format the data as the same as ADT Data History,
         bool, default=True
+    data_history_kwargs : keyword arguments for writing the data in ADT Data History format, i.e. compression of csv files (None, 'gzip' or 'zstd'),
+        max_shard_mb the size of each csv file or None for a single file, and batch_rows the number of rows formatted and written at once,
+        see DataHistoryWriter,
+        dict, default=None
+    chunk_freq : length of the time chunks simulated and written one after another to bound the memory used,
+        a multiple of every sampling frequency, or None to simulate the entire time range at once,
+        the anomaly labels of the entire time range being then kept compact (about 10 bytes per timestamp, see function get_anomaly_label_df()),
+        str (e.g. '1D'), default=None
+    n_workers : number of worker processes simulating the keys of the continuous and monotonic profiles and the categorical and binary profiles in parallel,
+        each drawing from its own random generator spawned from the seed so that the output does not depend on the number of workers,
+        or None to simulate them one after another from the global random state,
+        int, default=None
+    output_format : format of the update stream outputs, 'csv' for csv files or 'parquet' for Parquet datasets (requires pyarrow)
+        partitioned by date, with Id/Key/ModelId dictionary-encoded and typed timestamps,
+        str, default='csv'
+    partition_by_id : whether to also partition the Parquet datasets by Id,
+        bool, default=False
+    rng_per_series : whether each (profile, Id, Key) series draws from its own random generator derived from the seed and the series,
+        so that selected series can be regenerated later on with regenerate.py without regenerating the whole dataset,
+        bool, default=False
+    timestamp_unit : unit of the timestamps of all csv outputs, shared by all time chunks (e.g. 'ns' for full precision, see function format_timestamps()),
+        or None for the coarsest unit representing all timestamps simulated exactly, see function get_csv_timestamp_unit(),
+        str, default=None
 
     Return
     ----------
@@ -70,212 +166,216 @@ def main(
     np.random.seed(seed)
 
     # ## Chapter 1. Graph Object Creation
-    # #### Step 1.1. Ingest Topology Table
-    # Create a sample topology table
-    with open(init_graph_kwargs['topo_json_file'], 'r') as f:
-        topo_json = yaml.safe_load(f)
-    topo_df = pd.DataFrame(list(topo_json.values())[0])
+    gd = get_graph_dataset(init_graph_kwargs=init_graph_kwargs)
     if save:
-        topo_df.to_csv(data_path + f'topology_{experiment_name}.csv', index=False)
-
-    # #### Step 1.2. Convert Tabular Topology into Graph
-    # Instantiate a GraphDataset object with topology given
-    gd = GraphDataset(topo_df=topo_df, \
-                      relationship_to_flow=init_graph_kwargs['relationship_to_flow'], \
-                      simulated_nodes=init_graph_kwargs['simulated_nodes'])
+        gd.topo_df.to_csv(data_path + f'topology_{experiment_name}.csv', index=False)
     # Plot topology graph
     # if plot:
     #     gd.plot_graph()           
 
-    # #### Step 1.3. Read in DTDL Models
-    model_json_dic = {}
-    for i in os.listdir(init_graph_kwargs['models_json_folder']):
-        with open(os.path.join(init_graph_kwargs['models_json_folder'], i), 'r') as f:
-            model_json = yaml.safe_load(f)
-        model_name = model_json['displayName']
-        model_json_dic[model_name] = model_json
-
 
     # ## Chapter 2. Anomaly Labels Simulation
-    anomaly_label_lst, surge_start_end_indices_lst = simulate_anomaly_labels(**simulate_anomaly_labels_kwargs)
+    # Kept compact when simulating in time chunks, as the anomaly labels cover the entire time range
+    anomaly_label_lst, surge_start_end_indices_lst = simulate_anomaly_labels(**simulate_anomaly_labels_kwargs, compact=chunk_freq is not None)
     if save:
         for i in range(simulate_anomaly_labels_kwargs['num_simulated_anomaly_ts']):
-            anomaly_label_lst[i].reset_index().to_csv(data_path + f'anomaly_label_{experiment_name}_{i}.csv', index=False)
+            write_anomaly_label_csv(anomaly_label_lst[i], data_path + f'anomaly_label_{experiment_name}_{i}.csv')
 
 
     # ## Chapter 3. Synthetic Data Simulation
-    # ### Part 3.1. Data Profile - Continuous
-    # Simulate Telemetry Time-series with Anomalies: 
-    # - First Simulate Time-series for Selected Source Nodes
-    # - Then Populate Time-series for the Rest Nodes from Topology Flow Top-down
-    update_stream = pd.DataFrame()
-    if 'continuous' in profiles_included:
-        update_stream_continuous = pd.DataFrame()
-        for i in range(len(simulate_ts_kwargs_continuous['key_name_lst'])):
-            tmp_ts_df = get_cont_ts_df(
-                unique_anomaly_label=simulate_ts_kwargs_continuous['unique_anomaly_label'], \
-                anomaly_label_lst=anomaly_label_lst, \
-                surge_start_end_indices_lst=surge_start_end_indices_lst, \
-                simulate_surge_lst=simulate_ts_kwargs_continuous['simulate_surge_lst_lst'][i], \
-                surge_ratio_range_lst=simulate_ts_kwargs_continuous['surge_ratio_range_lst_lst'][i], \
-                normal_mean_range_lst=simulate_ts_kwargs_continuous['normal_mean_range_lst_lst'][i], \
-                normal_std_lst=simulate_ts_kwargs_continuous['normal_std_lst_lst'][i], \
-                gd=gd, \
-                key_name=simulate_ts_kwargs_continuous['key_name_lst'][i], \
-                missing_ratio=simulate_ts_kwargs_continuous['missing_ratio_lst'][i], \
-                value_noise=simulate_ts_kwargs_continuous['value_noise_lst'][i], \
-                timestamp_noise=simulate_ts_kwargs_continuous['timestamp_noise_lst'][i], \
-                surge_with_decay=simulate_ts_kwargs_continuous['surge_with_decay_lst'][i])
-            update_stream_continuous = pd.concat([update_stream_continuous, tmp_ts_df])
-        update_stream_continuous['ModelId'] = np.nan
-        for model_name, twins in init_graph_kwargs['model_twins_dic'].items():
-            update_stream_continuous.loc[update_stream_continuous['Id'].isin(twins), 'ModelId'] = model_json_dic[model_name]['@id']
-        update_stream_continuous = update_stream_continuous[['Id', 'ModelId', 'Key', 'Timestamp', 'Value']].sort_values(['Timestamp', 'Id', 'Key']).reset_index(drop=True)
-        update_stream = pd.concat([update_stream, update_stream_continuous])
-
-        if plot:
-            plot_ts(ts_df=update_stream_continuous, anomaly_label=anomaly_label_lst[0])
-
-        # Output Update_stream_continuous.csv, Topology_continuous.json & Topology_continuous.csv
-        generate_relationship_json(
-            topo_df=gd.topo_df, 
-            save=save, 
-            output_data_path=data_path, 
-            output_json_file_name=f'topology_continuous_{experiment_name}.json',
-            output_csv_file_name=f'topology_continuous_{experiment_name}.csv'
-            )
-        if save:
-            update_stream_continuous.to_csv(data_path + f'update_stream_continuous_{experiment_name}.csv', index=False)
-        print('Sample Update_stream_continuous.csv:')
-        print(update_stream_continuous.head())
+    # Simulate the entire time range at once, or in consecutive time chunks written one after another, with the running state
+    # of each data profile (e.g. daily means, cumulative sums, 'ON' status) carried across chunk boundaries
+    chunk_range_lst = get_chunk_ranges(time_range=[anomaly_label_lst[0].index[0], anomaly_label_lst[0].index[-1]], \
+                                       chunk_freq=chunk_freq)
+    simulate_ts_kwargs_dic = {'continuous': simulate_ts_kwargs_continuous, \
+                              'categorical': simulate_ts_kwargs_categorical, \
+                              'monotonic': simulate_ts_kwargs_monotonic, \
+                              'binary': simulate_ts_kwargs_binary}
+    if timestamp_unit is None:
+        timestamp_unit = get_csv_timestamp_unit(profiles_included=profiles_included, \
+                                                simulate_anomaly_labels_kwargs=simulate_anomaly_labels_kwargs, \
+                                                simulate_ts_kwargs_dic=simulate_ts_kwargs_dic)
+    unit_lst = get_unit_lst(profiles_included=profiles_included, simulate_ts_kwargs_dic=simulate_ts_kwargs_dic)
+    unit_runner = UnitRunner(gd=gd, \
+                             anomaly_label_lst=anomaly_label_lst, \
+                             surge_start_end_indices_lst=surge_start_end_indices_lst, \
+                             simulate_ts_kwargs_dic=simulate_ts_kwargs_dic, \
+                             unit_lst=unit_lst, \
+                             seed=seed, \
+                             n_workers=n_workers, \
+                             stateful=chunk_freq is not None, \
+                             rng_per_series=rng_per_series)
+    if chunk_freq is not None and plot:
+        print('Plots are skipped when simulating in time chunks.')
+        plot = False
+    written_file_lst = []
+    dh_writer = DataHistoryWriter(file_path=data_path + f'update_stream_dh_{experiment_name}', \
+                                  output_format=output_format, \
+                                  partition_by_id=partition_by_id, \
+                                  timestamp_unit=timestamp_unit, \
+                                  **(data_history_kwargs or {})) if save and data_history_format else None
+    for chunk_i, chunk_range in enumerate(chunk_range_lst):
+        verbose = chunk_i == 0
+        if chunk_range is not None:
+            print(f'Simulating time chunk #{chunk_i} starting from {chunk_range[0]}')
+        chunk_anomaly_label_lst = [anomaly_label.iloc[slice(*get_chunk_positions(anomaly_label.index, chunk_range))] \
+                                   for anomaly_label in anomaly_label_lst]
+        # Simulate all keys and data profiles, possibly in parallel
+        unit_df_dic = unit_runner.run(chunk_range=chunk_range)
+
+        # ### Part 3.1. Data Profile - Continuous
+        # Simulate Telemetry Time-series with Anomalies: 
+        # - First Simulate Time-series for Selected Source Nodes
+        # - Then Populate Time-series for the Rest Nodes from Topology Flow Top-down
+        update_stream_lst = []
+        if 'continuous' in profiles_included and not chunk_anomaly_label_lst[0].empty:
+            update_stream_continuous = pd.concat([unit_df_dic[('continuous', i)] \
+                                                  for i in range(len(simulate_ts_kwargs_continuous['key_name_lst']))])
+            update_stream_continuous['ModelId'] = gd.get_model_ids(update_stream_continuous['Id'])
+            update_stream_continuous = update_stream_continuous[['Id', 'ModelId', 'Key', 'Timestamp', 'Value']].sort_values(['Timestamp', 'Id', 'Key']).reset_index(drop=True)
+            update_stream_lst.append(update_stream_continuous)
+
+            if plot:
+                plot_ts(ts_df=update_stream_continuous, anomaly_label=anomaly_label_lst[0])
 
+            # Output Update_stream_continuous.csv, Topology_continuous.json & Topology_continuous.csv
+            if verbose:
+                generate_relationship_json(
+                    topo_df=gd.topo_df, 
+                    save=save, 
+                    output_data_path=data_path, 
+                    output_json_file_name=f'topology_continuous_{experiment_name}.json',
+                    output_csv_file_name=f'topology_continuous_{experiment_name}.csv'
+                    )
+            if save:
+                write_table_chunk(update_stream_continuous, data_path + f'update_stream_continuous_{experiment_name}', written_file_lst, \
+                                  output_format=output_format, partition_by_id=partition_by_id, timestamp_unit=timestamp_unit)
+            if verbose:
+                print('Sample Update_stream_continuous.csv:')
+                print(update_stream_continuous.head())
 
-    # # Add Pattern Anomalies
-    # timerange_str_lst = [['2021-01-07 11:00:00', '2021-01-07 14:00:00'], ['2021-01-08 11:00:00', '2021-01-08 14:00:00']]
+
+        # # Add Pattern Anomalies
+        # timerange_str_lst = [['2021-01-07 11:00:00', '2021-01-07 14:00:00'], ['2021-01-08 11:00:00', '2021-01-08 14:00:00']]
+        # anomaly_spec_df = pd.DataFrame([[Id, 'Amps_Ia', start, end, 'multiple', magnitude] \
+        #                                 for Id, magnitude in [('C', 10), ('D', 10), ('E', 1/100)] for start, end in timerange_str_lst], \
+        #                                columns=['Id', 'Key', 'start', 'end', 'type', 'magnitude'])
         
-    # update_stream_continuous = get_pattern_anomalies(update_stream_continuous, 'C', 'Amps_Ia', timerange_str_lst, ['multiple' for _ in range(len(timerange_str_lst))], [10 for _ in range(len(timerange_str_lst))])
-    # update_stream_continuous = get_pattern_anomalies(update_stream_continuous, 'D', 'Amps_Ia', timerange_str_lst, ['multiple' for _ in range(len(timerange_str_lst))], [10 for _ in range(len(timerange_str_lst))])
-    # update_stream_continuous = get_pattern_anomalies(update_stream_continuous, 'E', 'Amps_Ia', timerange_str_lst, ['multiple' for _ in range(len(timerange_str_lst))], [1/100 for _ in range(len(timerange_str_lst))])
+        # update_stream_continuous = add_pattern_anomalies(update_stream_continuous, anomaly_spec_df)
 
-    # if plot:
-    #     plot_ts(ts_df=update_stream_continuous, \
-    #             anomaly_label=anomaly_label_lst[0])
-
-
-    # ### Part 3.2. Data Profile - Categorical
-    # Simulate Categorical Time-series (e.g. PowerLevel as one of 'High'/'Mid'/'Low' for devices A & B)
-    if 'categorical' in profiles_included:
-        update_stream_categorical = get_cat_ts_df(
-            anomaly_label_lst=anomaly_label_lst,
-            num_simulated_ts=simulate_ts_kwargs_categorical['num_simulated_ts'],
-            freq_lst=simulate_ts_kwargs_categorical['freq_lst'],
-            id_name_lst=simulate_ts_kwargs_categorical['id_name_lst'],
-            key_name_lst=simulate_ts_kwargs_categorical['key_name_lst'],
-            cat_names_lst=simulate_ts_kwargs_categorical['cat_names_lst'],
-            cat_ratio_lst=simulate_ts_kwargs_categorical['cat_ratio_lst'],
-            missing_ratio_lst=simulate_ts_kwargs_categorical['missing_ratio_lst'],
-            timestamp_noise_lst=simulate_ts_kwargs_categorical['timestamp_noise_lst']
-            )
-        update_stream_categorical['ModelId'] = np.nan
-        for model_name, twins in init_graph_kwargs['model_twins_dic'].items():
-            update_stream_categorical.loc[update_stream_categorical['Id'].isin(twins), 'ModelId'] = model_json_dic[model_name]['@id']
-        update_stream_categorical = update_stream_categorical[['Id', 'ModelId', 'Key', 'Timestamp', 'Value']].sort_values(['Timestamp', 'Id', 'Key']).reset_index(drop=True)
-        update_stream = pd.concat([update_stream, update_stream_categorical])
+        # if plot:
+        #     plot_ts(ts_df=update_stream_continuous, \
+        #             anomaly_label=anomaly_label_lst[0])
+
+
+        # ### Part 3.2. Data Profile - Categorical
+        # Simulate Categorical Time-series (e.g. PowerLevel as one of 'High'/'Mid'/'Low' for devices A & B)
+        if 'categorical' in profiles_included:
+            update_stream_categorical = unit_df_dic[('categorical', None)]
+            update_stream_categorical['ModelId'] = gd.get_model_ids(update_stream_categorical['Id'])
+            update_stream_categorical = update_stream_categorical[['Id', 'ModelId', 'Key', 'Timestamp', 'Value']].sort_values(['Timestamp', 'Id', 'Key']).reset_index(drop=True)
+            update_stream_lst.append(update_stream_categorical)
         
-        if plot:
-            plot_ts(ts_df=update_stream_categorical,
-                    anomaly_label=anomaly_label_lst[0], 
-                    mode='markers')
-            print(update_stream_categorical)
+            if plot:
+                plot_ts(ts_df=update_stream_categorical,
+                        anomaly_label=anomaly_label_lst[0], 
+                        mode='markers')
+                print(update_stream_categorical)
                 
-        # Output Update_stream_categorical.csv
-        if save:
-            update_stream_categorical.to_csv(data_path + f'update_stream_categorical_{experiment_name}.csv', index=False)
-        print('Sample Update_stream_categorical.csv:')
-        print(update_stream_categorical.head())
-
-
-    # ### Part 3.3. Data Profile - Monotonic
-    # Simulate Monotonic Time-series based on Continuous Time-series
-    if 'monotonic' in profiles_included:
-        update_stream_monotonic  = pd.DataFrame()
-        for i in range(len(simulate_ts_kwargs_monotonic['key_name_lst'])):
-            tmp_monotonic_ts_df = get_monotonic_ts_df(
-                unique_anomaly_label=simulate_ts_kwargs_monotonic['unique_anomaly_label'],
-                anomaly_label_lst=anomaly_label_lst,
-                surge_start_end_indices_lst=surge_start_end_indices_lst, 
-                simulate_surge_lst=simulate_ts_kwargs_monotonic['simulate_surge_lst_lst'][i],
-                surge_ratio_range_lst=simulate_ts_kwargs_monotonic['surge_ratio_range_lst_lst'][i],
-                normal_mean_range_lst=simulate_ts_kwargs_monotonic['normal_mean_range_lst_lst'][i],
-                normal_std_lst=simulate_ts_kwargs_monotonic['normal_std_lst_lst'][i],
-                gd=gd,
-                key_name=simulate_ts_kwargs_monotonic['key_name_lst'][i],
-                missing_ratio=simulate_ts_kwargs_monotonic['missing_ratio_lst'][i],
-                value_noise=simulate_ts_kwargs_monotonic['value_noise_lst'][i],
-                timestamp_noise=simulate_ts_kwargs_monotonic['timestamp_noise_lst'][i]
-                )
-            update_stream_monotonic = pd.concat([update_stream_monotonic, tmp_monotonic_ts_df])
-        update_stream_monotonic['ModelId'] = np.nan
-        for model_name, twins in init_graph_kwargs['model_twins_dic'].items():
-            update_stream_monotonic.loc[update_stream_monotonic['Id'].isin(twins), 'ModelId'] = model_json_dic[model_name]['@id']
-        update_stream_monotonic = update_stream_monotonic[['Id', 'ModelId', 'Key', 'Timestamp', 'Value']].sort_values(['Timestamp', 'Id', 'Key']).reset_index(drop=True)
-        update_stream = pd.concat([update_stream, update_stream_monotonic])
-
-        if plot:
-            plot_ts(ts_df=update_stream_monotonic,
-                    anomaly_label=anomaly_label_lst[0])
-            print(update_stream_monotonic)
-
-        # Output Update_stream_monotonic.csv, Topology_monotonic.json & Topology_monotonic.csv
-        generate_relationship_json(
-            topo_df=gd.topo_df, 
-            save=save, 
-            output_data_path=data_path, 
-            output_json_file_name=f'topology_monotonic_{experiment_name}.json',
-            output_csv_file_name=f'topology_monotonic_{experiment_name}.csv'
-            )
-        if save:
-            update_stream_monotonic.to_csv(data_path + f'update_stream_monotonic_{experiment_name}.csv', index=False)
-        print('\nSample Update_stream_monotonic.csv:')
-        print(update_stream_monotonic.head())
-
-    # ### Part 3.4. Data Profile - Binary
-    # Simulate Binary Time-series
-    if 'binary' in profiles_included:
-        update_stream_binary = get_binary_ts_df(**simulate_ts_kwargs_binary)
-        print('Binary count for each Id:')
-        print(update_stream_binary.groupby('Id')['Value'].value_counts())
-        update_stream_binary['ModelId'] = np.nan
-        for model_name, twins in init_graph_kwargs['model_twins_dic'].items():
-            update_stream_binary.loc[update_stream_binary['Id'].isin(twins), 'ModelId'] = model_json_dic[model_name]['@id']
-        update_stream_binary = update_stream_binary[['Id', 'ModelId', 'Key', 'Timestamp', 'Value']].sort_values(['Timestamp', 'Id', 'Key']).reset_index(drop=True)
-        update_stream = pd.concat([update_stream, update_stream_binary])
-
-        if plot:
-            plot_ts(ts_df=update_stream_binary,
-                    anomaly_label=anomaly_label_lst[0])
-            print(update_stream_binary)
-
-        # Output: Update_stream_binary.csv
-        if save:
-            update_stream_binary.to_csv(data_path + f'update_stream_binary_{experiment_name}.csv', index=False)
-        print('Sample Update_stream_binary.csv:')
-        print(update_stream_binary.head(10))
-
-    # ### Part 3.5. Combine Different Data Profile of Same Timerange Together
-    if not update_stream.empty:
-        update_stream = update_stream.sort_values('Timestamp').reset_index(drop=True)
-        if plot:
-            plot_ts(ts_df=update_stream, \
-                    anomaly_label=anomaly_label_lst[0])
-        if save:
-            update_stream.to_csv(data_path + f'update_stream_{experiment_name}.csv', index=False)
-            print('Sample Update_stream.csv:')
-            print(update_stream.head(10))
+            # Output Update_stream_categorical.csv
+            if save:
+                write_table_chunk(update_stream_categorical, data_path + f'update_stream_categorical_{experiment_name}', written_file_lst, \
+                                  output_format=output_format, partition_by_id=partition_by_id, timestamp_unit=timestamp_unit)
+            if verbose:
+                print('Sample Update_stream_categorical.csv:')
+                print(update_stream_categorical.head())
+
+
+        # ### Part 3.3. Data Profile - Monotonic
+        # Simulate Monotonic Time-series based on Continuous Time-series
+        if 'monotonic' in profiles_included and not chunk_anomaly_label_lst[0].empty:
+            update_stream_monotonic = pd.concat([unit_df_dic[('monotonic', i)] \
+                                                 for i in range(len(simulate_ts_kwargs_monotonic['key_name_lst']))])
+            update_stream_monotonic['ModelId'] = gd.get_model_ids(update_stream_monotonic['Id'])
+            update_stream_monotonic = update_stream_monotonic[['Id', 'ModelId', 'Key', 'Timestamp', 'Value']].sort_values(['Timestamp', 'Id', 'Key']).reset_index(drop=True)
+            update_stream_lst.append(update_stream_monotonic)
+
+            if plot:
+                plot_ts(ts_df=update_stream_monotonic,
+                        anomaly_label=anomaly_label_lst[0])
+                print(update_stream_monotonic)
+
+            # Output Update_stream_monotonic.csv, Topology_monotonic.json & Topology_monotonic.csv
+            if verbose:
+                generate_relationship_json(
+                    topo_df=gd.topo_df, 
+                    save=save, 
+                    output_data_path=data_path, 
+                    output_json_file_name=f'topology_monotonic_{experiment_name}.json',
+                    output_csv_file_name=f'topology_monotonic_{experiment_name}.csv'
+                    )
+            if save:
+                write_table_chunk(update_stream_monotonic, data_path + f'update_stream_monotonic_{experiment_name}', written_file_lst, \
+                                  output_format=output_format, partition_by_id=partition_by_id, timestamp_unit=timestamp_unit)
+            if verbose:
+                print('\nSample Update_stream_monotonic.csv:')
+                print(update_stream_monotonic.head())
+
+        # ### Part 3.4. Data Profile - Binary
+        # Simulate Binary Time-series
+        if 'binary' in profiles_included:
+            update_stream_binary = unit_df_dic[('binary', None)]
+            if verbose:
+                print('Binary count for each Id:')
+                print(update_stream_binary.groupby('Id')['Value'].value_counts())
+            update_stream_binary['ModelId'] = gd.get_model_ids(update_stream_binary['Id'])
+            update_stream_binary = update_stream_binary[['Id', 'ModelId', 'Key', 'Timestamp', 'Value']].sort_values(['Timestamp', 'Id', 'Key']).reset_index(drop=True)
+            update_stream_lst.append(update_stream_binary)
+
+            if plot:
+                plot_ts(ts_df=update_stream_binary,
+                        anomaly_label=anomaly_label_lst[0])
+                print(update_stream_binary)
+
+            # Output: Update_stream_binary.csv
+            if save:
+                write_table_chunk(update_stream_binary, data_path + f'update_stream_binary_{experiment_name}', written_file_lst, \
+                                  output_format=output_format, partition_by_id=partition_by_id, timestamp_unit=timestamp_unit)
+            if verbose:
+                print('Sample Update_stream_binary.csv:')
+                print(update_stream_binary.head(10))
+
+        # ### Part 3.5. Combine Different Data Profile of Same Timerange Together
+        # Merge the streams of all data profiles, each already sorted by Timestamp
+        update_stream = merge_sorted_streams(df_lst=update_stream_lst, sort_col='Timestamp')
+        if not update_stream.empty:
+            if plot:
+                plot_ts(ts_df=update_stream, \
+                        anomaly_label=anomaly_label_lst[0])
+            if save:
+                write_table_chunk(update_stream, data_path + f'update_stream_{experiment_name}', written_file_lst, \
+                                  output_format=output_format, partition_by_id=partition_by_id, timestamp_unit=timestamp_unit)
+                if verbose:
+                    print('Sample Update_stream.csv:')
+                    print(update_stream.head(10))
+
+        # ### Part 4. Format Synthetic Data to get consistent with ADT Data History
+        # Formatted and written in batches, without copying the update stream as a whole
+        if data_history_format:
+            if dh_writer is not None:
+                dh_writer.write(update_stream)
+            if verbose and not update_stream.empty:
+                print('Sample Update_stream.csv In ADT Data History Format:')
+                print(data_history_formatter(df=update_stream.head(10)))
+    if dh_writer is not None:
+        dh_writer.close()
 
     # ### Part 3.6. Get Initial Twins
-    if not update_stream.empty:
-        initial_df = update_stream.loc[update_stream.groupby(['Id', 'Key'])['Timestamp'].idxmin()].reset_index(drop=True)
+    # Earliest record of each (Id, Key), captured while the data was simulated
+    initial_df = unit_runner.initial_df
+    unit_runner.close()
+    if initial_df is not None:
+        initial_df['ModelId'] = gd.get_model_ids(initial_df['Id'])
         initial_df = initial_df[['Id', 'ModelId', 'Key', 'Timestamp', 'Value']]\
                                 .sort_values(['Timestamp', 'Id', 'Key']).reset_index(drop=True)
         if save:
@@ -283,13 +383,6 @@ def main(
         print('Initial_twins.csv:')
         print(initial_df)
 
-    # ### Part 4. Format Synthetic Data to get consistent with ADT Data History
-    if data_history_format:
-        update_stream_dh = data_history_formatter(df=update_stream)
-        update_stream_dh.to_csv(data_path + f'update_stream_dh_{experiment_name}.csv', index=False)
-        print('Sample Update_stream.csv In ADT Data History Format:')
-        print(update_stream_dh.head(10))
-
 
 if __name__ == '__main__':
     with open('config.yaml', 'r') as stream:
@@ -1,8 +1,12 @@
 #!/usr/bin/env python
 # coding: utf-8
 
+import numpy as np
 import pandas as pd
-from datetime import datetime as dt
+
+# Columns of the table of pattern anomalies to add
+ANOMALY_SPEC_COLUMNS = ['Id', 'Key', 'start', 'end', 'type', 'magnitude']
+ANOMALY_TYPES = ['assign', 'multiple']
 
 def get_pattern_anomalies(df=None, \
                           Id=None, \
@@ -10,10 +14,11 @@ def get_pattern_anomalies(df=None, \
                           timerange_str_lst=None, \
                           anomalies_type_lst=None, \
                           magnitude_lst=None) -> pd.DataFrame:
-    
+
     """
     Add pattern anomalies to the simulated time-series in two ways, either 'assign' new values directly or modify the old values by multiplication.
     Either way it will break the topology relationships within a subset of graph for a period and thereby generate a pattern anomaly instead of single-point wise surge or drop.
+    To add pattern anomalies to several series at once, build a table of them and call add_pattern_anomalies() once instead.
 
     Parameters
     ----------
@@ -32,23 +37,96 @@ def get_pattern_anomalies(df=None, \
 
     Return
     ----------
-    ret_df : dataframe after pattern anomalies added, 
+    ret_df : dataframe after pattern anomalies added,
         pd.DataFrame
     """
     assert len(timerange_str_lst)==len(anomalies_type_lst)==len(magnitude_lst)
-    df['Timestamp'] = pd.to_datetime(df['Timestamp'])
-    timerange_lst = [[dt.strptime(timerange_str[0], '%Y-%m-%d %H:%M:%S'), dt.strptime(timerange_str[1], '%Y-%m-%d %H:%M:%S')] for timerange_str in timerange_str_lst]
-    df_changed = df[(df['Id']==Id) & (df['Key']==Key)].sort_values('Timestamp').reset_index(drop=True)
-    df_unchanged = df[(df['Id']!=Id) | (df['Key']!=Key)]
-    
-    for i, timerange in enumerate(timerange_lst):
-        timerange_indices = df_changed[(df_changed['Timestamp']>=timerange[0]) & \
-                                       (df_changed['Timestamp']<=timerange[1])].index
-        if anomalies_type_lst[i]=='assign':
-            df_changed.loc[timerange_indices, 'Value'] = magnitude_lst[i]
+    anomaly_spec_df = pd.DataFrame({'Id': Id, \
+                                    'Key': Key, \
+                                    'start': [timerange_str[0] for timerange_str in timerange_str_lst], \
+                                    'end': [timerange_str[1] for timerange_str in timerange_str_lst], \
+                                    'type': anomalies_type_lst, \
+                                    'magnitude': magnitude_lst}, columns=ANOMALY_SPEC_COLUMNS)
+    ret_df = add_pattern_anomalies(df=df, anomaly_spec_df=anomaly_spec_df)
+    if not ret_df['Timestamp'].is_monotonic_increasing:
+        ret_df = ret_df.sort_values('Timestamp', kind='stable').reset_index(drop=True)
+
+    return ret_df
+
+
+def add_pattern_anomalies(df=None, \
+                          anomaly_spec_df=None, \
+                          inplace=False) -> pd.DataFrame:
+    """
+    Add a batch of pattern anomalies, each on one series (Id, Key) over a period, as function get_pattern_anomalies() but in one pass over df:
+    the rows are ordered once by series then timestamp, so that the rows of each period are located by a binary search (searchsorted)
+    within the rows of its series, then all values are edited in one array written back to df. The rows of df keep their order.
+    Pattern anomalies are applied in the order of anomaly_spec_df, e.g. a 'multiple' after an 'assign' on overlapping periods scales the assigned value.
+
+    Parameters
+    ----------
+    df : dataframe before pattern anomalies addition, with columns including ['Id', 'Key', 'Timestamp', 'Value'],
+        pd.DataFrame
+    anomaly_spec_df : one row per pattern anomaly with columns ['Id', 'Key', 'start', 'end', 'type', 'magnitude'],
+        where [start, end] is the period (both included, as str or Timestamp), type is 'assign' to assign the magnitude as value
+        or 'multiple' to multiply the values by the magnitude, pattern anomalies on series absent from df are ignored,
+        pd.DataFrame (e.g. pd.DataFrame({'Id': ['C', 'E'], 'Key': ['Amps_Ia', 'Amps_Ia'], 'start': ['2021-01-07 11:00:00', '2021-01-07 11:00:00'],
+                                         'end': ['2021-01-07 14:00:00', '2021-01-07 14:00:00'], 'type': ['multiple', 'assign'], 'magnitude': [10, 0]}))
+    inplace : whether to edit the Value column of df itself rather than of a copy,
+        bool, default=False
+
+    Return
+    ----------
+    ret_df : dataframe after pattern anomalies added,
+        pd.DataFrame
+    """
+    missing_col_lst = [col for col in ANOMALY_SPEC_COLUMNS if col not in anomaly_spec_df.columns]
+    if len(missing_col_lst) > 0:
+        raise ValueError(f'anomaly_spec_df is missing the columns {missing_col_lst}')
+    unknown_type_lst = sorted(set(anomaly_spec_df['type']) - set(ANOMALY_TYPES))
+    if len(unknown_type_lst) > 0:
+        raise ValueError(f"Unknown pattern anomaly types {unknown_type_lst}, please use 'assign' or 'multiple'")
+    ret_df = df if inplace else df.copy()
+    if not pd.api.types.is_datetime64_any_dtype(ret_df['Timestamp']):
+        ret_df['Timestamp'] = pd.to_datetime(ret_df['Timestamp'])
+    if anomaly_spec_df.empty or ret_df.empty:
+        return ret_df
+
+    # Sorted index: positions of the rows ordered by series then timestamp, each series holding a contiguous block of it
+    id_codes, id_uniques = pd.factorize(ret_df['Id'])
+    key_codes, key_uniques = pd.factorize(ret_df['Key'])
+    series_codes = id_codes.astype(np.int64) * len(key_uniques) + key_codes
+    timestamps_ns = ret_df['Timestamp'].values.view(np.int64)
+    order = np.lexsort((timestamps_ns, series_codes))
+    sorted_series_codes = series_codes[order]
+    sorted_timestamps_ns = timestamps_ns[order]
+
+    # Block of the series of each pattern anomaly, empty if the series is absent from df
+    spec_id_codes = id_uniques.get_indexer(anomaly_spec_df['Id'])
+    spec_key_codes = key_uniques.get_indexer(anomaly_spec_df['Key'])
+    spec_series_codes = np.where((spec_id_codes >= 0) & (spec_key_codes >= 0), \
+                                 spec_id_codes.astype(np.int64) * len(key_uniques) + spec_key_codes, -1)
+    block_starts = np.searchsorted(sorted_series_codes, spec_series_codes, side='left')
+    block_ends = np.searchsorted(sorted_series_codes, spec_series_codes, side='right')
+    start_ns = pd.to_datetime(anomaly_spec_df['start']).values.view(np.int64)
+    end_ns = pd.to_datetime(anomaly_spec_df['end']).values.view(np.int64)
+
+    magnitudes = anomaly_spec_df['magnitude'].to_numpy()
+    values = ret_df['Value'].to_numpy()
+    if pd.api.types.is_numeric_dtype(values.dtype):
+        # Upcast e.g. integer counters multiplied by a fraction
+        values = values.astype(np.result_type(values.dtype, magnitudes.dtype))
+    else:
+        values = values.astype(object)
+    for block_start, block_end, period_start, period_end, anomalies_type, magnitude in \
+            zip(block_starts, block_ends, start_ns, end_ns, anomaly_spec_df['type'], magnitudes):
+        block_timestamps_ns = sorted_timestamps_ns[block_start:block_end]
+        positions = order[block_start + np.searchsorted(block_timestamps_ns, period_start, side='left'): \
+                          block_start + np.searchsorted(block_timestamps_ns, period_end, side='right')]
+        if anomalies_type == 'assign':
+            values[positions] = magnitude
         else:
-            df_changed.loc[timerange_indices, 'Value'] = magnitude_lst[i] * df_changed.loc[timerange_indices, 'Value']
-    ret_df = pd.concat([df_changed, df_unchanged]).sort_values('Timestamp').reset_index(drop=True)
-    
+            values[positions] = magnitude * values[positions]
+    ret_df['Value'] = values
+
     return ret_df
-    
\ No newline at end of file
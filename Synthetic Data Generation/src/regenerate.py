@@ -0,0 +1,191 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+import argparse
+import numpy as np
+import pandas as pd
+pd.options.mode.chained_assignment = None
+import yaml
+from main import get_graph_dataset, get_csv_timestamp_unit
+from simulation_anomalylabels import simulate_anomaly_labels
+from simulation_parallel import get_unit_lst, UnitRunner
+from data_history_formatter import DataHistoryWriter
+from utils.utils_data_generation import get_chunk_ranges, merge_sorted_streams, update_initial_records
+from utils.utils_output import write_table_chunk
+
+def regenerate(
+    id_lst=None, \
+    key_lst=None, \
+    experiment_name=None, \
+    profiles_included = ['continuous', 'categorical', 'monotonic', 'binary'], \
+    seed=2022, \
+    init_graph_kwargs=None, \
+    simulate_anomaly_labels_kwargs=None, \
+    simulate_ts_kwargs_continuous=None, \
+    simulate_ts_kwargs_categorical=None, \
+    simulate_ts_kwargs_monotonic=None, \
+    simulate_ts_kwargs_binary=None, \
+    data_history_format=True, \
+    data_history_kwargs=None, \
+    chunk_freq=None, \
+    n_workers=None, \
+    output_format='csv', \
+    rng_per_series=False, \
+    timestamp_unit=None, \
+    **kwargs
+    ) -> None:
+    """
+    Regenerate selected series of an existing synthetic dataset and splice them into its outputs, without regenerating the whole dataset,
+    e.g. after changing the config of a key. As each (profile, Id, Key) series draws from its own random generator derived from the seed
+    and the series, series left unchanged are regenerated exactly as they were simulated by function main().
+    The continuous and monotonic keys are simulated for all twins at once (the topology flow ties them together),
+    then only the rows of the selected twins are spliced.
+
+    Parameters
+    ----------
+    id_lst : Ids of the series to regenerate, if not given then all Ids of the selected keys,
+        list of str (e.g. ['A', 'B'])
+    key_lst : Keys of the series to regenerate, if not given then all Keys of the selected Ids,
+        list of str (e.g. ['PowerMeter'])
+    rng_per_series : must be set, as the dataset must have been simulated with rng_per_series,
+        bool
+    output_format : must be 'csv', only csv outputs can be spliced,
+        str
+    Other params refer to function main(), with the same config as the dataset, apart from the changes to regenerate.
+
+    Return
+    ----------
+    None
+    """
+    if not rng_per_series:
+        raise ValueError('Series can only be regenerated from a dataset simulated with rng_per_series set')
+    if output_format != 'csv':
+        raise ValueError(f"Series can only be spliced into csv outputs, not '{output_format}'")
+    data_path = f'../data/synthetic_data/{experiment_name}/'
+    # The anomaly labels are drawn from the global random state as in function main()
+    np.random.seed(seed)
+    gd = get_graph_dataset(init_graph_kwargs=init_graph_kwargs)
+    anomaly_label_lst, surge_start_end_indices_lst = simulate_anomaly_labels(**simulate_anomaly_labels_kwargs, compact=chunk_freq is not None)
+
+    # Only simulate the keys (continuous, monotonic) and sensors (categorical, binary) holding selected series
+    simulate_ts_kwargs_dic = {'continuous': simulate_ts_kwargs_continuous, \
+                              'categorical': simulate_ts_kwargs_categorical, \
+                              'monotonic': simulate_ts_kwargs_monotonic, \
+                              'binary': simulate_ts_kwargs_binary}
+    if timestamp_unit is None:
+        timestamp_unit = get_csv_timestamp_unit(profiles_included=profiles_included, \
+                                                simulate_anomaly_labels_kwargs=simulate_anomaly_labels_kwargs, \
+                                                simulate_ts_kwargs_dic=simulate_ts_kwargs_dic)
+    selected_kwargs_dic = {profile: select_series_kwargs(profile, simulate_ts_kwargs_dic[profile], id_lst, key_lst) \
+                           for profile in profiles_included}
+    selected_profile_lst = [profile for profile in profiles_included if selected_kwargs_dic[profile] is not None]
+    if len(selected_profile_lst) == 0:
+        print('No series selected.')
+        return
+    unit_lst = get_unit_lst(profiles_included=selected_profile_lst, simulate_ts_kwargs_dic=selected_kwargs_dic)
+    unit_runner = UnitRunner(gd=gd, \
+                             anomaly_label_lst=anomaly_label_lst, \
+                             surge_start_end_indices_lst=surge_start_end_indices_lst, \
+                             simulate_ts_kwargs_dic=selected_kwargs_dic, \
+                             unit_lst=unit_lst, \
+                             seed=seed, \
+                             n_workers=n_workers, \
+                             stateful=chunk_freq is not None, \
+                             rng_per_series=True)
+    chunk_range_lst = get_chunk_ranges(time_range=[anomaly_label_lst[0].index[0], anomaly_label_lst[0].index[-1]], \
+                                       chunk_freq=chunk_freq)
+    profile_df_lst_dic = {profile: [] for profile in selected_profile_lst}
+    for chunk_i, chunk_range in enumerate(chunk_range_lst):
+        if chunk_range is not None:
+            print(f'Regenerating time chunk #{chunk_i} starting from {chunk_range[0]}')
+        for (profile, _), unit_df in unit_runner.run(chunk_range=chunk_range).items():
+            if unit_df is not None:
+                profile_df_lst_dic[profile].append(unit_df[_is_selected(unit_df, id_lst, key_lst)])
+    unit_runner.close()
+
+    # Splice the regenerated series into the stream of each data profile
+    update_stream_lst = []
+    for profile in profiles_included:
+        file_path = data_path + f'update_stream_{profile}_{experiment_name}'
+        update_stream_profile = pd.read_csv(file_path + '.csv', parse_dates=['Timestamp'], float_precision='round_trip')
+        if profile in selected_profile_lst:
+            regenerated_df = pd.concat(profile_df_lst_dic[profile], ignore_index=True)
+            regenerated_df['ModelId'] = gd.get_model_ids(regenerated_df['Id'])
+            update_stream_profile = pd.concat([update_stream_profile[~_is_selected(update_stream_profile, id_lst, key_lst)], \
+                                               regenerated_df[['Id', 'ModelId', 'Key', 'Timestamp', 'Value']]], ignore_index=True)
+            update_stream_profile = update_stream_profile.sort_values(['Timestamp', 'Id', 'Key'], kind='stable').reset_index(drop=True)
+            write_table_chunk(update_stream_profile, file_path, [], timestamp_unit=timestamp_unit)
+            print(f'Spliced {regenerated_df.shape[0]} regenerated rows into {file_path}.csv')
+        update_stream_lst.append(update_stream_profile)
+
+    # Rebuild the combined stream, the Data History format and the initial twins from the streams of all data profiles
+    update_stream = merge_sorted_streams(df_lst=update_stream_lst, sort_col='Timestamp')
+    write_table_chunk(update_stream, data_path + f'update_stream_{experiment_name}', [], timestamp_unit=timestamp_unit)
+    if data_history_format:
+        dh_writer = DataHistoryWriter(file_path=data_path + f'update_stream_dh_{experiment_name}', timestamp_unit=timestamp_unit, \
+                                      **(data_history_kwargs or {}))
+        dh_writer.write(update_stream)
+        dh_writer.close()
+    initial_df = update_initial_records(df=update_stream)
+    initial_df = initial_df[['Id', 'ModelId', 'Key', 'Timestamp', 'Value']].sort_values(['Timestamp', 'Id', 'Key']).reset_index(drop=True)
+    initial_df.to_csv(data_path + f'initial_twins_{experiment_name}.csv', index=False)
+    print('Initial_twins.csv:')
+    print(initial_df)
+
+
+def select_series_kwargs(profile=None, simulate_ts_kwargs=None, id_lst=None, key_lst=None) -> dict:
+    """
+    Restrict the keyword arguments of a data profile to the keys (continuous, monotonic) or sensors (categorical, binary) holding selected series.
+    Following the naming of the keyword arguments, every list ending with '_lst' holds one entry per key or per sensor.
+
+    Parameters
+    ----------
+    profile : data profile,
+        str (e.g. 'continuous')
+    simulate_ts_kwargs : keyword arguments for synthetic data generation of the data profile,
+        dict
+    id_lst : Ids of the series to regenerate, if not given then all Ids,
+        list of str
+    key_lst : Keys of the series to regenerate, if not given then all Keys,
+        list of str
+
+    Return
+    ----------
+    selected_kwargs : keyword arguments restricted to the selected keys or sensors, or None if none is selected,
+        dict
+    """
+    key_name_lst = simulate_ts_kwargs['key_name_lst']
+    if profile in ['continuous', 'monotonic']:
+        # Every twin holds every key of the profile
+        selected_indices = [i for i, key_name in enumerate(key_name_lst) if key_lst is None or key_name in key_lst]
+    else:
+        selected_indices = [i for i, (id_name, key_name) in enumerate(zip(simulate_ts_kwargs['id_name_lst'], key_name_lst)) \
+                            if (id_lst is None or id_name in id_lst) and (key_lst is None or key_name in key_lst)]
+    if len(selected_indices) == 0:
+        return None
+    selected_kwargs = {name: [value[i] for i in selected_indices] if name.endswith('_lst') else value \
+                       for name, value in simulate_ts_kwargs.items()}
+    if 'num_simulated_ts' in selected_kwargs:
+        selected_kwargs['num_simulated_ts'] = len(selected_indices)
+    return selected_kwargs
+
+
+def _is_selected(df=None, id_lst=None, key_lst=None) -> pd.Series:
+    """Helper function to flag the rows of selected series"""
+    is_selected = pd.Series(True, index=df.index)
+    if id_lst is not None:
+        is_selected &= df['Id'].isin(id_lst)
+    if key_lst is not None:
+        is_selected &= df['Key'].isin(key_lst)
+    return is_selected
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Regenerate selected series of the dataset simulated with config.yaml and splice them into its outputs.')
+    parser.add_argument('--ids', nargs='+', default=None, help='Ids of the series to regenerate, all Ids if not given')
+    parser.add_argument('--keys', nargs='+', default=None, help='Keys of the series to regenerate, all Keys if not given')
+    args = parser.parse_args()
+    with open('config.yaml', 'r') as stream:
+        config = yaml.safe_load(stream)
+
+    regenerate(id_lst=args.ids, key_lst=args.keys, **config)
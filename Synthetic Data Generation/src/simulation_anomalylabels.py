@@ -4,9 +4,13 @@
 import numpy as np
 import pandas as pd
 pd.options.mode.chained_assignment = None
-from datetime import datetime as dt
 from numpy.random import uniform
 from utils.utils_data_generation import get_random_time_between
+from utils.utils_calendar import get_calendar, get_index_calendar
+from utils.utils_output import format_timestamps, get_timestamp_unit
+
+# Number of rows of anomaly labels expanded and written at once by function write_anomaly_label_csv()
+DEFAULT_BATCH_ROWS = 100000
 
 def simulate_anomaly_labels(num_simulated_anomaly_ts=None, \
                             time_range_lst=None, \
@@ -14,7 +18,8 @@ def simulate_anomaly_labels(num_simulated_anomaly_ts=None, \
                             start_of_day_range_lst=None, \
                             end_of_day_range_lst=None, \
                             surge_occurrence_range_lst=None, \
-                            surge_length_range_lst=None) -> tuple:
+                            surge_length_range_lst=None, \
+                            compact=False) -> tuple:
     """
     Simulate binary anomaly label series.
 
@@ -34,11 +39,15 @@ def simulate_anomaly_labels(num_simulated_anomaly_ts=None, \
         list of list of int (e.g. [[5, 7] for _ in range(2)])
     surge_length_range_lst : list of range of surge duration, in terms of number of consecutive timestamps for each anomaly label series,
         list of list of int (e.g. [[5, 10] for _ in range(2)])
+    compact : whether to keep the anomaly labels compact, e.g. when simulating in time chunks, see function get_anomaly_label_df(),
+        the calendar of the entire time range being then freed rather than cached,
+        bool, default=False
 
     Return
     ----------
     Tuple of (anomaly_label_lst, surge_start_end_indices_lst)
-    anomaly_label_lst : list of anomaly label series simulated, each as dataframe with columns=['date', 'isAnomaly', 'isOffHour'] and Timestamp as index,
+    anomaly_label_lst : list of anomaly label series simulated, each as dataframe with columns=['date', 'isAnomaly', 'isOffHour'] and Timestamp as index
+        (or only ['isAnomaly', 'isOffHour'] if compact),
         list of DataFrame
     surge_start_end_indices_lst : list of start and end timestamps for each surge occurrence for each anomaly label series,
         list of list of of list of Timestamps (e.g. [
@@ -58,44 +67,103 @@ def simulate_anomaly_labels(num_simulated_anomaly_ts=None, \
                                                                                                              surge_occurrence_range_lst[ts_i], \
                                                                                                              surge_length_range_lst[ts_i]
         print(f'Simulating Anomaly Labels for #{ts_i}...')
-        anomaly_label = pd.DataFrame(columns=['Timestamp'], \
-                                    data=pd.date_range(time_range[0], time_range[1], freq=freq))
-        anomaly_label['date'] = anomaly_label['Timestamp'].dt.date
-        anomaly_label['isAnomaly'] = 0
+        calendar = get_calendar(time_range, freq, cached=not compact)
+        timestamps, timestamps_ns = calendar.timestamps, calendar.timestamps_ns
 
         # Simulate start and end time of weekday
         start_of_day_str, end_of_day_str = get_random_time_between(start_of_day_range[0], start_of_day_range[1]), \
                                            get_random_time_between(end_of_day_range[0], end_of_day_range[1])
-        start_of_day, end_of_day = dt.strptime(start_of_day_str, '%H:%M:%S').time(),\
-                                   dt.strptime(end_of_day_str, '%H:%M:%S').time()
-        # print(f'For Labels: Simulated Start & End of Weekday: {start_of_day}, {end_of_day}')
-        # Differentiate on-hour and off-hour
-        on_hours = anomaly_label[~(anomaly_label['Timestamp'].dt.weekday.isin([5,6])) \
-                                 &(anomaly_label['Timestamp'].dt.time>=start_of_day) \
-                                 &(anomaly_label['Timestamp'].dt.time<=end_of_day)].reset_index(drop=True)
-        off_hours = anomaly_label[(anomaly_label['Timestamp'].dt.weekday.isin([5,6])) \
-                                  |(anomaly_label['Timestamp'].dt.time<start_of_day)\
-                                  |(anomaly_label['Timestamp'].dt.time>end_of_day)].set_index('Timestamp')
-        on_hours['isOffHour'], off_hours['isOffHour'] = False, True
+        # print(f'For Labels: Simulated Start & End of Weekday: {start_of_day_str}, {end_of_day_str}')
+        # Differentiate on-hour and off-hour on the integer weekday and time-of-day codes of the shared calendar
+        is_off_hour = calendar.get_off_hour_mask(start_of_day_str, end_of_day_str)
+        on_hour_positions = np.flatnonzero(~is_off_hour)
         # Simulate the number of surges
         surge_occurrence = int(uniform(surge_occurrence_range[0], surge_occurrence_range[1]+1, 1))
-        # Simulate the numerical indices when surges start
-        surge_start_indices = np.sort(np.random.choice(on_hours.shape[0], surge_occurrence))
+        # Simulate the numerical indices (among on-hours) when surges start
+        surge_start_indices = np.sort(np.random.choice(on_hour_positions.shape[0], surge_occurrence))
         # Simulate the duration of each surge
         surge_lengths = uniform(surge_length_range[0], surge_length_range[1], surge_occurrence)
+        # Each surge covers on-hours [start, floor(start+length-1)], clipped to the last on-hour
+        surge_end_indices = np.clip(np.floor(surge_start_indices + surge_lengths - 1).astype(np.int64), \
+                                    surge_start_indices, on_hour_positions.shape[0] - 1)
+        # Map surge boundaries back onto positions of the full time range, then paint all surges at once:
+        # every timestamp between surge start and end is anomalous, including off-hours in between
+        surge_start_positions, surge_end_positions = on_hour_positions[surge_start_indices], \
+                                                     on_hour_positions[surge_end_indices]
+        surge_coverage = np.zeros(timestamps_ns.shape[0] + 1, dtype=np.int64)
+        np.add.at(surge_coverage, surge_start_positions, 1)
+        np.add.at(surge_coverage, surge_end_positions + 1, -1)
+        is_anomaly = np.zeros(timestamps_ns.shape[0], dtype=np.int64)
+        is_anomaly[np.cumsum(surge_coverage[:-1]) > 0] = 1
         # Get start and end timestamps for each surge occurrence
-        surge_start_end_indices = []
-        for j in range(surge_occurrence):
-            on_hours.loc[surge_start_indices[j]:surge_start_indices[j]+surge_lengths[j]-1, 'isAnomaly'] = 1
-            tmp_on_hours = on_hours.loc[surge_start_indices[j]:surge_start_indices[j]+surge_lengths[j]-1]
-            surge_start_end_indices.append([tmp_on_hours['Timestamp'].iloc[0], tmp_on_hours['Timestamp'].iloc[-1]])
-        on_hours = on_hours.set_index('Timestamp')
-        # Combine on-hour and off-hour for anomaly label and sort by timestamp
-        anomaly_label = pd.concat([on_hours, off_hours]).sort_index()
-        for k in range(surge_occurrence):
-            anomaly_label.loc[surge_start_end_indices[k][0]: surge_start_end_indices[k][1], 'isAnomaly'] = 1
+        surge_start_end_indices = [[timestamps[surge_start_positions[j]], timestamps[surge_end_positions[j]]] \
+                                   for j in range(surge_occurrence)]
+        anomaly_label = get_anomaly_label_df(timestamps, is_anomaly, is_off_hour, compact=compact)
         anomaly_label_lst.append(anomaly_label)
         surge_start_end_indices_lst.append(surge_start_end_indices)
         print(f'#{ts_i} Anomaly Labels Simulation Done.')
 
     return anomaly_label_lst, surge_start_end_indices_lst
+
+
+def get_anomaly_label_df(timestamps=None, is_anomaly=None, is_off_hour=None, compact=False, cached=True) -> pd.DataFrame:
+    """
+    Assemble an anomaly label series from its timestamps and label arrays, e.g. to rebuild it from arrays shared with worker processes.
+
+    Parameters
+    ----------
+    timestamps : sorted timestamps of the anomaly label series,
+        pd.DatetimeIndex
+    is_anomaly : 1 for anomalous timestamps else 0,
+        np.array of int
+    is_off_hour : True for timestamps out of business hours,
+        np.array of bool
+    compact : whether to leave out the date column (one object per timestamp) and store isAnomaly as int8, i.e. 10 bytes per timestamp with the index,
+        so that the anomaly labels of long time ranges stay small when simulating in time chunks,
+        bool, default=False
+    cached : whether to get the calendar of the date column from the cache (see function get_index_calendar()),
+        bool, default=True
+
+    Return
+    ----------
+    anomaly_label : anomaly label series with columns=['date', 'isAnomaly', 'isOffHour'] (or only ['isAnomaly', 'isOffHour'] if compact) and Timestamp as index,
+        pd.DataFrame
+    """
+    if compact:
+        return pd.DataFrame({'isAnomaly': is_anomaly.astype(np.int8), \
+                             'isOffHour': is_off_hour}, \
+                            index=timestamps)
+    calendar = get_index_calendar(timestamps, cached=cached)
+    return pd.DataFrame({'date': calendar.dates[calendar.day_idx], \
+                         'isAnomaly': is_anomaly, \
+                         'isOffHour': is_off_hour}, \
+                        index=timestamps)
+
+
+def write_anomaly_label_csv(anomaly_label=None, file_path=None, batch_rows=DEFAULT_BATCH_ROWS) -> None:
+    """
+    Write an anomaly label series as anomaly_label.reset_index().to_csv(file_path, index=False) would, with columns=['Timestamp', 'date', 'isAnomaly', 'isOffHour'],
+    batch by batch so that compact anomaly labels are only expanded (see function get_anomaly_label_df()) a batch at a time.
+    All batches share the timestamp format of the entire series.
+
+    Parameters
+    ----------
+    anomaly_label : anomaly label series from function simulate_anomaly_labels(), compact or not,
+        pd.DataFrame
+    file_path : path of the csv file,
+        str
+    batch_rows : number of rows expanded and written at once,
+        int, default=100000
+
+    Return
+    ----------
+    None
+    """
+    timestamp_unit = get_timestamp_unit(anomaly_label.index.asi8)
+    with open(file_path, 'w', newline='') as f:
+        for start in range(0, max(anomaly_label.shape[0], 1), batch_rows):
+            batch = anomaly_label.iloc[start: start + batch_rows]
+            # Calendars of batches are not cached, as they are used once and would push the calendars of the time chunks out of the cache
+            batch_df = get_anomaly_label_df(batch.index, batch['isAnomaly'].values, batch['isOffHour'].values, cached=False).reset_index()
+            batch_df['Timestamp'] = format_timestamps(batch_df['Timestamp'].values, unit=timestamp_unit)
+            batch_df.to_csv(f, index=False, header=start == 0)
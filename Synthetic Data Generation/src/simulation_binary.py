@@ -3,9 +3,8 @@
 
 import pandas as pd
 import numpy as np
-from datetime import datetime as dt
-from numpy.random import uniform
-from utils.utils_data_generation import add_timestamp_noise, random_drop_rows, get_random_time_between
+from utils.utils_data_generation import get_timestamp_noise, get_keep_positions, get_random_time_between, get_chunk_ranges
+from utils.utils_calendar import get_calendar
 
 def get_binary_ts_df(num_simulated_ts=1, \
                      time_range_lst=None, \
@@ -17,7 +16,11 @@ def get_binary_ts_df(num_simulated_ts=1, \
                      on_occurrence_range_lst=None, \
                      on_length_range_lst=None, \
                      missing_ratio_lst=[0], \
-                     timestamp_noise_lst=[False]) -> pd.DataFrame:
+                     timestamp_noise_lst=[False], \
+                     chunk_range=None, \
+                     state=None, \
+                     rng=None, \
+                     series_rng=None) -> pd.DataFrame:
     """
     Get simulated binary time-series dataframe for selected sensors.
 
@@ -45,13 +48,24 @@ def get_binary_ts_df(num_simulated_ts=1, \
         list of float, default=[0]
     timestamp_noise_lst : list of indicator of whether to add noise (e.g. fractions of seconds) into timestamp,
         list of bool, default=[False]
+    chunk_range : [start, end) timestamps of the time chunk to simulate, from function get_chunk_ranges(), if not given then simulate the entire time range,
+        list of Timestamps, optional
+    state : running state of each binary series carried across consecutive time chunks, e.g. the 'ON' status spilling over into the next chunk, updated in place,
+        dict, optional
+    rng : random generator to draw from, if not given then draw from the global numpy random state,
+        np.random.Generator, optional
+    series_rng : random generators of all series of the data profile, called with (id_name, key_name),
+        if given then each series draws from its own generator instead of rng,
+        SeriesRng, optional
 
     Return
     ----------
     ret_binary_ts_df : simulated binary time-series dataframe for selected sensors with columns=['Timestamp', 'Id', 'Value', 'Key'], 
         pd.DataFrame
     """
-    ret_binary_ts_df = pd.DataFrame()
+    rng = np.random if rng is None else rng
+    # Columns of all sensors, concatenated into a single dataframe at the end
+    timestamp_lst, value_lst, num_rows_lst = [], [], []
     for sensor in range(num_simulated_ts):
         time_range, freq, id_name, key_name, start_of_day_range, end_of_day_range, on_occurrence_range, on_length_range, missing_ratio, timestamp_noise = time_range_lst[sensor], \
                                                                                                                                                           freq_lst[sensor], \
@@ -63,49 +77,101 @@ def get_binary_ts_df(num_simulated_ts=1, \
                                                                                                                                                           on_length_range_lst[sensor], \
                                                                                                                                                           missing_ratio_lst[sensor], \
                                                                                                                                                           timestamp_noise_lst[sensor]
+        if series_rng is not None:
+            rng = series_rng(id_name, key_name)
+        sensor_state = state.setdefault(sensor, {}) if state is not None else {}
         print(f'Simulating Binary Labels for Sensor {sensor}...')
-        binary_ts_df = pd.DataFrame(columns=['Timestamp'], \
-                                    data=pd.date_range(time_range[0], time_range[1], freq=freq))
-        binary_ts_df['date'] = binary_ts_df['Timestamp'].dt.date
-        binary_ts_df['Id'] = id_name
-        binary_ts_df['Key'] = key_name
-        binary_ts_df['Value'] = 0
+        calendar = get_calendar(time_range, freq, chunk_range)
+        timestamps = calendar.timestamps
 
-        # Simulate start and end time of weekday
-        start_of_day_str, end_of_day_str = get_random_time_between(start_of_day_range[0], start_of_day_range[1]), \
-                                           get_random_time_between(end_of_day_range[0], end_of_day_range[1])
-        start_of_day, end_of_day = dt.strptime(start_of_day_str, '%H:%M:%S').time(),\
-                                   dt.strptime(end_of_day_str, '%H:%M:%S').time()
-        # print(f'For Binary TS: Simulated Start & End of Weekday: {start_of_day}, {end_of_day}')
+        if 'start_of_day_str' not in sensor_state:
+            # Simulate start and end time of weekday
+            sensor_state['start_of_day_str'], sensor_state['end_of_day_str'] = get_random_time_between(start_of_day_range[0], start_of_day_range[1], rng), \
+                                                                               get_random_time_between(end_of_day_range[0], end_of_day_range[1], rng)
+            # print(f'For Binary TS: Simulated Start & End of Weekday: {sensor_state["start_of_day_str"]}, {sensor_state["end_of_day_str"]}')
         # Differentiate on-hour and off-hour
-        on_hours = binary_ts_df[~(binary_ts_df['Timestamp'].dt.weekday.isin([5,6])) \
-                                &(binary_ts_df['Timestamp'].dt.time>=start_of_day) \
-                                &(binary_ts_df['Timestamp'].dt.time<=end_of_day)].reset_index(drop=True)
-        off_hours = binary_ts_df[(binary_ts_df['Timestamp'].dt.weekday.isin([5,6])) \
-                                 |(binary_ts_df['Timestamp'].dt.time<start_of_day)\
-                                 |(binary_ts_df['Timestamp'].dt.time>end_of_day)].set_index('Timestamp')
-        on_hours['isOffHour'], off_hours['isOffHour'] = False, True
-        # Simulate the number of being on
-        on_occurrence = int(uniform(on_occurrence_range[0], on_occurrence_range[1]+1, 1))
-        # Simulate the numerical indices when device is turned on
-        on_start_indices = np.sort(np.random.choice(on_hours.shape[0], on_occurrence))
+        on_hour_positions = np.flatnonzero(~calendar.get_off_hour_mask(sensor_state['start_of_day_str'], sensor_state['end_of_day_str']))
+        num_on_hours = on_hour_positions.shape[0]
+        if 'on_occurrence_left' not in sensor_state:
+            # Simulate the number of being on, over the entire time range
+            sensor_state['on_occurrence_left'] = int(rng.uniform(on_occurrence_range[0], on_occurrence_range[1]+1, 1))
+            sensor_state['num_on_hours_left'] = num_on_hours if chunk_range is None else \
+                                                _count_on_hours(time_range, freq, chunk_range, sensor_state['start_of_day_str'], sensor_state['end_of_day_str'])
+            sensor_state['num_on_carry'] = 0
+        # Share of the 'ON' occurrences starting in this time chunk (all of them without time chunks)
+        if num_on_hours >= sensor_state['num_on_hours_left']:
+            on_occurrence = sensor_state['on_occurrence_left']
+        else:
+            on_occurrence = rng.binomial(sensor_state['on_occurrence_left'], num_on_hours / sensor_state['num_on_hours_left'])
+        # Simulate the numerical indices (among on-hours) when device is turned on
+        on_start_indices = np.sort(rng.choice(num_on_hours, on_occurrence)) if on_occurrence > 0 else np.zeros(0, dtype=np.int64)
         # Simulate the duration of each 'ON' status
-        on_lengths = uniform(on_length_range[0], on_length_range[1], on_occurrence)
-        # Simulate the binary ts
-        for j in range(on_occurrence):
-            on_hours.loc[on_start_indices[j]:on_start_indices[j]+on_lengths[j]-1, 'Value'] = 1
-        on_hours = on_hours.set_index('Timestamp')
-        # Combine on-hour and off-hour for anomaly label and sort by timestamp
-        binary_ts_df = pd.concat([on_hours, off_hours]).sort_index().reset_index()
-        
+        on_lengths = rng.uniform(on_length_range[0], on_length_range[1], on_occurrence)
+        # Each 'ON' status covers on-hours [start, floor(start+length-1)], possibly spilling over into the next time chunk
+        on_end_indices = np.floor(on_start_indices + on_lengths - 1).astype(np.int64)
+        # Simulate the binary ts, continuing the 'ON' status carried over from the previous time chunk
+        value = np.zeros(timestamps.shape[0], dtype=np.int64)
+        value[on_hour_positions] = paint_on_intervals(num_on_hours, \
+                                                      np.append(0, on_start_indices), \
+                                                      np.append(sensor_state['num_on_carry']-1, on_end_indices))
+        sensor_state['num_on_carry'] = int(max(sensor_state['num_on_carry'] - num_on_hours, \
+                                               np.max(on_end_indices + 1 - num_on_hours, initial=0)))
+        sensor_state['on_occurrence_left'] -= on_occurrence
+        sensor_state['num_on_hours_left'] -= num_on_hours
+
         # Randomly remove rows to simulate missings
-        binary_ts_df = random_drop_rows(binary_ts_df, missing_ratio)
+        keep_positions = get_keep_positions(timestamps.shape[0], missing_ratio, rng)
+        timestamps, value = timestamps.values[keep_positions], value[keep_positions]
         # Add noise such as fractions of seconds to timestamp
         if timestamp_noise:
-            binary_ts_df = add_timestamp_noise(binary_ts_df)
+            timestamps = timestamps + get_timestamp_noise(timestamps.shape[0], rng)
+        timestamp_lst.append(timestamps)
+        value_lst.append(value)
+        num_rows_lst.append(timestamps.shape[0])
         print(f'Sensor {sensor} Binary Simulation Done.')
-        ret_binary_ts_df = pd.concat([ret_binary_ts_df, binary_ts_df])
-    ret_binary_ts_df = ret_binary_ts_df.sort_values('Timestamp').reset_index(drop=True)
-    ret_binary_ts_df = ret_binary_ts_df[['Id', 'Key', 'Timestamp', 'Value']]
+    timestamps = np.concatenate(timestamp_lst).astype('datetime64[ns]')
+    order = np.argsort(timestamps, kind='stable')
+    ret_binary_ts_df = pd.DataFrame({'Id': np.repeat(np.array(id_name_lst[:num_simulated_ts], dtype=object), num_rows_lst)[order], \
+                                     'Key': np.repeat(np.array(key_name_lst[:num_simulated_ts], dtype=object), num_rows_lst)[order], \
+                                     'Timestamp': timestamps[order], \
+                                     'Value': np.concatenate(value_lst)[order]})
 
     return ret_binary_ts_df
+
+
+def paint_on_intervals(n_values=0, start_indices=None, end_indices=None) -> np.array:
+    """
+    Mark all 'ON' intervals [start, end] at once with a difference array: +1 where an interval starts, -1 after it ends,
+    so that the cumulative sum counts the intervals covering each value. Intervals may overlap, run past n_values, or be empty (end < start).
+
+    Parameters
+    ----------
+    n_values : number of values to mark,
+        int
+    start_indices : first index of each interval,
+        np.array of int
+    end_indices : last index (inclusive) of each interval,
+        np.array of int
+
+    Return
+    ----------
+    value : 1 within any interval, else 0,
+        np.array of int
+    """
+    start_indices = np.minimum(start_indices, n_values)
+    end_indices = np.clip(end_indices + 1, start_indices, n_values)
+    diff = np.bincount(start_indices, minlength=n_values+1) - np.bincount(end_indices, minlength=n_values+1)
+    return (np.cumsum(diff[:n_values]) > 0).astype(np.int64)
+
+
+def _count_on_hours(time_range=None, freq=None, chunk_range=None, start_of_day_str=None, end_of_day_str=None) -> int:
+    """
+    Helper function to count the on-hour timestamps over the entire time range, by blocks of the size of the time chunk,
+    with calendars left out of the cache as each block is only counted once.
+    """
+    if chunk_range is None or chunk_range[1] is None:
+        block_range_lst = [chunk_range]
+    else:
+        block_range_lst = get_chunk_ranges(time_range, chunk_range[1] - chunk_range[0])
+    return int(sum(np.count_nonzero(~get_calendar(time_range, freq, block_range, cached=False).get_off_hour_mask(start_of_day_str, end_of_day_str)) \
+                   for block_range in block_range_lst))
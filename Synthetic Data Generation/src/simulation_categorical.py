@@ -3,7 +3,8 @@
 
 import pandas as pd
 import numpy as np
-from utils.utils_data_generation import random_drop_rows, add_timestamp_noise
+from pandas.api.types import union_categoricals
+from utils.utils_data_generation import get_keep_positions, add_timestamp_noise, get_chunk_timestamps
 
 def get_cat_ts_df(anomaly_label_lst=None, \
                   num_simulated_ts=1, \
@@ -13,7 +14,11 @@ def get_cat_ts_df(anomaly_label_lst=None, \
                   cat_names_lst=None, \
                   cat_ratio_lst=None, \
                   missing_ratio_lst=[0], \
-                  timestamp_noise_lst=[False]) -> pd.DataFrame:
+                  timestamp_noise_lst=[False], \
+                  exact_ratio=True, \
+                  chunk_range=None, \
+                  rng=None, \
+                  series_rng=None) -> pd.DataFrame:
     """
     Get simulated categorical time-series dataframe for selected sensors.
 
@@ -37,13 +42,25 @@ def get_cat_ts_df(anomaly_label_lst=None, \
         list of float, default=[0]
     timestamp_noise_lst : list of indicator of whether to add noise (e.g. fractions of seconds) into timestamp,
         list of bool, default=[False]
+    exact_ratio : whether to draw exactly int(n*ratio) values of each category (the last one taking the rest) in random order,
+        otherwise draw each value independently with the ratios as probabilities,
+        bool, default=True
+    chunk_range : [start, end) timestamps of the time chunk to simulate, from function get_chunk_ranges(), if not given then simulate the entire time range,
+        list of Timestamps, optional
+    rng : random generator to draw from, if not given then draw from the global numpy random state,
+        np.random.Generator, optional
+    series_rng : random generators of all series of the data profile, called with (id_name, key_name),
+        if given then each series draws from its own generator instead of rng,
+        SeriesRng, optional
 
     Return
     ----------
-    ret_cat_ts_df : simulated categorical time-series dataframe for selected sensors with columns=['Timestamp', 'Id', 'Value', 'Key'], 
+    ret_cat_ts_df : simulated categorical time-series dataframe for selected sensors with columns=['Timestamp', 'Id', 'Value', 'Key'],
+        where Value is a pd.Categorical over the categories of all sensors,
         pd.DataFrame
     """
-    ret_cat_ts_df = pd.DataFrame()
+    rng = np.random if rng is None else rng
+    cat_ts_df_lst = []
     for sensor in range(num_simulated_ts):
         freq, id_name, key_name, cat_names, cat_ratio, missing_ratio, timestamp_noise = freq_lst[sensor], \
                                                                                         id_name_lst[sensor], \
@@ -52,27 +69,63 @@ def get_cat_ts_df(anomaly_label_lst=None, \
                                                                                         cat_ratio_lst[sensor], \
                                                                                         missing_ratio_lst[sensor], \
                                                                                         timestamp_noise_lst[sensor]
-        cat_ts_df = pd.DataFrame(pd.date_range(anomaly_label_lst[0].index[0], \
-                                               anomaly_label_lst[0].index[-1], \
-                                               freq=freq), columns=['Timestamp'])
-        cat_ts_df['Id'] = id_name
-        cat_ts_df['Key'] = key_name
-        tmp_value_lst = []
-        for i, cat in enumerate(cat_names):
-            if i!= len(cat_names)-1:
-                tmp_value_lst = tmp_value_lst + [cat_names[i] for _ in range(int(cat_ts_df.shape[0]*cat_ratio[i]))]
-        tmp_value_lst = tmp_value_lst + [cat_names[i] for _ in range(cat_ts_df.shape[0]-len(tmp_value_lst))]
-        np.random.shuffle(tmp_value_lst)
-        cat_ts_df['Value'] = tmp_value_lst
-        
-        # Randomly remove rows to simulate missings
-        cat_ts_df = random_drop_rows(cat_ts_df, missing_ratio)
+        if series_rng is not None:
+            rng = series_rng(id_name, key_name)
+        timestamps = get_chunk_timestamps([anomaly_label_lst[0].index[0], \
+                                           anomaly_label_lst[0].index[-1]], \
+                                          freq=freq, \
+                                          chunk_range=chunk_range)
+        cat_codes = get_cat_codes(timestamps.shape[0], cat_ratio, exact_ratio, rng)
+        # Randomly pick the rows to keep to simulate missings, before the rows are built
+        keep_positions = get_keep_positions(timestamps.shape[0], missing_ratio, rng)
+        cat_ts_df = pd.DataFrame({'Timestamp': timestamps.values[keep_positions], \
+                                  'Id': id_name, \
+                                  'Key': key_name, \
+                                  'Value': pd.Categorical.from_codes(cat_codes[keep_positions], categories=cat_names)})
         # Add noise such as fractions of seconds to timestamp
         if timestamp_noise:
-            cat_ts_df = add_timestamp_noise(cat_ts_df)
+            cat_ts_df = add_timestamp_noise(cat_ts_df, sort=False, rng=rng)
         print(f'Sensor {sensor} Categorical Simulation Done.')
-        ret_cat_ts_df = pd.concat([ret_cat_ts_df, cat_ts_df])
+        cat_ts_df_lst.append(cat_ts_df)
+    ret_cat_ts_df = pd.concat(cat_ts_df_lst, ignore_index=True)
+    # Sensors with different categories would otherwise fall back to an object column
+    ret_cat_ts_df['Value'] = union_categoricals([cat_ts_df['Value'] for cat_ts_df in cat_ts_df_lst])
     ret_cat_ts_df = ret_cat_ts_df.sort_values('Timestamp').reset_index(drop=True)
     ret_cat_ts_df = ret_cat_ts_df[['Id', 'Key', 'Timestamp', 'Value']]
 
     return ret_cat_ts_df
+
+
+def get_cat_codes(n_values=0, \
+                  cat_ratio=None, \
+                  exact_ratio=True, \
+                  rng=None) -> np.array:
+    """
+    Draw the integer codes of a categorical time-series, i.e. the position of each value in its list of categories.
+
+    Parameters
+    ----------
+    n_values : number of values to draw,
+        int
+    cat_ratio : ratios of each category,
+        list of float (e.g. [1/3, 1/3, 1/3])
+    exact_ratio : whether to draw exactly int(n_values*ratio) codes of each category (the last one taking the rest) in random order,
+        otherwise draw each code independently with the ratios as probabilities,
+        bool, default=True
+    rng : random generator to draw from, if not given then draw from the global numpy random state,
+        np.random.Generator, optional
+
+    Return
+    ----------
+    codes : codes of the categories drawn,
+        np.array of int8 (int16 for more than 127 categories)
+    """
+    rng = np.random if rng is None else rng
+    n_cats = len(cat_ratio)
+    code_dtype = np.int8 if n_cats <= np.iinfo(np.int8).max else np.int16
+    if exact_ratio:
+        counts = [int(n_values*ratio) for ratio in cat_ratio[:-1]]
+        counts.append(max(n_values-sum(counts), 0))
+        return rng.permutation(np.repeat(np.arange(n_cats, dtype=code_dtype), counts))
+    cat_p = np.asarray(cat_ratio, dtype=float)
+    return rng.choice(n_cats, n_values, p=cat_p/cat_p.sum()).astype(code_dtype)
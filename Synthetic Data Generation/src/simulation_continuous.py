@@ -1,16 +1,20 @@
 """
 Functions to generate continuous time-series data profile, with anomalies
 """
-import networkx as nx
-from numpy.random import uniform, normal
+from functools import partial
+from itertools import groupby
+
 import numpy as np
 import pandas as pd
 
 from utils.utils_data_generation import (
-    add_value_noise,
+    add_value_noise_mat,
     add_timestamp_noise,
-    random_drop_rows,
+    get_keep_positions,
+    get_timestamp_noise,
+    get_max_timestamp_noise_us,
 )
+from utils.utils_calendar import get_index_calendar
 from utils.gen_ts_shapes import (
     gen_beta_anom,
     get_wave_period,
@@ -36,6 +40,9 @@ def simulate_source_nodes_ts(
     sine_oh_params=None,
     freq_lst=None,
     surge_with_decay=False,
+    state=None,
+    rng=None,
+    id_rng=None,
 ) -> list:
     """
     Simulate telemetry time-series for selected source nodes based on anomaly labels.
@@ -64,13 +71,17 @@ def simulate_source_nodes_ts(
     sine_oh_params, dict: dictionary of params for creating daily sine pattern, yearly sine pattern (if any), and concave week off-hours, and weekend hours
     freq_lst, str: list of the sensor sampling rate/frequency for each simulated time-series (sensor)
     surge_with_decay, boolean: whether to turn on the inclusion of surge/dip of decaying anomalous behavior as anomaly
-
+    state, dict: running state of each sensor when simulating consecutive time chunks of anomaly labels (see main()), updated in place,
+        e.g. the cosine phase, the normal mean of each day and the surge degrees, optional
+    rng, np.random.Generator: random generator to draw from, if not given then draw from the global numpy random state, optional
+    id_rng, callable: function returning the random generator of the series of an Id, if given then each sensor draws from its own generator instead of rng, optional
 
     Return
     ----------
     ret_df_lst : list of simulated time-series dataframes, each with columns=['date', 'isAnomaly', 'isOffHour', 'value'] and Timestamp as index,
         list of Dataframe
     """
+    rng = np.random if rng is None else rng
     ret_df_lst = []
     num_simulated_sensors = len(gd.simulated_nodes)
     for sensor in range(num_simulated_sensors):
@@ -94,6 +105,18 @@ def simulate_source_nodes_ts(
             )
         else:
             simulate_surge = None
+        if id_rng is not None:
+            rng = id_rng(gd.simulated_nodes[sensor])
+        sensor_state = state.setdefault(sensor, {}) if state is not None else {}
+        # Number of timestamps simulated in previous time chunks, to continue the cosine phase
+        n_pts_offset = sensor_state.get("n_pts_offset", 0)
+
+        # Locate days and on/off-hours of all timestamps at once, on the calendar shared by all sensors and keys
+        calendar = get_index_calendar(anomaly_label.index)
+        timestamps_ns, day_idx, days_since_epoch = calendar.timestamps_ns, calendar.day_idx, calendar.days_since_epoch
+        is_weekend = calendar.is_weekend
+        is_off_hour = anomaly_label["isOffHour"].values.astype(bool)
+        value = np.zeros(timestamps_ns.shape[0])
 
         # For sine wave, set baseline in for all time
         if ts_shape == "sinusoidal":
@@ -103,10 +126,10 @@ def simulate_source_nodes_ts(
                 theta_start_str=sine_oh_params["daily"]["theta_start_str"],
             )
             print("Daily sine_period:", sine_period, ", theta:", theta)
-            anomaly_label["value"] = gen_cosine_imperfect(
+            value += gen_cosine_imperfect(
                 len(anomaly_label),
                 sine_period=sine_period,
-                theta=theta,
+                theta=theta + n_pts_offset,
                 sine_mean=sine_oh_params["daily"]["sine_mean"],
                 amplitude=sine_oh_params["daily"]["amplitude"],
                 sinebkpt_factor=sine_oh_params["daily"]["sinebkpt_factor"],
@@ -114,13 +137,17 @@ def simulate_source_nodes_ts(
                 noise_min=sine_oh_params["daily"]["noise_min"],
                 noise_max=sine_oh_params["daily"]["noise_max"],
                 sigma=sine_oh_params["daily"]["sigma"],
+                rng=rng,
             )
         else:  # step function like
             # Simulate the mean values during normal times for each time-series
-            num_days = anomaly_label["date"].nunique()
-            normal_means_array = uniform(
-                normal_mean_range[0], normal_mean_range[1], num_days
+            # (only for days not simulated in previous time chunks)
+            normal_means_dic = sensor_state.setdefault("normal_means", {})
+            new_days = [day for day in days_since_epoch if day not in normal_means_dic]
+            normal_means_dic.update(
+                zip(new_days, rng.uniform(normal_mean_range[0], normal_mean_range[1], len(new_days)))
             )
+            normal_means_array = np.array([normal_means_dic[day] for day in days_since_epoch])
 
         if add_season_trend:
             sine_period_year, theta_year = get_wave_period(
@@ -131,10 +158,10 @@ def simulate_source_nodes_ts(
             print(
                 "Seasonal year sine_period:", sine_period_year, ", theta:", theta_year
             )
-            anomaly_label["value"] += gen_cosine_trend(
+            value += gen_cosine_trend(
                 len(anomaly_label),
                 sine_period=sine_period_year,
-                theta=theta_year,
+                theta=theta_year + n_pts_offset,
                 sine_mean=sine_oh_params["yearly"]["sine_mean"],
                 amplitude=sine_oh_params["yearly"]["amplitude"],
                 sinebkpt_factor=sine_oh_params["yearly"]["sinebkpt_factor"],
@@ -147,135 +174,127 @@ def simulate_source_nodes_ts(
                 coeff_dist=sine_oh_params["yearly"]["coeff_dist"],
                 coeff_max=sine_oh_params["yearly"]["coeff_max"],
                 coeff_min=sine_oh_params["yearly"]["coeff_min"],
+                rng=rng,
             )
 
-        ret_df = pd.DataFrame()
-        gb_dic = dict(list(anomaly_label.reset_index().groupby("date")))
-        for i, (date, sub_df) in enumerate(gb_dic.items()):
-
-            # Check if date is a weekend,
-            if date.weekday() in [5, 6]:
-                sub_ret_df = sub_df.copy()
-
-                if ts_shape == "sinusoidal":  # downish concave trend during weekend
-                    sub_ret_df["value"] += gen_pw_concave_trend(
-                        len(sub_ret_df),
-                        trendbkpt_factor=sine_oh_params["weekend"]["trendbkpt_factor"],
-                        concavity=sine_oh_params["weekend"]["concavity"],
-                        buffer_itval=sine_oh_params["weekend"]["buffer_itval"],
-                        start_coeff=sine_oh_params["weekend"]["start_coeff"],
-                        coeff_dist=sine_oh_params["weekend"]["coeff_dist"],
-                        coeff_val=sine_oh_params["weekend"]["coeff_val"],
-                        coeff_mid_factor=sine_oh_params["weekend"]["coeff_mid_factor"],
-                        trend_shift_max=sine_oh_params["weekend"]["trend_shift_max"],
-                        scale_2ndhalf_zero=sine_oh_params["weekend"][
-                            "scale_2ndhalf_zero"
-                        ],
-                        date=date,
-                        trend_val_max=sine_oh_params["weekend"]["trend_val_max"],
+        if ts_shape == "sinusoidal":
+            # Downish concave trend during weekend, and slightly downward trend during weekday off-hours,
+            # each segment being all timestamps of a weekend day, or all off-hour timestamps of a weekday
+            dates = calendar.dates
+            for segment_name, segment_mask in [
+                ("weekend", is_weekend),
+                ("ohweek", ~is_weekend & is_off_hour),
+            ]:
+                segment_positions = np.flatnonzero(segment_mask)
+                segment_day_idx = day_idx[segment_positions]
+                segment_bounds = np.flatnonzero(np.diff(segment_day_idx)) + 1
+                positions_lst = [
+                    positions
+                    for positions in np.split(segment_positions, segment_bounds)
+                    if positions.shape[0] > 0
+                ]
+                # Consecutive segments of the same length (e.g. days of the same sampling) are generated as one batch
+                for n_pts, positions_grp in groupby(positions_lst, key=len):
+                    positions_mat = np.array(list(positions_grp))
+                    value[positions_mat] += gen_pw_concave_trend(
+                        n_pts,
+                        trendbkpt_factor=sine_oh_params[segment_name]["trendbkpt_factor"],
+                        concavity=sine_oh_params[segment_name]["concavity"],
+                        buffer_itval=sine_oh_params[segment_name]["buffer_itval"],
+                        start_coeff=sine_oh_params[segment_name]["start_coeff"],
+                        coeff_dist=sine_oh_params[segment_name]["coeff_dist"],
+                        coeff_val=sine_oh_params[segment_name]["coeff_val"],
+                        coeff_mid_factor=sine_oh_params[segment_name]["coeff_mid_factor"],
+                        trend_shift_max=sine_oh_params[segment_name]["trend_shift_max"],
+                        scale_2ndhalf_zero=sine_oh_params[segment_name]["scale_2ndhalf_zero"],
+                        date=dates[day_idx[positions_mat[0, 0]]],
+                        trend_val_max=sine_oh_params[segment_name]["trend_val_max"],
+                        rng=rng,
+                        n_series=positions_mat.shape[0],
                     )
-                else:  # For step-function profile, generate zero values if it is
-                    sub_ret_df["value"] = 0
-
-            else:
-                on_hours, off_hours = (
-                    sub_df[~sub_df["isOffHour"]],
-                    sub_df[sub_df["isOffHour"]],
-                )
-
-                if ts_shape == "sinusoidal":
-                    if not off_hours.empty:  # Slightly downward trend during off hours
-                        off_hours["value"] += gen_pw_concave_trend(
-                            len(off_hours),
-                            trendbkpt_factor=sine_oh_params["ohweek"][
-                                "trendbkpt_factor"
-                            ],
-                            concavity=sine_oh_params["ohweek"]["concavity"],
-                            buffer_itval=sine_oh_params["ohweek"]["buffer_itval"],
-                            start_coeff=sine_oh_params["ohweek"]["start_coeff"],
-                            coeff_dist=sine_oh_params["ohweek"]["coeff_dist"],
-                            coeff_val=sine_oh_params["ohweek"]["coeff_val"],
-                            coeff_mid_factor=sine_oh_params["ohweek"][
-                                "coeff_mid_factor"
-                            ],
-                            trend_shift_max=sine_oh_params["ohweek"]["trend_shift_max"],
-                            scale_2ndhalf_zero=sine_oh_params["ohweek"][
-                                "scale_2ndhalf_zero"
-                            ],
-                            date=date,
-                            trend_val_max=sine_oh_params["ohweek"]["trend_val_max"],
-                        )
-
-                else:  # step-function like
-                    # Generate zero values for weekday off-hour
-                    if not off_hours.empty:
-                        off_hours["value"] = 0
-                    # Generate an array from normal distribution for weekday on-hour
-                    if not on_hours.empty:
-                        on_hours["value"] = normal(
-                            normal_means_array[i], normal_std, on_hours.shape[0]
-                        )
-
-                sub_ret_df = pd.concat([off_hours, on_hours])
-            ret_df = ret_df.append(sub_ret_df)
-        ret_df = ret_df.sort_values("Timestamp").set_index("Timestamp")
-
-        if simulate_surge:
-            surge_occurrence = len(surge_start_end_indices)
-            # Simulate surge degree for current time-series
-            surge_ratios = uniform(
-                surge_ratio_range[0], surge_ratio_range[1], surge_occurrence
+        else:  # step-function like
+            # Zero values at weekend and weekday off-hour,
+            # and values from normal distribution around the mean of the day for weekday on-hour
+            on_hour_positions = np.flatnonzero(~is_weekend & ~is_off_hour)
+            value[on_hour_positions] = rng.normal(
+                normal_means_array[day_idx[on_hour_positions]],
+                normal_std,
+                on_hour_positions.shape[0],
             )
-            surge_df = pd.DataFrame()
-            # Indicate whether to allow absence of telemetry surge during anomalies from simulated anomaly label
-            # comb_lst = []
-            # for i in range(1, surge_occurrence+1):
-            #     comb_lst = comb_lst + list(itertools.combinations(range(surge_occurrence), i))
-            comb_lst = list(range(surge_occurrence))
 
-            # Generate telemetries during surge
-            for j in range(surge_occurrence):
-                # tmp_surge_lst = np.random.choice(np.array(comb_lst, dtype=object), 1)[0]
-                tmp_surge_lst = comb_lst
-                surge_ratio = surge_ratios[j] if j in tmp_surge_lst else 1
-                tmp_surge_df = anomaly_label.loc[
-                    surge_start_end_indices[j][0] : surge_start_end_indices[j][1]
-                ]
-                tmp_surge_df["value"] = normal(
-                    normal_means_array.mean() * surge_ratio,
-                    normal_std,
-                    tmp_surge_df.shape[0],
-                )
-                surge_df = surge_df.append(tmp_surge_df)
+        # Positional [start, end) of each surge occurrence (clipped to the anomaly labels given), with inclusive end timestamps
+        surge_occurrence = len(surge_start_end_indices)
+        surge_bounds = np.array(surge_start_end_indices).reshape(surge_occurrence, 2)
+        surge_start_positions = anomaly_label.index.searchsorted(surge_bounds[:, 0], side="left")
+        surge_end_positions = anomaly_label.index.searchsorted(surge_bounds[:, 1], side="right")
 
         if surge_with_decay:
-            surge_occurrence = len(surge_start_end_indices)
-            surge_df = pd.DataFrame()
-            list_surge_or_dip = np.random.choice(["surge", "dip"], surge_occurrence)
-            # Generate telemetries during surge
+            if "surge_or_dip" not in sensor_state:
+                sensor_state["surge_or_dip"] = rng.choice(["surge", "dip"], surge_occurrence)
+            list_surge_or_dip = sensor_state["surge_or_dip"]
+            # Number of timestamps of each surge before and in total, for surges crossing time chunk boundaries
+            surge_n_pts_before, surge_n_pts_total = _get_surge_n_pts(anomaly_label.index, surge_bounds)
+            # Generate telemetries during surge, shaping the values of normal times
+            normal_value = value.copy()
             for j in range(surge_occurrence):
-                tmp_surge_df = anomaly_label.loc[
-                    surge_start_end_indices[j][0] : surge_start_end_indices[j][1]
-                ]
-                ans = gen_beta_anom(
-                    ret_df.loc[tmp_surge_df.index, "value"],
+                if surge_end_positions[j] <= surge_start_positions[j]:
+                    continue
+                value[surge_start_positions[j] : surge_end_positions[j]] = gen_beta_anom(
+                    normal_value[surge_start_positions[j] : surge_end_positions[j]],
                     a=2,
                     b=5,
                     scale_fac=0.5,
                     surge_or_dip=list_surge_or_dip[j],
+                    n_pts_before=surge_n_pts_before[j],
+                    n_pts_total=surge_n_pts_total[j],
                 )
-                tmp_surge_df["value"] = ans
-                surge_df = surge_df.append(tmp_surge_df)
-
-        if simulate_surge or surge_with_decay:
-            # Update time-series during normal time with the one with surges
-            ret_df.loc[surge_df.index, "value"] = surge_df["value"]
+        elif simulate_surge:
+            # Simulate surge degree for current time-series
+            if "surge_ratios" not in sensor_state:
+                sensor_state["surge_ratios"] = rng.uniform(
+                    surge_ratio_range[0], surge_ratio_range[1], surge_occurrence
+                )
+                sensor_state["surge_mean"] = normal_means_array.mean()
+            surge_ratios, surge_mean = sensor_state["surge_ratios"], sensor_state["surge_mean"]
+            # Indicate whether to allow absence of telemetry surge during anomalies from simulated anomaly label
+            # comb_lst = []
+            # for i in range(1, surge_occurrence+1):
+            #     comb_lst = comb_lst + list(itertools.combinations(range(surge_occurrence), i))
+            # Generate telemetries during surge for all surge occurrences at once, later surges overwrite overlaps
+            surge_lengths = surge_end_positions - surge_start_positions
+            surge_positions = np.repeat(
+                surge_start_positions - np.cumsum(surge_lengths) + surge_lengths, surge_lengths
+            ) + np.arange(surge_lengths.sum())
+            value[surge_positions] = rng.normal(
+                np.repeat(surge_mean * surge_ratios, surge_lengths),
+                normal_std,
+                surge_positions.shape[0],
+            )
 
+        ret_df = anomaly_label.copy()
+        ret_df["value"] = value
         ret_df_lst.append(ret_df)
+        sensor_state["n_pts_offset"] = n_pts_offset + timestamps_ns.shape[0]
         print(f"\nSensor {sensor} Time-series Simulation Done.")
     return ret_df_lst
 
 
+def _get_surge_n_pts(timestamps=None, surge_bounds=None) -> tuple:
+    """
+    Helper function to count, for each surge occurrence, the number of timestamps before the given (regular) timestamps and in total.
+    Without regular frequency, surges are assumed to lie within the given timestamps.
+    """
+    surge_start_positions = timestamps.searchsorted(surge_bounds[:, 0], side="left")
+    surge_end_positions = timestamps.searchsorted(surge_bounds[:, 1], side="right")
+    if timestamps.freq is None or len(timestamps) == 0:
+        return np.zeros(surge_bounds.shape[0], dtype=np.int64), surge_end_positions - surge_start_positions
+    step_ns = pd.to_timedelta(timestamps.freq).value
+    surge_start_ns, surge_end_ns = pd.DatetimeIndex(surge_bounds[:, 0]).asi8, pd.DatetimeIndex(surge_bounds[:, 1]).asi8
+    surge_n_pts_before = np.maximum(-((surge_start_ns - timestamps.asi8[0]) // step_ns), 0)
+    surge_n_pts_total = (surge_end_ns - surge_start_ns) // step_ns + 1
+    return surge_n_pts_before, surge_n_pts_total
+
+
 def populate_flow_all_nodes(gd=None, supply_mat=None) -> np.array:
     """
     Based on the simulation of selected nodes, populate the rest according to topology flow top-down
@@ -293,18 +312,9 @@ def populate_flow_all_nodes(gd=None, supply_mat=None) -> np.array:
     sln_mat : Solution matrix, np.array,
         stacked vertically by each the supply vector per timestamp, or to be considered as a horizontal stack of time-series simulated per node.
     """
-    tmp_G = gd.G.copy()
-    # Refine topology with relationship used for topology flow
-    sub_topo_df = gd.topo_df[gd.topo_df["relationshipName"] != gd.relationship_to_flow]
-    tmp_G.remove_edges_from(list(zip(sub_topo_df["sourceId"], sub_topo_df["targetId"])))
-    # adj_mat A[i,j]: adjency matrix of graph, where a[i,j]=1 if there is an arc from i to j else 0
-    adj_mat = nx.to_numpy_array(tmp_G)
-    # Get factors to divide flows equally
-    div_factor = np.sum(adj_mat, axis=1)
-    div_factor[div_factor == 0] = 1
-    # Solve linear equations of form: A_matrix x_matrix = supply_matrix, where A=I-(adj_mat)^T/div_factor
-    A = np.eye(len(adj_mat)) - np.transpose(adj_mat) / div_factor
-    sln_mat = np.linalg.solve(A, supply_mat).round(3)
+    # The flow operator W[j,i] (flow from node i to node j divided equally amongst the targets of i) is cached on gd, and
+    # solves linear equations of form: A_matrix x_matrix = supply_matrix, where A=I-W, in topological order for a DAG
+    sln_mat = gd.get_flow_operator().solve(supply_mat).round(3)
     # print(f'Supply Matrix = {supply_mat}, Shape {supply_mat.shape}\nSolution Matrix = {sln_mat}, Shape {sln_mat.shape}')
     return sln_mat
 
@@ -319,6 +329,11 @@ def get_full_ts_df(
     bump_up_neg=False,
     accept_neg=False,
     timestamp_noise=False,
+    cumsum_offset_dic=None,
+    exact_missing=True,
+    rng=None,
+    id_rng=None,
+    bump_up_state=None,
 ) -> pd.DataFrame:
     """
     Get simulated telemetry time-series dataframe for all nodes in graph.
@@ -341,38 +356,89 @@ def get_full_ts_df(
     accept_neg, boolean: whether to accept negative values, if false negative values are set to 0
     timestamp_noise : indicate whether to add noise (e.g. fractions of seconds) into timestamp,
         bool, default=False
+    cumsum_offset_dic : if given, accumulate the values along time into monotonic counters, starting from the value of each Id in the dict
+        (e.g. the last value of the previous time chunk, 0 if absent), and update it in place with the last value of each Id,
+        dict, default=None, with timestamp_noise the noise is then kept below half the sample period so that the counters do not decrease
+    exact_missing : whether to drop exactly int(n*missing_ratio) rows, otherwise drop each row independently with probability missing_ratio,
+        bool, default=True
+    rng : random generator to draw from, if not given then draw from the global numpy random state,
+        np.random.Generator, default=None
+    id_rng : function returning the random generator of the series of an Id, if given then the row of each Id draws from its own generator instead of rng,
+        callable, default=None
+    bump_up_state : running state of the key across time chunks, if given then the minimum value bumped up with bump_up_neg is the one of the first chunk,
+        so that all chunks are shifted by the same amount, values still negative after the shift being then handled as set by accept_neg,
+        dict, default=None
 
     Return
     ----------
     ts_df : simulated continuous time-series dataframe for all nodes in graph with columns=['Timestamp', 'Id', 'Value', 'Key'],
         pd.DataFrame
     """
-    ts_df = pd.DataFrame(sln_mat).T
-    ts_df.index, ts_df.columns = time_series_index, gd.G.nodes
-
-    # Add disturbance to value
-    min_val = ts_df.min().min()
-    if value_noise and bump_up_neg and min_val < 0:
-        for col in ts_df.columns:
-            ts_df[col] = ts_df[col].apply(lambda x: add_value_noise(x, accept_neg=True))
-            ts_df[col] += abs(min_val)
-    elif value_noise:
-        for col in ts_df.columns:
-            ts_df[col] = ts_df[col].apply(
-                lambda x: add_value_noise(x, accept_neg=accept_neg)
+    node_lst = gd.node_ids
+    n_nodes, n_timestamps = sln_mat.shape
+    row_rng_lst = None if id_rng is None else [id_rng(node) for node in node_lst]
+
+    # Add disturbance to value, directly on the (nodes x time) solution matrix, or row by row with the generator of each Id
+    min_val = np.min(sln_mat) if bump_up_state is None else bump_up_state.setdefault("min_val", np.min(sln_mat))
+    if value_noise:
+        row_accept_neg = True if bump_up_neg and min_val < 0 else accept_neg
+        if row_rng_lst is None:
+            sln_mat = add_value_noise_mat(sln_mat, accept_neg=row_accept_neg, rng=rng)
+        else:
+            sln_mat = np.array(
+                [add_value_noise_mat(row, accept_neg=row_accept_neg, rng=row_rng) for row, row_rng in zip(sln_mat, row_rng_lst)]
+            ).reshape(n_nodes, n_timestamps)
+        if bump_up_neg and min_val < 0:
+            sln_mat += abs(min_val)
+            # Values still negative after the shift (e.g. below the minimum of the first chunk) are handled as set by accept_neg
+            if not accept_neg:
+                np.maximum(sln_mat, 0, out=sln_mat)
+
+    # Monotonic counters, accumulated along the time axis before any row is dropped
+    if cumsum_offset_dic is not None:
+        cumsum_offsets = np.array([cumsum_offset_dic.get(node, 0) for node in node_lst])
+        sln_mat = np.cumsum(sln_mat, axis=1) + cumsum_offsets[:, np.newaxis]
+        cumsum_offset_dic.update(zip(node_lst, sln_mat[:, -1]))
+
+    # Randomly pick the rows to keep to simulate missings, before the long table is built,
+    # rows being in time-major order (all nodes of a timestamp, then the next timestamp) so that they come sorted by Timestamp
+    if row_rng_lst is None:
+        keep_positions = get_keep_positions(sln_mat.size, missing_ratio, rng, exact_count=exact_missing)
+    else:
+        keep_positions = np.sort(
+            np.concatenate(
+                [
+                    get_keep_positions(n_timestamps, missing_ratio, row_rng, exact_count=exact_missing) * n_nodes + i
+                    for i, row_rng in enumerate(row_rng_lst)
+                ]
             )
-
-    # Pivot table from wide to long
-    ts_df = pd.melt(
-        ts_df.reset_index(), id_vars=["Timestamp"], var_name="Id", value_name="Value"
+        )
+    time_positions, node_positions = np.divmod(keep_positions, n_nodes)
+    del keep_positions
+    # Long table from the kept entries of the wide (nodes x time) matrix only
+    ts_df = pd.DataFrame(
+        {
+            "Timestamp": time_series_index.values[time_positions],
+            "Id": node_lst[node_positions],
+            "Value": sln_mat[node_positions, time_positions],
+            "Key": key_name,
+        }
     )
-    ts_df["Key"] = key_name
-    # Randomly remove rows to simulate missings
-    ts_df = random_drop_rows(ts_df, missing_ratio)
-    # Add noise such as fractions of seconds to timestamp
-    if timestamp_noise:
-        ts_df = add_timestamp_noise(ts_df)
-    ts_df = ts_df.sort_values("Timestamp").reset_index(drop=True)
+    # Add noise such as fractions of seconds to timestamp,
+    # below half the sample period for monotonic counters so that the noise does not reorder the values accumulated above
+    max_noise_us = 10**6 if cumsum_offset_dic is None else get_max_timestamp_noise_us(time_series_index)
+    if timestamp_noise and row_rng_lst is None:
+        ts_df = add_timestamp_noise(ts_df, sort=True, rng=rng, max_noise_us=max_noise_us)
+    elif timestamp_noise:
+        # Draw the noise of each Id from its own generator, in time order, then put it back in place
+        node_order = np.argsort(node_positions, kind="stable")
+        node_counts = np.bincount(node_positions, minlength=n_nodes)
+        noise = np.empty(ts_df.shape[0], dtype="timedelta64[ns]")
+        noise[node_order] = np.concatenate(
+            [get_timestamp_noise(count, row_rng, max_noise_us=max_noise_us) for count, row_rng in zip(node_counts, row_rng_lst)]
+        )
+        ts_df["Timestamp"] = ts_df["Timestamp"].values + noise
+        ts_df = ts_df.sort_values("Timestamp").reset_index(drop=True)
     return ts_df
 
 
@@ -396,12 +462,20 @@ def get_cont_ts_df(
     missing_ratio=0,
     value_noise=True,
     timestamp_noise=False,
+    state=None,
+    cumsum_offset_dic=None,
+    exact_missing=True,
+    rng=None,
+    series_rng=None,
 ) -> pd.DataFrame:
     """
     Main function to simulate continuous telemetry time-series based on anomaly labels.
 
     Parameters
     ----------
+    series_rng : random generators of all series of the data profile, called with (id_name, key_name),
+        if given then each series draws from its own generator instead of rng,
+        SeriesRng, default=None
     Other params refer to each function called within.
 
     Return
@@ -409,6 +483,8 @@ def get_cont_ts_df(
     cont_ts_df : simulated time-series dataframe for all nodes in graph with columns=['Timestamp', 'Id', 'Value', 'Key'],
         pd.DataFrame
     """
+    # Random generator of the series of each Id for this key
+    id_rng = None if series_rng is None else partial(series_rng, key_name=key_name)
     ret_df_lst = simulate_source_nodes_ts(
         unique_anomaly_label=unique_anomaly_label,
         anomaly_label_lst=anomaly_label_lst,
@@ -423,12 +499,14 @@ def get_cont_ts_df(
         sine_oh_params=sine_oh_params,
         freq_lst=freq_lst,
         surge_with_decay=surge_with_decay,
+        state=state,
+        rng=rng,
+        id_rng=id_rng,
     )
 
     # Convert simulated time-series into supply matrix
-    supply_mat = np.zeros((len(gd.G), ret_df_lst[0].shape[0]))
-    for i, node in enumerate(gd.simulated_nodes):
-        node_idx = list(gd.G.nodes).index(node)
+    supply_mat = np.zeros((gd.n_nodes, ret_df_lst[0].shape[0]))
+    for i, node_idx in enumerate(gd.get_node_indices(gd.simulated_nodes)):
         supply_mat[node_idx] = ret_df_lst[i]["value"]
 
     # Use the telemetry simulated for source nodes to populate the rest
@@ -444,6 +522,11 @@ def get_cont_ts_df(
         bump_up_neg=bump_up_neg,
         accept_neg=accept_neg,
         timestamp_noise=timestamp_noise,
+        cumsum_offset_dic=cumsum_offset_dic,
+        exact_missing=exact_missing,
+        rng=rng,
+        id_rng=id_rng,
+        bump_up_state=state.setdefault("bump_up_neg", {}) if state is not None else None,
     )
 
     return cont_ts_df
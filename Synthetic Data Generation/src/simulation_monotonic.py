@@ -3,7 +3,6 @@
 
 import pandas as pd
 from simulation_continuous import get_cont_ts_df
-from utils.utils_data_generation import random_drop_rows
 
 def get_monotonic_ts_df(unique_anomaly_label=True, \
                         anomaly_label_lst=None, \
@@ -16,7 +15,11 @@ def get_monotonic_ts_df(unique_anomaly_label=True, \
                         key_name=None, \
                         missing_ratio=0, \
                         value_noise=True,\
-                        timestamp_noise=False) -> pd.DataFrame:
+                        timestamp_noise=False, \
+                        state=None, \
+                        exact_missing=True, \
+                        rng=None, \
+                        series_rng=None) -> pd.DataFrame:
     """
     Simulate monotonic time-series based on anomaly labels and continuous simulation.
 
@@ -47,34 +50,41 @@ def get_monotonic_ts_df(unique_anomaly_label=True, \
         bool, default=True
     timestamp_noise : indicate whether to add noise (e.g. fractions of seconds) into timestamp,
         bool, default=False
+    state : running state when simulating consecutive time chunks (see main()), e.g. the last cumulative value of each Id, updated in place,
+        dict, optional
+    exact_missing : whether to drop exactly int(n*missing_ratio) rows, otherwise drop each row independently with probability missing_ratio,
+        bool, default=True
+    rng : random generator to draw from, if not given then draw from the global numpy random state,
+        np.random.Generator, optional
+    series_rng : random generators of all series of the data profile, called with (id_name, key_name),
+        if given then each series draws from its own generator instead of rng,
+        SeriesRng, optional
 
     Return
     ----------
     ret_monotonic_ts_df : simulated monotonic time-series dataframe for selected sensors with columns=['Timestamp', 'Id', 'Value', 'Key'], 
         pd.DataFrame
     """
-    ts_df = get_cont_ts_df(unique_anomaly_label=unique_anomaly_label, \
-                           anomaly_label_lst=anomaly_label_lst, \
-                           surge_start_end_indices_lst=surge_start_end_indices_lst, \
-                           simulate_surge_lst=simulate_surge_lst, \
-                           surge_ratio_range_lst=surge_ratio_range_lst, \
-                           normal_mean_range_lst=normal_mean_range_lst, \
-                           normal_std_lst=normal_std_lst, \
-                           gd=gd, \
-                           key_name=key_name, \
-                           missing_ratio=0, \
-                           value_noise=value_noise,\
-                           timestamp_noise=timestamp_noise)
-
-    ts_df_gb = ts_df.groupby('Id')
-    ret_monotonic_ts_df = pd.DataFrame()
-    for gb_key in ts_df_gb.groups.keys():
-        sub_ts_df_monotonic = ts_df_gb.get_group(gb_key).sort_values('Timestamp').reset_index(drop=True)
-        sub_ts_df_monotonic['Value'] = sub_ts_df_monotonic['Value'].cumsum()
-        ret_monotonic_ts_df = pd.concat([ret_monotonic_ts_df, sub_ts_df_monotonic])
-    # update_stream_monotonic['Key'] = 'PowerMeter'
-    ret_monotonic_ts_df = random_drop_rows(ret_monotonic_ts_df, missing_ratio)
+    # Continue the cumulative sum from the last value of the previous time chunk if any,
+    # the values being accumulated on the (nodes x time) solution matrix before rows are dropped
+    cumsum_offset_dic = state.setdefault('cumsum_offset', {}) if state is not None else {}
+    ret_monotonic_ts_df = get_cont_ts_df(unique_anomaly_label=unique_anomaly_label, \
+                                         anomaly_label_lst=anomaly_label_lst, \
+                                         surge_start_end_indices_lst=surge_start_end_indices_lst, \
+                                         simulate_surge_lst=simulate_surge_lst, \
+                                         surge_ratio_range_lst=surge_ratio_range_lst, \
+                                         normal_mean_range_lst=normal_mean_range_lst, \
+                                         normal_std_lst=normal_std_lst, \
+                                         gd=gd, \
+                                         key_name=key_name, \
+                                         missing_ratio=missing_ratio, \
+                                         value_noise=value_noise,\
+                                         timestamp_noise=timestamp_noise, \
+                                         state=state.setdefault('continuous', {}) if state is not None else None, \
+                                         cumsum_offset_dic=cumsum_offset_dic, \
+                                         exact_missing=exact_missing, \
+                                         rng=rng, \
+                                         series_rng=series_rng)
     ret_monotonic_ts_df = ret_monotonic_ts_df[['Id', 'Key', 'Timestamp', 'Value']]
-    ret_monotonic_ts_df = ret_monotonic_ts_df.sort_values('Timestamp').reset_index(drop=True)
-    
+
     return ret_monotonic_ts_df
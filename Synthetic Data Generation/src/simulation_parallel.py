@@ -0,0 +1,263 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+import atexit
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+from graph_dataset import GraphDataset
+from simulation_anomalylabels import get_anomaly_label_df
+from simulation_continuous import get_cont_ts_df
+from simulation_categorical import get_cat_ts_df
+from simulation_monotonic import get_monotonic_ts_df
+from simulation_binary import get_binary_ts_df
+from utils.utils_data_generation import get_chunk_positions, update_initial_records
+from utils.utils_flow import FlowOperator
+from utils.utils_parallel import share_arrays, attach_arrays, release_shared_memory
+from utils.utils_rng import SeriesRng
+
+# Inputs shared by all work units within a worker process, set once by _init_worker()
+_worker_context = {}
+
+
+def get_unit_lst(profiles_included=None, simulate_ts_kwargs_dic=None) -> list:
+    """
+    List the independent work units of the simulation: one unit per key of the continuous and monotonic profiles,
+    and one unit for each of the categorical and binary profiles.
+
+    Parameters
+    ----------
+    profiles_included : list of data profiles included in synthetic data,
+        list of str (e.g. ['continuous', 'categorical', 'monotonic', 'binary'])
+    simulate_ts_kwargs_dic : keyword arguments for synthetic data generation of each data profile, keyed by data profile,
+        dict of dict
+
+    Return
+    ----------
+    unit_lst : work units as (data profile, index of key or None), in the order they are simulated without worker processes,
+        list of tuple
+    """
+    unit_lst = []
+    for profile in ['continuous', 'categorical', 'monotonic', 'binary']:
+        if profile not in profiles_included:
+            continue
+        if profile in ['continuous', 'monotonic']:
+            unit_lst += [(profile, i) for i in range(len(simulate_ts_kwargs_dic[profile]['key_name_lst']))]
+        else:
+            unit_lst.append((profile, None))
+    return unit_lst
+
+
+class UnitRunner(object):
+    def __init__(self, \
+                 gd=None, \
+                 anomaly_label_lst=None, \
+                 surge_start_end_indices_lst=None, \
+                 simulate_ts_kwargs_dic=None, \
+                 unit_lst=None, \
+                 seed=None, \
+                 n_workers=None, \
+                 stateful=False, \
+                 rng_per_series=False) -> None:
+        """
+        Runner of the work units from function get_unit_lst(), serially in the current process or on a pool of worker processes.
+        With n_workers given, each unit draws from its own random generator spawned from the seed by np.random.SeedSequence,
+        so that the simulated data is bit-identical whatever the number of workers. The topology flow operator and the anomaly labels
+        are handed over to the workers once through shared memory, instead of being pickled with every task.
+        With rng_per_series set, each (profile, Id, Key) series draws from its own random generator derived from the seed and the series,
+        so that the simulated data of a series does not depend on the other series simulated (see regenerate.py).
+        The earliest record of each (Id, Key) is captured in initial_df as the units are simulated.
+
+        Parameters
+        ----------
+        gd : an instance of GraphDataset object,
+            GraphDataset
+        anomaly_label_lst : list of anomaly label series simulated from function simulate_anomaly_labels(),
+            list of DataFrame
+        surge_start_end_indices_lst : list of start and end timestamps for each surge occurrence for each anomaly label series from function simulate_anomaly_labels(),
+            list of list of of list of Timestamps
+        simulate_ts_kwargs_dic : keyword arguments for synthetic data generation of each data profile, keyed by data profile,
+            dict of dict
+        unit_lst : work units from function get_unit_lst(),
+            list of tuple
+        seed : random seed to spawn the random generator of each unit,
+            int
+        n_workers : number of worker processes, 1 to run the units serially with their own random generators,
+            or None to run them serially drawing from the global numpy random state,
+            int, default=None
+        stateful : whether to carry the running state of each unit across consecutive time chunks,
+            bool, default=False
+        rng_per_series : whether to draw each series from its own random generator, whatever the number of workers,
+            bool, default=False
+
+        Return
+        ----------
+        None
+        """
+        self.unit_lst = unit_lst
+        self.n_workers = n_workers
+        if rng_per_series:
+            self.rng_dic = {unit: SeriesRng(seed=seed, profile=unit[0]) for unit in unit_lst}
+        elif n_workers is None:
+            self.rng_dic = {unit: None for unit in unit_lst}
+        else:
+            seed_seq_lst = np.random.SeedSequence(seed).spawn(len(unit_lst))
+            self.rng_dic = {unit: np.random.default_rng(seed_seq) for unit, seed_seq in zip(unit_lst, seed_seq_lst)}
+        self.state_dic = {unit: {} if stateful else None for unit in unit_lst}
+        self.initial_df = None
+        self._context = {'gd': gd, \
+                         'anomaly_label_lst': anomaly_label_lst, \
+                         'surge_start_end_indices_lst': surge_start_end_indices_lst, \
+                         'simulate_ts_kwargs_dic': simulate_ts_kwargs_dic}
+        self._shm_lst, self._executor = [], None
+        if n_workers is not None and n_workers > 1:
+            array_dic = {f'flow_{name}': array for name, array in gd.get_flow_operator().to_arrays().items()}
+            for i, anomaly_label in enumerate(anomaly_label_lst):
+                array_dic[f'label_{i}_Timestamp'] = anomaly_label.index.asi8
+                array_dic[f'label_{i}_isAnomaly'] = anomaly_label['isAnomaly'].values
+                array_dic[f'label_{i}_isOffHour'] = anomaly_label['isOffHour'].values
+            self._shm_lst, spec_dic = share_arrays(array_dic)
+            worker_spec = {'topo_df': gd.topo_df, \
+                           'relationship_to_flow': gd.relationship_to_flow, \
+                           'simulated_nodes': gd.simulated_nodes, \
+                           'label_freq_lst': [anomaly_label.index.freq for anomaly_label in anomaly_label_lst], \
+                           'surge_start_end_indices_lst': surge_start_end_indices_lst, \
+                           'simulate_ts_kwargs_dic': simulate_ts_kwargs_dic, \
+                           'spec_dic': spec_dic}
+            self._executor = ProcessPoolExecutor(max_workers=n_workers, initializer=_init_worker, initargs=(worker_spec,))
+            # Free the shared memory even if the run is interrupted before close()
+            atexit.register(self.close)
+
+    def run(self, \
+            chunk_range=None) -> dict:
+        """
+        Simulate all work units over a time chunk, carrying the random generator and the running state of each unit to the next call.
+
+        Parameters
+        ----------
+        chunk_range : [start, end) timestamps of the time chunk to simulate, from function get_chunk_ranges(), if not given then simulate the entire time range,
+            list of Timestamps, optional
+
+        Return
+        ----------
+        unit_df_dic : simulated time-series dataframe of each unit with columns=['Id', 'Key', 'Timestamp', 'Value'],
+            or None for continuous and monotonic units if the time chunk holds no anomaly label,
+            dict of DataFrame
+        """
+        if self._executor is None:
+            result_lst = [_run_unit(unit, chunk_range, self.rng_dic[unit], self.state_dic[unit], self._context) \
+                          for unit in self.unit_lst]
+        else:
+            future_lst = [self._executor.submit(_run_unit, unit, chunk_range, self.rng_dic[unit], self.state_dic[unit]) \
+                          for unit in self.unit_lst]
+            result_lst = [future.result() for future in future_lst]
+        unit_df_dic = {}
+        for unit, (unit_df, rng, state) in zip(self.unit_lst, result_lst):
+            unit_df_dic[unit], self.rng_dic[unit], self.state_dic[unit] = unit_df, rng, state
+            if unit_df is not None and not unit_df.empty:
+                self.initial_df = update_initial_records(self.initial_df, unit_df)
+        return unit_df_dic
+
+    def close(self) -> None:
+        """
+        Shut down the worker processes and free the shared memory.
+        """
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+        release_shared_memory(self._shm_lst, unlink=True)
+        self._shm_lst = []
+
+
+def _init_worker(worker_spec=None) -> None:
+    """
+    Initializer of each worker process, attaching the shared arrays and rebuilding the inputs shared by all work units.
+    """
+    shm_lst, array_dic = attach_arrays(worker_spec['spec_dic'])
+    gd = GraphDataset(topo_df=worker_spec['topo_df'], \
+                      relationship_to_flow=worker_spec['relationship_to_flow'], \
+                      simulated_nodes=worker_spec['simulated_nodes'])
+    gd.set_flow_operator(FlowOperator.from_arrays({name[len('flow_'):]: array for name, array in array_dic.items() \
+                                                   if name.startswith('flow_')}))
+    # Work units only read the index and isOffHour of the anomaly labels, hence compact ones
+    anomaly_label_lst = [get_anomaly_label_df(pd.DatetimeIndex(array_dic[f'label_{i}_Timestamp'].view('M8[ns]'), freq=freq, name='Timestamp'), \
+                                              array_dic[f'label_{i}_isAnomaly'], \
+                                              array_dic[f'label_{i}_isOffHour'], \
+                                              compact=True) \
+                         for i, freq in enumerate(worker_spec['label_freq_lst'])]
+    _worker_context.update({'shm_lst': shm_lst, \
+                            'gd': gd, \
+                            'anomaly_label_lst': anomaly_label_lst, \
+                            'surge_start_end_indices_lst': worker_spec['surge_start_end_indices_lst'], \
+                            'simulate_ts_kwargs_dic': worker_spec['simulate_ts_kwargs_dic']})
+
+
+def _run_unit(unit=None, chunk_range=None, rng=None, state=None, context=None) -> tuple:
+    """
+    Simulate one work unit over a time chunk, returning its dataframe along with its advanced random generator and running state.
+    """
+    context = _worker_context if context is None else context
+    profile, i = unit
+    # Either a random generator shared by the whole unit, or the random generators of each series
+    rng, series_rng = (None, rng) if isinstance(rng, SeriesRng) else (rng, None)
+    kwargs = context['simulate_ts_kwargs_dic'][profile]
+    anomaly_label_lst = context['anomaly_label_lst']
+    chunk_anomaly_label_lst = [anomaly_label.iloc[slice(*get_chunk_positions(anomaly_label.index, chunk_range))] \
+                               for anomaly_label in anomaly_label_lst]
+    unit_df = None
+    if profile == 'continuous' and not chunk_anomaly_label_lst[0].empty:
+        unit_df = get_cont_ts_df(unique_anomaly_label=kwargs['unique_anomaly_label'], \
+                                 anomaly_label_lst=chunk_anomaly_label_lst, \
+                                 surge_start_end_indices_lst=context['surge_start_end_indices_lst'], \
+                                 simulate_surge_lst=kwargs['simulate_surge_lst_lst'][i], \
+                                 surge_ratio_range_lst=kwargs['surge_ratio_range_lst_lst'][i], \
+                                 normal_mean_range_lst=kwargs['normal_mean_range_lst_lst'][i], \
+                                 normal_std_lst=kwargs['normal_std_lst_lst'][i], \
+                                 gd=context['gd'], \
+                                 key_name=kwargs['key_name_lst'][i], \
+                                 missing_ratio=kwargs['missing_ratio_lst'][i], \
+                                 value_noise=kwargs['value_noise_lst'][i], \
+                                 timestamp_noise=kwargs['timestamp_noise_lst'][i], \
+                                 surge_with_decay=kwargs['surge_with_decay_lst'][i], \
+                                 state=state, \
+                                 exact_missing=kwargs.get('exact_missing', True), \
+                                 rng=rng, \
+                                 series_rng=series_rng)
+    elif profile == 'monotonic' and not chunk_anomaly_label_lst[0].empty:
+        unit_df = get_monotonic_ts_df(unique_anomaly_label=kwargs['unique_anomaly_label'], \
+                                      anomaly_label_lst=chunk_anomaly_label_lst, \
+                                      surge_start_end_indices_lst=context['surge_start_end_indices_lst'], \
+                                      simulate_surge_lst=kwargs['simulate_surge_lst_lst'][i], \
+                                      surge_ratio_range_lst=kwargs['surge_ratio_range_lst_lst'][i], \
+                                      normal_mean_range_lst=kwargs['normal_mean_range_lst_lst'][i], \
+                                      normal_std_lst=kwargs['normal_std_lst_lst'][i], \
+                                      gd=context['gd'], \
+                                      key_name=kwargs['key_name_lst'][i], \
+                                      missing_ratio=kwargs['missing_ratio_lst'][i], \
+                                      value_noise=kwargs['value_noise_lst'][i], \
+                                      timestamp_noise=kwargs['timestamp_noise_lst'][i], \
+                                      state=state, \
+                                      exact_missing=kwargs.get('exact_missing', True), \
+                                      rng=rng, \
+                                      series_rng=series_rng)
+    elif profile == 'categorical':
+        unit_df = get_cat_ts_df(anomaly_label_lst=anomaly_label_lst, \
+                                num_simulated_ts=kwargs['num_simulated_ts'], \
+                                freq_lst=kwargs['freq_lst'], \
+                                id_name_lst=kwargs['id_name_lst'], \
+                                key_name_lst=kwargs['key_name_lst'], \
+                                cat_names_lst=kwargs['cat_names_lst'], \
+                                cat_ratio_lst=kwargs['cat_ratio_lst'], \
+                                missing_ratio_lst=kwargs['missing_ratio_lst'], \
+                                timestamp_noise_lst=kwargs['timestamp_noise_lst'], \
+                                exact_ratio=kwargs.get('exact_ratio', True), \
+                                chunk_range=chunk_range, \
+                                rng=rng, \
+                                series_rng=series_rng)
+    elif profile == 'binary':
+        unit_df = get_binary_ts_df(**kwargs, \
+                                   chunk_range=chunk_range, \
+                                   state=state, \
+                                   rng=rng, \
+                                   series_rng=series_rng)
+    return unit_df, rng if series_rng is None else series_rng, state
@@ -0,0 +1,273 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+import argparse
+import json
+from pathlib import Path
+import numpy as np
+import pandas as pd
+import yaml
+
+TOPOLOGY_SHAPES = ['tree', 'layered', 'random']
+
+def generate_topology(n_nodes=None, \
+                      shape='tree', \
+                      n_sources=2, \
+                      fan_out=3, \
+                      fan_in_range=[1, 2], \
+                      window=None, \
+                      redundant_ratio=0, \
+                      node_prefix='N', \
+                      source_model='sourcemachine', \
+                      feed_model='feedmachine', \
+                      seed=None) -> tuple:
+    """
+    Generate the topology of a large synthetic system, as 'isParent' relationships forming a DAG top-down from the source twins,
+    plus 'isRedundant' cross-links in both directions between twins sharing a parent, along with the twins of each DTDL model.
+    Twins are numbered in topological order, i.e. every parent has a smaller number than its children.
+
+    Parameters
+    ----------
+    n_nodes : number of twins,
+        int (e.g. 100000)
+    shape : shape of the 'isParent' DAG,
+        'tree': every twin but the sources has one parent, and each twin has fan_out children in turn, breadth-first,
+        'layered': layers growing by a factor fan_out/mean fan-in from the n_sources sources, where each twin draws its parents from the previous layer,
+        'random': each twin draws its parents from the window twins numbered right before it, so that the mean fan-out is the mean fan-in,
+        str, default='tree'
+    n_sources : number of source twins, which have no parent and are the twins to simulate,
+        int, default=2
+    fan_out : number of children of each twin for 'tree', or mean number of children for 'layered',
+        int, default=3
+    fan_in_range : range of the number of parents of each twin but the sources, drawn uniformly, for 'layered' and 'random',
+        list of int, default=[1, 2]
+    window : number of twins numbered right before each twin to draw its parents from for 'random', if not given then 4 times the largest fan-in,
+        int, default=None
+    redundant_ratio : number of 'isRedundant' cross-links per twin, each between two twins sharing a parent, fewer if not enough such pairs exist,
+        float, default=0
+    node_prefix : prefix of the twin ids, followed by the twin number zero-padded to the same width,
+        str, default='N'
+    source_model, feed_model : displayName of the DTDL models of the source twins and of the other twins,
+        str, default='sourcemachine', 'feedmachine'
+    seed : random seed to reproduce results,
+        int, default=None
+
+    Return
+    ----------
+    topo_df : topology table with columns=['relationshipName', 'sourceId', 'targetId'],
+        pd.DataFrame
+    model_twins_dic : twins of each model, as model_twins_dic of init_graph_kwargs,
+        dict of list of str
+    """
+    if shape not in TOPOLOGY_SHAPES:
+        raise ValueError(f"Unknown shape '{shape}', please use one of {TOPOLOGY_SHAPES}")
+    if not 0 < n_sources <= n_nodes:
+        raise ValueError(f'n_sources must be between 1 and n_nodes={n_nodes}, got {n_sources}')
+    rng = np.random.default_rng(seed)
+    node_names = get_node_names(n_nodes=n_nodes, node_prefix=node_prefix)
+    children = np.arange(n_sources, n_nodes)
+
+    if shape == 'tree':
+        parents = (children - n_sources) // fan_out
+    else:
+        if shape == 'layered':
+            layer_starts = get_layer_starts(n_nodes=n_nodes, n_sources=n_sources, fan_out=fan_out, mean_fan_in=np.mean(fan_in_range))
+            # Each twin draws its parents from the previous layer
+            layer_idx = np.searchsorted(layer_starts, children, side='right') - 1
+            candidate_starts = layer_starts[layer_idx - 1]
+            candidate_sizes = layer_starts[layer_idx] - candidate_starts
+        else:
+            window = 4 * fan_in_range[1] if window is None else window
+            candidate_starts = np.maximum(children - window, 0)
+            candidate_sizes = children - candidate_starts
+        parent_mat, fan_ins = draw_distinct_parents(candidate_starts=candidate_starts, \
+                                                    candidate_sizes=candidate_sizes, \
+                                                    fan_in_range=fan_in_range, \
+                                                    rng=rng)
+        is_edge = np.arange(parent_mat.shape[1]) < fan_ins[:, None]
+        parents = parent_mat[is_edge]
+        children = np.repeat(children, fan_ins)
+
+    edge_lst = [('isParent', parents, children)]
+    if redundant_ratio > 0:
+        edge_lst.append(('isRedundant', *draw_sibling_pairs(parents=parents, \
+                                                             children=children, \
+                                                             n_pairs=int(round(redundant_ratio * n_nodes)), \
+                                                             rng=rng)))
+    topo_df = pd.DataFrame({'relationshipName': np.concatenate([np.full(len(sources), name, dtype=object) for name, sources, _ in edge_lst]), \
+                            'sourceId': node_names[np.concatenate([sources for _, sources, _ in edge_lst])], \
+                            'targetId': node_names[np.concatenate([targets for _, _, targets in edge_lst])]})
+    model_twins_dic = {source_model: node_names[:n_sources].tolist(), \
+                       feed_model: node_names[n_sources:].tolist()}
+    return topo_df, model_twins_dic
+
+
+def get_node_names(n_nodes=None, node_prefix='N') -> np.array:
+    """
+    Helper function to name n_nodes twins by their number, zero-padded to the same width so that names sort as numbers.
+
+    Parameters
+    ----------
+    n_nodes : number of twins,
+        int
+    node_prefix : prefix of the twin ids,
+        str, default='N'
+
+    Return
+    ----------
+    node_names : twin ids,
+        np.array of str (object)
+    """
+    width = len(str(max(n_nodes - 1, 0)))
+    return np.char.add(node_prefix, np.char.zfill(np.arange(n_nodes).astype(str), width)).astype(object)
+
+
+def get_layer_starts(n_nodes=None, n_sources=None, fan_out=None, mean_fan_in=None) -> np.array:
+    """
+    Helper function to split twins into layers, the first one holding the sources and each next one fan_out/mean_fan_in times larger
+    than the previous one (at least one twin), the last one being truncated to n_nodes twins in total.
+
+    Return
+    ----------
+    layer_starts : number of the first twin of each layer, followed by n_nodes,
+        np.array of int
+    """
+    layer_starts = [0, n_sources]
+    while layer_starts[-1] < n_nodes:
+        layer_size = layer_starts[-1] - layer_starts[-2]
+        layer_starts.append(min(layer_starts[-1] + max(int(round(layer_size * fan_out / mean_fan_in)), 1), n_nodes))
+    return np.array(layer_starts)
+
+
+def draw_distinct_parents(candidate_starts=None, candidate_sizes=None, fan_in_range=None, rng=None) -> tuple:
+    """
+    Draw the parents of twins, each drawing a uniform number of distinct parents within fan_in_range out of its candidates
+    [candidate_start, candidate_start + candidate_size). Parents are drawn with replacement at once, then the twins which drew
+    the same parent twice draw again, which only concerns a few twins as long as the candidates outnumber the parents.
+
+    Parameters
+    ----------
+    candidate_starts : number of the first candidate parent of each twin,
+        np.array of int
+    candidate_sizes : number of candidate parents of each twin, at least 1,
+        np.array of int
+    fan_in_range : range of the number of parents of each twin, capped by its number of candidates,
+        list of int
+    rng : random generator to draw from,
+        np.random.Generator
+
+    Return
+    ----------
+    parent_mat : parents of each twin as a row, of which only the first fan_in entries are meaningful,
+        np.array of int
+    fan_ins : number of parents of each twin,
+        np.array of int
+    """
+    max_fan_in = fan_in_range[1]
+    fan_ins = np.minimum(rng.integers(fan_in_range[0], max_fan_in + 1, len(candidate_starts)), candidate_sizes)
+    is_edge = np.arange(max_fan_in) < fan_ins[:, None]
+    # Twins taking all their candidates as parents need no draw
+    is_full = fan_ins == candidate_sizes
+    parent_mat = candidate_starts[:, None] + np.minimum(np.arange(max_fan_in), candidate_sizes[:, None] - 1)
+    redraw = ~is_full
+    while redraw.any():
+        rows = np.flatnonzero(redraw)
+        parent_mat[rows] = candidate_starts[rows, None] + rng.integers(0, candidate_sizes[rows, None], (len(rows), max_fan_in))
+        # Unused entries get distinct negative values, so that only duplicated parents compare equal once sorted
+        sorted_mat = np.sort(np.where(is_edge[rows], parent_mat[rows], -1 - np.arange(max_fan_in)), axis=1)
+        redraw[rows] = (sorted_mat[:, 1:] == sorted_mat[:, :-1]).any(axis=1)
+    return parent_mat, fan_ins
+
+
+def draw_sibling_pairs(parents=None, children=None, n_pairs=None, rng=None) -> tuple:
+    """
+    Draw up to n_pairs distinct pairs of twins sharing a parent, each pair as a relationship in both directions.
+
+    Parameters
+    ----------
+    parents, children : parent and child of each 'isParent' relationship,
+        np.array of int
+    n_pairs : number of pairs to draw,
+        int
+    rng : random generator to draw from,
+        np.random.Generator
+
+    Return
+    ----------
+    sources, targets : twins of each relationship,
+        np.array of int
+    """
+    # Consecutive children of the same parent once sorted by parent are siblings
+    order = np.lexsort((children, parents))
+    sorted_parents, sorted_children = parents[order], children[order]
+    sibling_positions = np.flatnonzero(sorted_parents[1:] == sorted_parents[:-1])
+    pair_positions = rng.choice(sibling_positions, min(n_pairs, len(sibling_positions)), replace=False)
+    # Siblings under several common parents are drawn once
+    pair_mat = np.unique(np.stack([sorted_children[pair_positions], sorted_children[pair_positions + 1]], axis=1), axis=0)
+    return np.concatenate([pair_mat[:, 0], pair_mat[:, 1]]), np.concatenate([pair_mat[:, 1], pair_mat[:, 0]])
+
+
+def write_topology_json(topo_df=None, topo_json_file=None) -> None:
+    """
+    Write a topology table as the topology json file read by function main() (topo_json_file of init_graph_kwargs),
+    i.e. {"topology": [{"relationshipName": ..., "sourceId": ..., "targetId": ...}, ...]} laid out as json.dump(indent=4),
+    formatting each distinct id once instead of serializing one dict per relationship.
+
+    Parameters
+    ----------
+    topo_df : topology table with columns=['relationshipName', 'sourceId', 'targetId'],
+        pd.DataFrame
+    topo_json_file : path of the topology json file,
+        str
+
+    Return
+    ----------
+    None
+    """
+    columns = ['relationshipName', 'sourceId', 'targetId']
+    codes, uniques = pd.factorize(pd.concat([topo_df[col] for col in columns], ignore_index=True))
+    json_uniques = np.array([json.dumps(value) for value in uniques], dtype=object)
+    json_col_lst = [json_uniques[col_codes] for col_codes in codes.reshape(len(columns), -1)]
+    item_lst = [f'        {{\n            "relationshipName": {name},\n            "sourceId": {source},\n            "targetId": {target}\n        }}' \
+                for name, source, target in zip(*json_col_lst)]
+    Path(topo_json_file).parent.mkdir(parents=True, exist_ok=True)
+    with open(topo_json_file, 'w') as f:
+        if len(item_lst) == 0:
+            f.write('{\n    "topology": []\n}')
+        else:
+            f.write('{\n    "topology": [\n' + ',\n'.join(item_lst) + '\n    ]\n}')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Generate a large synthetic topology json file, along with the init_graph_kwargs to paste into config.yaml.')
+    parser.add_argument('--n-nodes', type=int, required=True, help='number of twins')
+    parser.add_argument('--shape', choices=TOPOLOGY_SHAPES, default='tree', help='shape of the isParent DAG')
+    parser.add_argument('--n-sources', type=int, default=2, help='number of source twins to simulate')
+    parser.add_argument('--fan-out', type=int, default=3, help="number of children of each twin ('tree'), or mean number of children ('layered')")
+    parser.add_argument('--fan-in', type=int, nargs=2, default=[1, 2], help="range of the number of parents of each twin ('layered' and 'random')")
+    parser.add_argument('--window', type=int, default=None, help="number of twins before each twin to draw its parents from ('random')")
+    parser.add_argument('--redundant-ratio', type=float, default=0, help='number of isRedundant cross-links per twin')
+    parser.add_argument('--seed', type=int, default=2022, help='random seed')
+    parser.add_argument('--output', default=None, help='topology json file, by default ../data/topology_json/topology_{shape}_{n_nodes}.json')
+    args = parser.parse_args()
+
+    topo_json_file = args.output or f'../data/topology_json/topology_{args.shape}_{args.n_nodes}.json'
+    topo_df, model_twins_dic = generate_topology(n_nodes=args.n_nodes, \
+                                                 shape=args.shape, \
+                                                 n_sources=args.n_sources, \
+                                                 fan_out=args.fan_out, \
+                                                 fan_in_range=args.fan_in, \
+                                                 window=args.window, \
+                                                 redundant_ratio=args.redundant_ratio, \
+                                                 seed=args.seed)
+    write_topology_json(topo_df=topo_df, topo_json_file=topo_json_file)
+    init_graph_kwargs = {'topo_json_file': topo_json_file, \
+                         'relationship_to_flow': 'isParent', \
+                         'simulated_nodes': list(model_twins_dic['sourcemachine']), \
+                         'model_twins_dic': model_twins_dic, \
+                         'models_json_folder': '../data/models_json/'}
+    graph_kwargs_file = str(Path(topo_json_file).with_suffix('')) + '_graph_kwargs.yaml'
+    with open(graph_kwargs_file, 'w') as f:
+        yaml.safe_dump({'init_graph_kwargs': init_graph_kwargs}, f, default_flow_style=None, sort_keys=False)
+    print(f"Topology of {args.n_nodes} twins with {topo_df['relationshipName'].value_counts().to_dict()} relationships written to {topo_json_file}")
+    print(f'init_graph_kwargs written to {graph_kwargs_file}')
@@ -7,7 +7,7 @@ import pandas as pd
 from scipy.stats import beta
 
 
-def gen_beta_anom(series, a=2, b=5, scale_fac=0.5, surge_or_dip="surge"):
+def gen_beta_anom(series, a=2, b=5, scale_fac=0.5, surge_or_dip="surge", n_pts_before=0, n_pts_total=None):
     """Generates a curvy line, exponentially decaying, to present anomaly surge or dip,
      that of shape defined by the pdf of a beta-distribution parameterized by a & b
     Args:
@@ -17,11 +17,14 @@ def gen_beta_anom(series, a=2, b=5, scale_fac=0.5, surge_or_dip="surge"):
                       and vice-versa
         scale_fac, float: factor by which to rescale the generated beta pdf
         surge_or_dip, str: "surge" or "dip" to denote if curve is concave or convex
+        n_pts_before, n_pts_total (int): when series is only part of the anomaly occurrence (e.g. split across time chunks),
+                                         number of datapts of the occurrence before series, and in total
     Returns:
         series, Pandas.series: series with ts values with anomalous behavior
     """
 
-    x = np.linspace(0, 1, len(series))
+    n_pts_total = n_pts_total or len(series)
+    x = np.linspace(0, 1, n_pts_total)[n_pts_before : n_pts_before + len(series)]
     pdf = scale_fac * (beta.pdf(x, a, b)) + 1
     if surge_or_dip == "surge":
         series *= pdf
@@ -51,6 +54,8 @@ def gen_cosine_trend(
     sigma_coeff=2,
     n_pts_bufferstart=0,
     n_pts_bufferend=0,
+    rng=None,
+    n_series=None,
 ):
     """Generate a sinusoidal TS shape that consists of an imperfect cosine wave superposed with a piece-wise linear trend line.
         Sum of `gen_cosine_imperfect` and `gen_pw_lineaer_trend` methods
@@ -66,8 +71,10 @@ def gen_cosine_trend(
         coeff_max, coeff_min (float): range of coeff values from which to sample the coeffs
         sigma, float: parameter to determine the stdev if normal distribution used for trend line coefficient sampling
         n_pts_bufferstart, n_pts_bufferend (int): number of data-points at the start and end to set to zero
+        rng, np.random.Generator: random generator to draw from, if None then draw from the global random state
+        n_series, int: number of series to generate at once as rows of a 2D array (e.g. one per day), if None a 1D array is returned
     Returns:
-        ans, np.array: 1D array consisting value of generated sinusoidal wave
+        ans, np.array: 1D array (2D array of shape (n_series, n_datapts)) consisting value of generated sinusoidal wave
     """
 
     sine_wave = gen_cosine_imperfect(
@@ -81,6 +88,8 @@ def gen_cosine_trend(
         noise_min=noise_min,
         noise_max=noise_max,
         sigma=sigma,
+        rng=rng,
+        n_series=n_series,
     )
     trend = _gen_pw_linear_trend(
         n_datapts,
@@ -92,6 +101,8 @@ def gen_cosine_trend(
         sigma=sigma_coeff,
         n_pts_bufferstart=n_pts_bufferstart,
         n_pts_bufferend=n_pts_bufferend,
+        rng=rng,
+        n_series=n_series,
     )
 
     ans = sine_wave + trend
@@ -130,32 +141,41 @@ def gen_cosine_imperfect(
     noise_min=-1,
     noise_max=2,
     sigma=2,
+    rng=None,
+    n_series=None,
 ):
     """Generate a sinusoidal TS shape that consists of a cosine wave, made imperfect with some randomly-sampled noise added per small segments across the wave
     Args:
         n_datapts, int: number of datapts in TS to generate
-        sine_mean, amplitude, sine_period, theta (float): params for creating cosine wave
+        sine_mean, amplitude, sine_period (float): params for creating cosine wave
+        theta, float or np.array: phase of cosine wave, or one phase per series if n_series given
         sinebkpt_factor, int: factor representing the number of data-points within a small segment, for which noise is sampled and added
         noise_dist, str:"uniform" or "normal" distribution
         noise_min, noise_max, sigma (int): params to determine amplitude of added noise, and stdev if normal distribution used
+        rng, np.random.Generator: random generator to draw from, if None then draw from the global random state
+        n_series, int: number of series to generate at once as rows of a 2D array (e.g. one per day), if None a 1D array is returned
     Returns:
-        sinewave, np.array: 1D array consisting value of generated sinusoidal wave
+        sinewave, np.array: 1D array (2D array of shape (n_series, n_datapts)) consisting value of generated sinusoidal wave
     """
+    n_rows = 1 if n_series is None else n_series
     time = np.arange(n_datapts)
     frequency = 1 / sine_period
+    theta = np.broadcast_to(np.reshape(theta, (-1, 1)), (n_rows, 1))
     sinewave = sine_mean + amplitude * -1 * np.cos(
         2 * np.pi * frequency * (time + theta)
     )
 
+    # Noise is constant within each small segment, drawn row after row
     n_bpkts = int(n_datapts / sinebkpt_factor)
-    bkps = _draw_bkps(len(sinewave), n_bpkts)
-    noise1 = _gen_samples(noise_dist, len(bkps), noise_min, noise_max, sigma)
-
-    for i, sub in enumerate(np.split(sinewave, bkps)):
-        if sub.size > 0:
-            sub += noise1[i]
+    bkps_lst, noise_lst = [], []
+    for _ in range(n_rows):
+        bkps_lst.append(_draw_bkps(n_datapts, n_bpkts, rng=rng))
+        noise_lst.append(
+            _gen_samples(noise_dist, n_bpkts + 1, noise_min, noise_max, sigma, rng=rng)
+        )
+    sinewave += _repeat_segments(np.array(noise_lst), np.array(bkps_lst))
 
-    return sinewave
+    return sinewave if n_series is not None else sinewave[0]
 
 
 def gen_pw_concave_trend(
@@ -172,6 +192,8 @@ def gen_pw_concave_trend(
     scale_2ndhalf_zero=False,
     date=None,
     trend_val_max=0.5,
+    rng=None,
+    n_series=None,
 ):
     """Generate a piece-wise linear trend line, that is concave or convex, i.e. over time ramps up from zero, then has little fluctuation, then ramps down to zero.
         This is done by sampling the coefficients of each of the piece-wise line segments, which can be grouped into these 3 major sections
@@ -189,20 +211,23 @@ def gen_pw_concave_trend(
         scale_2ndhalf_zero, boolean: whether to scale 2nd half of trend line, so that last valueit ends up at zero
         date, datetime.date: date passed on, to print out in case of error msg
         trend_val_max, float: maximum trend value to which to reduce any values exceeding that
+        rng, np.random.Generator: random generator to draw from, if None then draw from the global random state
+        n_series, int: number of series to generate at once as rows of a 2D array (e.g. one per day), if None a 1D array is returned
     Returns:
-        y_all, np.array: array for trend line values
+        y_all, np.array: array for trend line values, of shape (n_series, n_datapts) if n_series given
     """
+    n_rows = 1 if n_series is None else n_series
     n_bkps = int(n_datapts / trendbkpt_factor)
-    bkps = _draw_bkps(n_datapts, n_bkps)
-    x_arr = np.arange(n_datapts)
 
     # print(f'n_datapts":{n_datapts}, n_bkps:{n_bkps}, buffer_itval:{buffer_itval}')
     # assert n_bkps-2*buffer_itval>buffer_itval # make sure there are enough in the middle section
     if n_bkps - 2 * buffer_itval < buffer_itval:
+        for _ in range(n_rows):  # Keep the random stream in step with the regular case
+            _draw_bkps(n_datapts, n_bkps, rng=rng)
         print(
             f"For date:{date}, not enough datapoints to do pw concave trend, n_datapoints:{n_datapts}"
         )
-        return np.zeros(x_arr.shape)
+        return np.zeros((n_rows, n_datapts) if n_series is not None else n_datapts)
 
     if concavity == "concave":
         coeff_max, coeff_min = [coeff_val, coeff_val / coeff_mid_factor, 0], [
@@ -219,51 +244,46 @@ def gen_pw_concave_trend(
     else:
         raise Exception("Try concave or convex")
 
-    coeffs = []
-    seg_1 = _gen_samples(coeff_dist, buffer_itval, coeff_min[0], coeff_max[0], sigma)
-    coeffs.extend(seg_1)
-    coeffs.extend(
-        _gen_samples(
-            coeff_dist, len(bkps) - 2 * buffer_itval, coeff_min[1], coeff_max[1], sigma
-        )
-    )
-    seg_3 = seg_1.copy()
-    random.shuffle(seg_3)
-    seg_3 = -1 * seg_3
-    coeffs.extend(seg_3)
-
-    n_indices = [buffer_itval, len(bkps) - 2 * (buffer_itval), buffer_itval]
-    for i, (coeff_i_min, coeff_i_max) in enumerate(zip(coeff_min, coeff_max)):
-        ans1 = _gen_samples(coeff_dist, n_indices[i], coeff_i_min, coeff_i_max, sigma)
-        coeffs.extend(ans1)
-
-    yintercepts = [start_coeff]
-    y_all = np.zeros(x_arr.shape)
-    for i, val in enumerate(bkps):
-        if i == 0:
-            y_all[range(0, val, 1)] = coeffs[i] * x_arr[range(0, val, 1)] + start_coeff
-        else:
-            yintercepts.append(
-                (coeffs[i - 1] - coeffs[i]) * x_arr[bkps[i - 1]] + yintercepts[i - 1]
-            )
-            y_all[range(bkps[i - 1], val, 1)] = (
-                coeffs[i] * x_arr[range(bkps[i - 1], val, 1)] + yintercepts[i]
+    # Sample the breakpoints and the coefficients of each line segment, row after row
+    bkps_lst, coeffs_lst = [], []
+    for _ in range(n_rows):
+        bkps = _draw_bkps(n_datapts, n_bkps, rng=rng)
+        coeffs = []
+        seg_1 = _gen_samples(coeff_dist, buffer_itval, coeff_min[0], coeff_max[0], sigma, rng=rng)
+        coeffs.extend(seg_1)
+        coeffs.extend(
+            _gen_samples(
+                coeff_dist, len(bkps) - 2 * buffer_itval, coeff_min[1], coeff_max[1], sigma, rng=rng
             )
+        )
+        seg_3 = seg_1.copy()
+        (random if rng is None else rng).shuffle(seg_3)
+        seg_3 = -1 * seg_3
+        coeffs.extend(seg_3)
+
+        n_indices = [buffer_itval, len(bkps) - 2 * (buffer_itval), buffer_itval]
+        for i, (coeff_i_min, coeff_i_max) in enumerate(zip(coeff_min, coeff_max)):
+            ans1 = _gen_samples(coeff_dist, n_indices[i], coeff_i_min, coeff_i_max, sigma, rng=rng)
+            coeffs.extend(ans1)
+        bkps_lst.append(bkps)
+        coeffs_lst.append(coeffs[: len(bkps)])
+
+    y_all = _gen_pw_linear(np.array(coeffs_lst), np.array(bkps_lst), start_coeff)
 
     if scale_2ndhalf_zero:  # Scale so that 2nd half goes to zero
-        y_all[-int(len(y_all) / 2) :] = y_all[-int(len(y_all) / 2) :] - y_all[-1]
+        y_all[:, -int(n_datapts / 2) :] = y_all[:, -int(n_datapts / 2) :] - y_all[:, -1:]
 
     if trend_shift_max is not None:
         if concavity == "concave":
-            y_all = y_all / (max(y_all) / trend_shift_max)
+            y_all = y_all / (y_all.max(axis=1, keepdims=True) / trend_shift_max)
         elif concavity == "convex":
-            y_all = y_all / (min(y_all) / trend_shift_max)
+            y_all = y_all / (y_all.min(axis=1, keepdims=True) / trend_shift_max)
         else:
             raise Exception("Try concave or convex")
     # Correction for too positive trend value:
     y_all[y_all > trend_val_max] = trend_val_max
 
-    return y_all
+    return y_all if n_series is not None else y_all[0]
 
 
 def _gen_pw_linear_trend(
@@ -276,6 +296,8 @@ def _gen_pw_linear_trend(
     sigma=2,
     n_pts_bufferstart=0,
     n_pts_bufferend=0,
+    rng=None,
+    n_series=None,
 ):
     #     coeff_max=1.0, coeff_min=-0.1,
     """Generate a piece-wise linear trend line. This is done by sampling the coefficients of each of the piece-wise line segments.
@@ -287,39 +309,69 @@ def _gen_pw_linear_trend(
         coeff_max, coeff_min (float): range of coeff values from which to sample the coeffs
         sigma, float: parameter to determine the stdev if normal distribution used
         n_pts_bufferstart, n_pts_bufferend (int): number of data-points at the start and end to set to zero
+        rng, np.random.Generator: random generator to draw from, if None then draw from the global random state
+        n_series, int: number of series to generate at once as rows of a 2D array (e.g. one per day), if None a 1D array is returned
 
     """
+    n_rows = 1 if n_series is None else n_series
     n_bkps = int(n_datapts / trendbkpt_factor)
-    bkps = _draw_bkps(n_datapts, n_bkps)
-    x_arr = np.arange(n_datapts)
+    bkps_lst, coeffs_lst = [], []
+    for _ in range(n_rows):
+        bkps_lst.append(_draw_bkps(n_datapts, n_bkps, rng=rng))
+        coeffs_lst.append(
+            _gen_samples(coeff_dist, n_bkps + 1, coeff_min, coeff_max, sigma, rng=rng)
+        )
+    y_all = _gen_pw_linear(np.array(coeffs_lst), np.array(bkps_lst), start_coeff)
 
-    coeffs = _gen_samples(coeff_dist, len(bkps), coeff_min, coeff_max, sigma)
+    # do buffer at start and end, so that no strong jumps
+    y_all[:, :n_pts_bufferstart], y_all[:, -n_pts_bufferend:] = 0, 0
+    return y_all if n_series is not None else y_all[0]
 
-    yintercepts = [start_coeff]
-    y_all = np.zeros(x_arr.shape)
-    for i, val in enumerate(bkps):
-        if i == 0:
-            y_all[range(0, val, 1)] = coeffs[i] * x_arr[range(0, val, 1)] + start_coeff
-        else:
-            yintercepts.append(
-                (coeffs[i - 1] - coeffs[i]) * x_arr[bkps[i - 1]] + yintercepts[i - 1]
-            )
-            y_all[range(bkps[i - 1], val, 1)] = (
-                coeffs[i] * x_arr[range(bkps[i - 1], val, 1)] + yintercepts[i]
-            )
 
-    # do buffer at start and end, so that no strong jumps
-    y_all[:n_pts_bufferstart], y_all[-n_pts_bufferend:] = 0, 0
-    return y_all
+def _gen_pw_linear(coeffs, bkps, start_coeff):
+    """Build continuous piece-wise linear lines from the gradient coefficient of each segment, one line per row.
+    The y-intercept of each segment follows from the previous one so that consecutive segments meet at the breakpoint,
+    i.e. the y-intercepts are the cumulative sum of the jumps (coeffs[i-1]-coeffs[i])*bkps[i-1] starting from start_coeff
+    Args:
+        coeffs, np.array: gradient coefficients of shape (n_rows, n_segments)
+        bkps, np.array: end index (exclusive) of each segment of shape (n_rows, n_segments), the last one being the number of datapts
+        start_coeff, float: y-intersect of the first segment
+    Returns:
+        y_all, np.array: 2D array of shape (n_rows, n_datapts) for line values
+    """
+    yintercepts = np.cumsum(
+        np.column_stack(
+            [
+                np.full(coeffs.shape[0], float(start_coeff)),
+                (coeffs[:, :-1] - coeffs[:, 1:]) * bkps[:, :-1],
+            ]
+        ),
+        axis=1,
+    )
+    x_arr = np.arange(bkps[0, -1])
+    return _repeat_segments(coeffs, bkps) * x_arr + _repeat_segments(yintercepts, bkps)
+
+
+def _repeat_segments(values, bkps):
+    """Spread the value of each segment over its datapts, one row per series.
+    Args:
+        values, np.array: value of each segment of shape (n_rows, n_segments)
+        bkps, np.array: end index (exclusive) of each segment of shape (n_rows, n_segments), the last one being the number of datapts
+    Returns:
+        2D array of shape (n_rows, n_datapts)
+    """
+    seg_lengths = np.diff(bkps, axis=1, prepend=0)
+    return np.repeat(values.ravel(), seg_lengths.ravel()).reshape(values.shape[0], -1)
 
 
-def _gen_samples(coeff_dist, n_pts, coeff_min, coeff_max, sigma):
+def _gen_samples(coeff_dist, n_pts, coeff_min, coeff_max, sigma, rng=None):
     """Randomly sample `n_pts` from `coeff_dist` distribution, sampling from range between coeff_min and coeff_max.
     Note that for normal dist, the stdev is calculated such that 95% of the samples come from within that range"""
+    rng = np.random if rng is None else rng
     if coeff_dist == "uniform":
-        coeffs = np.random.uniform(coeff_min, coeff_max, n_pts)
+        coeffs = rng.uniform(coeff_min, coeff_max, n_pts)
     elif coeff_dist == "normal":
-        coeffs = np.random.normal(
+        coeffs = rng.normal(
             0.5 * (coeff_max + coeff_min),
             abs(coeff_max - coeff_min) / (2 * sigma),
             n_pts,
@@ -330,10 +382,10 @@ def _gen_samples(coeff_dist, n_pts, coeff_min, coeff_max, sigma):
     return coeffs
 
 
-def _draw_bkps(n_samples=100, n_bkps=3, seed=None):
+def _draw_bkps(n_samples=100, n_bkps=3, seed=None, rng=None):
     """Draw a random partition with specified number of samples and specified
     number of changes, adapted from https://github.com/deepcharles/ruptures/blob/master/src/ruptures/utils/drawbkps.py"""
-    rng = np.random.default_rng(seed=seed)
+    rng = np.random.default_rng(seed=seed) if rng is None else rng
     alpha = np.ones(n_bkps + 1) / (n_bkps + 1) * 2000
     bkps = np.cumsum(rng.dirichlet(alpha) * n_samples).astype(int).tolist()
     bkps[-1] = n_samples  # -1
@@ -0,0 +1,124 @@
+"""utility functions to share the business-hours calendar of regular timestamps amongst all generators, through a bounded LRU cache"""
+
+from functools import lru_cache
+import numpy as np
+import pandas as pd
+from pandas.tseries.frequencies import to_offset
+from utils.utils_data_generation import get_chunk_grid, get_day_index, time_str_to_ns, NS_PER_DAY
+
+# Maximum number of calendars kept in memory, e.g. one per (time range, freq) of each profile and time chunk
+CALENDAR_CACHE_SIZE = 16
+
+
+class Calendar(object):
+    def __init__(self, \
+                 timestamps=None) -> None:
+        """
+        Calendar of sorted timestamps, precomputing once the calendar day, weekday and time of day of every timestamp,
+        so that on/off-hour masks for any start and end of day are cheap to derive. Calendars from function get_calendar()
+        are shared through a cache, hence their arrays are read-only.
+
+        Parameters
+        ----------
+        timestamps : sorted timestamps,
+            pd.DatetimeIndex
+
+        Return
+        ----------
+        None
+        """
+        self.timestamps = timestamps
+        self.timestamps_ns = timestamps.asi8
+        # day_idx: number of the day of each timestamp, day_start_positions: first position of each day followed by the number of timestamps,
+        # days_since_epoch: day ordinal of each day
+        self.day_idx, self.day_start_positions, self.days_since_epoch = get_day_index(self.timestamps_ns)
+        self.ns_of_day = self.timestamps_ns - self.days_since_epoch[self.day_idx] * NS_PER_DAY
+        # 1970-01-01 is a Thursday, so shift by 3 to get Monday=0, ..., Sunday=6
+        self.is_weekend_day = (self.days_since_epoch + 3) % 7 >= 5
+        self.is_weekend = self.is_weekend_day[self.day_idx]
+        # One datetime.date object per day
+        self.dates = pd.to_datetime(self.days_since_epoch * NS_PER_DAY).date
+        for array in [self.day_idx, self.day_start_positions, self.days_since_epoch, self.ns_of_day, \
+                      self.is_weekend_day, self.is_weekend, self.dates]:
+            array.flags.writeable = False
+
+    def get_off_hour_mask(self, \
+                          start_of_day_str=None, \
+                          end_of_day_str=None) -> np.array:
+        """
+        Flag off-hours, i.e. weekends or times of day outside [start_of_day, end_of_day].
+
+        Parameters
+        ----------
+        start_of_day_str, end_of_day_str : start and end time of weekday in the format of h:m:s,
+            str (e.g. '08:00:00')
+
+        Return
+        ----------
+        Boolean mask, True for off-hours,
+            np.array
+        """
+        return self.is_weekend \
+               | (self.ns_of_day < time_str_to_ns(start_of_day_str)) \
+               | (self.ns_of_day > time_str_to_ns(end_of_day_str))
+
+
+def get_calendar(time_range=None, freq=None, chunk_range=None, cached=True) -> Calendar:
+    """
+    Get the calendar of pd.date_range(time_range[0], time_range[1], freq=freq), or of its part falling into a time chunk,
+    as a cached calendar shared with every other caller of the same timestamps.
+
+    Parameters
+    ----------
+    time_range : start and end timestamp of the entire time range,
+        list of str (e.g. ['2022-06-01 00:00:00', '2022-07-01 00:00:00'])
+    freq : updating frequency (sample rate),
+        str (e.g. '5min')
+    chunk_range : [start, end) timestamps of the chunk from function get_chunk_ranges(), if not given then use the entire time range,
+        list of Timestamps, optional
+    cached : whether to get the calendar from the cache, otherwise build a calendar freed as soon as the caller drops it,
+        e.g. for the entire time range when the generators work on time chunks,
+        bool, default=True
+
+    Return
+    ----------
+    calendar : calendar of the timestamps,
+        Calendar
+    """
+    first_timestamp, periods = get_chunk_grid(time_range, freq, chunk_range)
+    if not cached:
+        return _build_calendar(first_timestamp, periods, to_offset(freq))
+    return _get_cached_calendar(first_timestamp, periods, to_offset(freq))
+
+
+def get_index_calendar(timestamps=None, cached=True) -> Calendar:
+    """
+    Get the calendar of given sorted timestamps, e.g. the index of anomaly labels, from the cache if the timestamps are regular.
+
+    Parameters
+    ----------
+    timestamps : sorted timestamps,
+        pd.DatetimeIndex
+    cached : whether to get the calendar from the cache, otherwise build a calendar freed as soon as the caller drops it,
+        e.g. for one-off timestamps which would only push the calendars in use out of the cache,
+        bool, default=True
+
+    Return
+    ----------
+    calendar : calendar of the timestamps,
+        Calendar
+    """
+    if not cached or timestamps.freq is None or timestamps.tz is not None or len(timestamps) == 0:
+        return Calendar(timestamps=timestamps)
+    return _get_cached_calendar(timestamps[0], len(timestamps), timestamps.freq)
+
+
+@lru_cache(maxsize=CALENDAR_CACHE_SIZE)
+def _get_cached_calendar(first_timestamp=None, periods=None, freq=None) -> Calendar:
+    """Helper function to build the calendar of regular timestamps, cached by (first timestamp, number of timestamps, freq)"""
+    return _build_calendar(first_timestamp, periods, freq)
+
+
+def _build_calendar(first_timestamp=None, periods=None, freq=None) -> Calendar:
+    """Helper function to build the calendar of regular timestamps"""
+    return Calendar(timestamps=pd.date_range(first_timestamp, periods=periods, freq=freq, name='Timestamp'))
@@ -3,13 +3,19 @@
 import json
 import os
 from pathlib import Path
-from datetime import timedelta
 from datetime import datetime as dt
 import pandas as pd
 import numpy as np
 from numpy.random import uniform, normal
+from pandas.tseries.frequencies import to_offset
 import plotly.graph_objects as go
 from plotly.subplots import make_subplots
+from utils.utils_plot import get_series_blocks, get_decimated_positions
+
+NS_PER_SECOND = 10**9
+NS_PER_DAY = 86400 * NS_PER_SECOND
+# Color of the bins of MVAD results by confusion class in function plot_ts()
+CONFUSION_COLOR_DIC = {'TN': 'green', 'FN': 'yellow', 'FP': 'grey', 'TP': 'red'}
 
 def generate_relationship_json(
     topo_df=None, save=True, output_data_path=None, output_json_file_name=None, output_csv_file_name=None
@@ -99,7 +105,43 @@ def add_value_noise(x=None, accept_neg=False) -> float:
             return 0
 
 
-def add_timestamp_noise(df=None) -> pd.DataFrame:
+def add_value_noise_mat(mat=None, accept_neg=False, rng=None) -> np.array:
+    """
+    Vectorized counterpart of add_value_noise() applied to every entry of a matrix at once
+
+    Parameters
+    ----------
+    mat : original simulated telemetry values, e.g. solution matrix of shape (nodes, time),
+        np.array
+    accept_neg : whether to accept negative values, if not, replace by 0,
+        bool, default=False
+    rng : random generator to draw from, if not given then draw from the global numpy random state,
+        np.random.Generator, default=None
+
+    Return
+    ----------
+    ret_mat : simulated telemetry with noise added, same shape as mat,
+        np.array
+    """
+    rng = np.random if rng is None else rng
+    ret_mat = np.array(mat, dtype=float)
+    is_zero = ret_mat == 0
+    # Add noise as a random value from normal distribution for non-zero original values
+    is_nonzero = ~is_zero
+    ret_mat[is_nonzero] += rng.normal(0, 0.1, np.count_nonzero(is_nonzero))
+    del is_nonzero
+    if not accept_neg:
+        np.maximum(ret_mat, 0, out=ret_mat)
+    # In a small probability add noise as a random value from normal distribution for zero original values, otherwise keep as zero
+    zero_indices = np.flatnonzero(is_zero)
+    del is_zero
+    zero_indices = zero_indices[rng.uniform(0, 1, zero_indices.shape[0]) <= 0.1]
+    zero_noise = rng.normal(0, 0.05, zero_indices.shape[0])
+    ret_mat.flat[zero_indices] = zero_noise if accept_neg else np.absolute(zero_noise)
+    return ret_mat
+
+
+def add_timestamp_noise(df=None, sort=True, rng=None, max_noise_us=10**6) -> pd.DataFrame:
     """
     Helper function to add timestamp noise to simulated dataframe
 
@@ -107,23 +149,25 @@ def add_timestamp_noise(df=None) -> pd.DataFrame:
     ----------
     df : original dataframe with clean and standard column 'Timestamp',
         pd.DataFrame
+    sort : whether to re-sort the dataframe by the noisy timestamps, can be skipped if the caller sorts or merges afterwards,
+        bool, default=True
+    rng : random generator to draw from, if not given then draw from the global numpy random state,
+        np.random.Generator, default=None
+    max_noise_us : bound of the noise in microseconds, as in get_timestamp_noise(),
+        int, default=10**6
 
     Return
     ----------
     df : dataframe with noisy timestamps,
         pd.DataFrame
     """
-    # Add noise such as fractions of seconds to timestamp
-    df["Microsecond"] = uniform(-(10**6), 10**6, df.shape[0])
-    df["Timestamp"] = df.apply(
-        lambda x: (x["Timestamp"] + timedelta(microseconds=x["Microsecond"])), axis=1
-    )
-    df = df.drop("Microsecond", axis=1)
-    df = df.sort_values("Timestamp").reset_index(drop=True)
+    df["Timestamp"] = df["Timestamp"].values + get_timestamp_noise(df.shape[0], rng, max_noise_us=max_noise_us)
+    if sort:
+        df = df.sort_values("Timestamp").reset_index(drop=True)
     return df
 
 
-def random_drop_rows(df=None, missing_ratio=0) -> pd.DataFrame:
+def random_drop_rows(df=None, missing_ratio=0, rng=None) -> pd.DataFrame:
     """
     Helper function to randomly remove rows from simulated dataframe to create missings
 
@@ -133,20 +177,96 @@ def random_drop_rows(df=None, missing_ratio=0) -> pd.DataFrame:
         pd.DataFrame
     missing_ratio : percentage of missing value of time-series,
         float, default=0
+    rng : random generator to draw from, if not given then draw from the global numpy random state,
+        np.random.Generator, default=None
 
     Return
     ----------
     df : dataframe with certain rows randomly removed,
         pd.DataFrame
     """
-    drop_indices = np.random.choice(
+    rng = np.random if rng is None else rng
+    drop_indices = rng.choice(
         df.index, int(df.shape[0] * missing_ratio), replace=False
     )
     df = df.drop(drop_indices)
     return df
 
 
-def get_random_time_between(start_time=None, end_time=None) -> str:
+def get_timestamp_noise(n_rows=0, rng=None, max_noise_us=10**6) -> np.array:
+    """
+    Helper function to draw timestamp noise (e.g. fractions of seconds) for an array of timestamps, as drawn by add_timestamp_noise()
+
+    Parameters
+    ----------
+    n_rows : number of timestamps,
+        int
+    rng : random generator to draw from, if not given then draw from the global numpy random state,
+        np.random.Generator, default=None
+    max_noise_us : bound of the noise in microseconds, e.g. get_max_timestamp_noise_us() to keep the order of the timestamps of a series,
+        int, default=10**6 (1 second)
+
+    Return
+    ----------
+    noise : noise within +/- max_noise_us as whole microseconds, to be added to datetime64[ns] values,
+        np.array of timedelta64[ns]
+    """
+    rng = np.random if rng is None else rng
+    noise_ns = np.rint(rng.uniform(-max_noise_us, max_noise_us, n_rows)).astype(np.int64) * 1000
+    return noise_ns.astype("timedelta64[ns]")
+
+
+def get_max_timestamp_noise_us(timestamps=None) -> int:
+    """
+    Helper function to get the bound of the timestamp noise keeping evenly spaced timestamps in order, i.e. strictly below half the
+    sample period (e.g. for monotonic counters, whose values must not decrease in Timestamp order), and at most 1 second
+
+    Parameters
+    ----------
+    timestamps : evenly spaced timestamps of a series,
+        pd.DatetimeIndex
+
+    Return
+    ----------
+    max_noise_us : bound of the noise in microseconds, to be passed to get_timestamp_noise(),
+        int
+    """
+    if len(timestamps) < 2:
+        return 10**6
+    period_us = int(np.min(np.diff(timestamps.asi8))) // 1000
+    return min(10**6, max(0, (period_us - 1) // 2))
+
+
+def get_keep_positions(n_rows=0, missing_ratio=0, rng=None, exact_count=True) -> np.array:
+    """
+    Helper function to randomly pick the rows to keep out of n_rows to create missings, before any row is built.
+    The exact-count mode is the positional counterpart of random_drop_rows(), drawing the same rows for a dataframe with a RangeIndex
+
+    Parameters
+    ----------
+    n_rows : number of rows,
+        int
+    missing_ratio : percentage of missing value of time-series,
+        float, default=0
+    rng : random generator to draw from, if not given then draw from the global numpy random state,
+        np.random.Generator, default=None
+    exact_count : whether to drop exactly int(n_rows*missing_ratio) rows, otherwise drop each row independently with probability missing_ratio
+        from a boolean mask (cheaper for large n_rows with the global numpy random state, which permutes all rows to draw exactly),
+        bool, default=True
+
+    Return
+    ----------
+    keep_positions : sorted positions of the rows kept,
+        np.array of int
+    """
+    rng = np.random if rng is None else rng
+    if not exact_count:
+        return np.flatnonzero(rng.random(n_rows) >= missing_ratio)
+    drop_positions = rng.choice(n_rows, int(n_rows * missing_ratio), replace=False)
+    return np.delete(np.arange(n_rows), drop_positions)
+
+
+def get_random_time_between(start_time=None, end_time=None, rng=None) -> str:
     """
     Helper function to randomly pick a time within a time range regardless of date.
 
@@ -156,6 +276,8 @@ def get_random_time_between(start_time=None, end_time=None) -> str:
         str (e.g. '07:00:00')
     end_time : String of start time in the format of h:m:s,
         str (e.g. '09:00:00')
+    rng : random generator to draw from, if not given then draw from the global numpy random state,
+        np.random.Generator, default=None
 
     Return
     ----------
@@ -166,7 +288,8 @@ def get_random_time_between(start_time=None, end_time=None) -> str:
     h2, m2, s2 = end_time.split(":")
     total_seconds1 = int(h1) * 3600 + int(m1) * 60 + int(s1)
     total_seconds2 = int(h2) * 3600 + int(m2) * 60 + int(s2)
-    start_of_day_total_seconds = int(uniform(total_seconds1, total_seconds2))
+    rng = np.random if rng is None else rng
+    start_of_day_total_seconds = int(rng.uniform(total_seconds1, total_seconds2))
     start_of_day_h = start_of_day_total_seconds // 3600
     start_of_day_m = (start_of_day_total_seconds // 60) % 60
     start_of_day_s = (
@@ -180,6 +303,213 @@ def get_random_time_between(start_time=None, end_time=None) -> str:
     return ":".join([start_of_day_h, start_of_day_m, start_of_day_s])
 
 
+def get_day_index(timestamps_ns=None) -> tuple:
+    """
+    Helper function to locate the calendar days of sorted timestamps, without grouping by date.
+
+    Parameters
+    ----------
+    timestamps_ns : sorted timestamps as int64 nanoseconds since epoch,
+        np.array
+
+    Return
+    ----------
+    Tuple of (day_idx, day_start_positions, days_since_epoch)
+    day_idx : for each timestamp, the number of the day it belongs to, counting from 0,
+        np.array
+    day_start_positions : position of the first timestamp of each day, followed by the total number of timestamps,
+        np.array
+    days_since_epoch : number of days since 1970-01-01 for each day, e.g. weekday is (days_since_epoch + 3) % 7,
+        np.array
+    """
+    days_since_epoch = timestamps_ns // NS_PER_DAY
+    day_change = np.empty(days_since_epoch.shape[0], dtype=bool)
+    day_change[:1] = True
+    day_change[1:] = days_since_epoch[1:] != days_since_epoch[:-1]
+    day_start_positions = np.append(np.flatnonzero(day_change), days_since_epoch.shape[0])
+    day_idx = np.cumsum(day_change) - 1
+    return day_idx, day_start_positions, days_since_epoch[day_change]
+
+
+def time_str_to_ns(time_str=None) -> int:
+    """
+    Helper function to convert a time of day in the format of h:m:s into nanoseconds since midnight.
+    """
+    h, m, s = time_str.split(':')
+    return (int(h) * 3600 + int(m) * 60 + int(s)) * NS_PER_SECOND
+
+
+def get_chunk_ranges(time_range=None, chunk_freq=None) -> list:
+    """
+    Helper function to split a time range into consecutive time chunks.
+
+    Parameters
+    ----------
+    time_range : start and end timestamp of the entire time range,
+        list of str (e.g. ['2022-06-01 00:00:00', '2022-07-01 00:00:00'])
+    chunk_freq : length of each chunk, if not given then a single chunk [None] covers the entire time range,
+        str (e.g. '1D'), optional
+
+    Return
+    ----------
+    chunk_range_lst : list of [start, end) timestamps for each chunk, end is None for the last chunk,
+        list of list of Timestamps
+    """
+    if chunk_freq is None:
+        return [None]
+    chunk_edges = list(pd.date_range(time_range[0], time_range[1], freq=chunk_freq))
+    return [[chunk_start, chunk_end] for chunk_start, chunk_end in zip(chunk_edges, chunk_edges[1:] + [None])]
+
+
+def get_chunk_positions(timestamps=None, chunk_range=None) -> tuple:
+    """
+    Helper function to get the positional [start, end) of a time chunk within sorted timestamps.
+
+    Parameters
+    ----------
+    timestamps : sorted timestamps,
+        pd.DatetimeIndex
+    chunk_range : [start, end) timestamps of the chunk from function get_chunk_ranges(),
+        list of Timestamps
+
+    Return
+    ----------
+    Tuple of (start_position, end_position)
+    """
+    if chunk_range is None:
+        return 0, len(timestamps)
+    return timestamps.searchsorted(chunk_range[0]), \
+           len(timestamps) if chunk_range[1] is None else timestamps.searchsorted(chunk_range[1])
+
+
+def get_chunk_timestamps(time_range=None, freq=None, chunk_range=None) -> pd.DatetimeIndex:
+    """
+    Helper function to get the part of pd.date_range(time_range[0], time_range[1], freq=freq) falling into a time chunk,
+    without building the timestamps of the entire time range.
+
+    Parameters
+    ----------
+    time_range : start and end timestamp of the entire time range,
+        list of str (e.g. ['2022-06-01 00:00:00', '2022-07-01 00:00:00'])
+    freq : updating frequency (sample rate),
+        str (e.g. '5min')
+    chunk_range : [start, end) timestamps of the chunk from function get_chunk_ranges(), if not given then use the entire time range,
+        list of Timestamps, optional
+
+    Return
+    ----------
+    Timestamps of the chunk,
+        pd.DatetimeIndex
+    """
+    first_timestamp, periods = get_chunk_grid(time_range, freq, chunk_range)
+    return pd.date_range(first_timestamp, periods=periods, freq=freq, name='Timestamp')
+
+
+def get_chunk_grid(time_range=None, freq=None, chunk_range=None) -> tuple:
+    """
+    Helper function to locate the part of pd.date_range(time_range[0], time_range[1], freq=freq) falling into a time chunk,
+    without building any timestamp.
+
+    Parameters
+    ----------
+    time_range : start and end timestamp of the entire time range,
+        list of str (e.g. ['2022-06-01 00:00:00', '2022-07-01 00:00:00'])
+    freq : updating frequency (sample rate),
+        str (e.g. '5min')
+    chunk_range : [start, end) timestamps of the chunk from function get_chunk_ranges(), if not given then use the entire time range,
+        list of Timestamps, optional
+
+    Return
+    ----------
+    Tuple of (first_timestamp, periods)
+    first_timestamp : first timestamp of the chunk,
+        pd.Timestamp
+    periods : number of timestamps of the chunk,
+        int
+    """
+    start_time, end_time = pd.Timestamp(time_range[0]), pd.Timestamp(time_range[1])
+    step = pd.Timedelta(get_freq_ns(freq))
+    num_timestamps = (end_time - start_time) // step + 1
+    if chunk_range is None:
+        start_position, end_position = 0, num_timestamps
+    else:
+        start_position = int(np.clip(-((start_time - chunk_range[0]) // step), 0, num_timestamps))
+        end_position = num_timestamps if chunk_range[1] is None else \
+                       int(np.clip(-((start_time - chunk_range[1]) // step), 0, num_timestamps))
+    return start_time + start_position * step, int(end_position - start_position)
+
+
+def get_freq_ns(freq=None) -> int:
+    """
+    Helper function to get the step of a fixed frequency in nanoseconds, accepting the offset aliases of pd.date_range() (e.g. '5min', 'h' or 'D').
+
+    Parameters
+    ----------
+    freq : updating frequency (sample rate),
+        str (e.g. '5min')
+
+    Return
+    ----------
+    step_ns : step between consecutive timestamps in nanoseconds,
+        int
+    """
+    try:
+        return to_offset(freq).nanos
+    except ValueError:
+        raise ValueError(f"Frequency '{freq}' is not a fixed frequency, please use one such as '5min', 'h' or 'D' rather than e.g. months or business days")
+
+
+def merge_sorted_streams(df_lst=None, sort_col='Timestamp') -> pd.DataFrame:
+    """
+    Merge dataframes each already sorted by sort_col into one dataframe sorted by sort_col, without sorting all rows again:
+    the stable sort on the concatenated (int64) sort keys only merges the sorted runs of the dataframes.
+    Rows with equal sort keys keep the order of df_lst, then their order within each dataframe.
+
+    Parameters
+    ----------
+    df_lst : dataframes with the same columns, each sorted by sort_col, empty dataframes or None are skipped,
+        list of pd.DataFrame
+    sort_col : datetime column by which the dataframes are sorted,
+        str, default='Timestamp'
+
+    Return
+    ----------
+    merged_df : merged dataframe with a fresh RangeIndex,
+        pd.DataFrame
+    """
+    df_lst = [df for df in df_lst if df is not None and not df.empty]
+    if len(df_lst) == 0:
+        return pd.DataFrame()
+    if len(df_lst) == 1:
+        return df_lst[0].reset_index(drop=True)
+    sort_keys = np.concatenate([df[sort_col].values.view(np.int64) for df in df_lst])
+    order = np.argsort(sort_keys, kind='stable')
+    merged_df = pd.concat(df_lst, ignore_index=True)
+    return merged_df.take(order).reset_index(drop=True)
+
+
+def update_initial_records(initial_df=None, df=None) -> pd.DataFrame:
+    """
+    Helper function to keep a running table of the earliest record of each (Id, Key) while the data is generated,
+    so that the initial state of all series is known in memory proportional to the number of series.
+
+    Parameters
+    ----------
+    initial_df : earliest record of each (Id, Key) so far, or None before the first update,
+        pd.DataFrame
+    df : newly generated records sorted by Timestamp, with columns including ['Id', 'Key', 'Timestamp'],
+        pd.DataFrame
+
+    Return
+    ----------
+    initial_df : updated earliest record of each (Id, Key),
+        pd.DataFrame
+    """
+    # The first record of each (Id, Key) in df sorted by Timestamp is its earliest one
+    initial_df = pd.concat([initial_df, df.drop_duplicates(['Id', 'Key'])], ignore_index=True)
+    return initial_df.loc[initial_df.groupby(['Id', 'Key'])['Timestamp'].idxmin()].reset_index(drop=True)
+
+
 def plot_ts(ts_df=None, \
             anomaly_label=None, \
             start_time_str=None, \
@@ -193,7 +523,8 @@ def plot_ts(ts_df=None, \
             severity_thres=None, \
             mode="lines", \
             height=800, \
-            width=1000) -> None:
+            width=1000, \
+            decimate=True) -> None:
     """
     Make time-series plots for all nodes in graph as well as anomaly label and possibly with MVAD results.
 
@@ -224,6 +555,9 @@ def plot_ts(ts_df=None, \
     mode: one of 'markers', 'lines' or 'lines_markers' for sensor time-series plots,
         str, default='lines'
     height, width : params that refer to Plotly
+    decimate : whether to decimate each time-series to the width of the plot, keeping the first, last, min and max points per pixel column
+        (see function get_decimated_positions()), so that long time-series of many twins are drawn the same with far fewer points,
+        bool, default=True
 
     Return
     ----------
@@ -247,15 +581,15 @@ def plot_ts(ts_df=None, \
                           .sort_values('timestamp').reset_index(drop=True)
 
         tmp_df_res['timestamp_floor'] = tmp_df_res['timestamp'].dt.floor(floor_bin)
-        df_res_eval = pd.DataFrame(tmp_df_res.groupby('timestamp_floor')['value.is_anomaly'].apply(lambda x: any(list(x))))
+        df_res_eval = tmp_df_res['value.is_anomaly'].astype(bool).groupby(tmp_df_res['timestamp_floor']).any().to_frame()
         tmp_label['timestamp_floor'] = tmp_label['timestamp'].dt.floor(floor_bin)
-        label_eval = pd.DataFrame(tmp_label.groupby('timestamp_floor')['isAnomaly'].apply(lambda x: 1 in list(x)))
+        label_eval = (tmp_label['isAnomaly'] == 1).groupby(tmp_label['timestamp_floor']).any().to_frame()
 
         assert df_res_eval.index.equals(label_eval.index), "Caution! Timestamps don't match."
         df_res_label_eval = pd.concat([df_res_eval, label_eval], axis=1)
-        df_res_label_eval['confusion'] = df_res_label_eval.apply(lambda x: 'TP' if x['value.is_anomaly']==x['isAnomaly']==True
-                                                                                else ('FP' if (x['value.is_anomaly']== True) and (x['isAnomaly']==False)
-                                                                                           else ('TN' if x['value.is_anomaly']==x['isAnomaly']==False else 'FN')), axis=1)
+        is_anomaly_res, is_anomaly_label = df_res_label_eval['value.is_anomaly'].values, df_res_label_eval['isAnomaly'].values
+        df_res_label_eval['confusion'] = np.where(is_anomaly_res, np.where(is_anomaly_label, 'TP', 'FP'), \
+                                                  np.where(is_anomaly_label, 'FN', 'TN'))
         start_time, end_time = df_res_label_eval.index[0], df_res_label_eval.index[-1]
 
     if start_time_str is None:
@@ -286,8 +620,14 @@ def plot_ts(ts_df=None, \
         ts_df = ts_df[ts_df['Id'].isin(id_lst)]
     if key_lst is not None:
         ts_df = ts_df[ts_df['Key'].isin(key_lst)]
-    ts_df_gb = ts_df.groupby(["Id", "Key"])
-    sorted_gb_keys = sorted(ts_df_gb.groups.keys())
+    # Order the rows by series then Timestamp once, each series holding a contiguous block
+    order, series_codes, series_lst = get_series_blocks(ts_df)
+    timestamps = ts_df['Timestamp'].values[order]
+    values = ts_df['Value'].values[order]
+    if decimate:
+        positions = get_decimated_positions(series_codes, timestamps.view(np.int64), values, n_bins=width)
+        series_codes, timestamps, values = series_codes[positions], timestamps[positions], values[positions]
+    block_bounds = np.searchsorted(series_codes, np.arange(len(series_lst) + 1), side='left')
 
     title_text = 'Inference Visualization with MVAD Results' if plot_results else 'Simulated Time-series Sensor Telemetry with Anomalies'
     if plot_anomaly_label:
@@ -312,16 +652,16 @@ def plot_ts(ts_df=None, \
             )
 
     num_subplots = 2 if plot_anomaly_label else 1
-    for gb_key in sorted_gb_keys:
-        sub_ts_df = ts_df_gb.get_group(gb_key).sort_values("Timestamp")
+    for i, (gb_key, _, _) in enumerate(series_lst):
+        sub_values = values[block_bounds[i]: block_bounds[i + 1]]
         try:
-            sub_ts_df["Value"] = sub_ts_df["Value"].astype('float')
+            sub_values = sub_values.astype('float')
         except:
             pass
         fig.add_trace(
             go.Scatter(
-                x=sub_ts_df["Timestamp"],
-                y=sub_ts_df["Value"],
+                x=timestamps[block_bounds[i]: block_bounds[i + 1]],
+                y=sub_values,
                 name="_".join(gb_key),
                 mode=mode,
                 ),
@@ -329,28 +669,26 @@ def plot_ts(ts_df=None, \
             col=1
         )
 
-    if plot_results:
-        for j in range(df_res_label_eval.shape[0]-1):
-            confusion = df_res_label_eval.iloc[j]['confusion']
-            if confusion == 'TN':
-                vrect_color = 'green'
-            elif confusion == 'FN':
-                vrect_color = 'yellow'
-            elif confusion == 'FP':
-                vrect_color = 'grey'
-            else:
-                vrect_color = 'red'
-
-            fig.add_vrect(
-                x0=df_res_label_eval.index[j],
-                x1=df_res_label_eval.index[j+1],
-                fillcolor=vrect_color, 
-                opacity=0.5,
-                layer="below", 
-                line_width=0,
-                row=num_subplots, 
-                col=1
-            )
+    if plot_results and len(series_lst) > 0:
+        # Each bin spans up to the next one, consecutive bins of the same confusion class are merged into one shape
+        confusion_arr = df_res_label_eval['confusion'].values[:-1]
+        run_starts = np.flatnonzero(np.r_[True, confusion_arr[1:] != confusion_arr[:-1]]) if confusion_arr.size > 0 else []
+        run_ends = np.r_[run_starts[1:], confusion_arr.size].astype(int)
+        # Shapes are added at once after the shapes already on the figure, as fig.add_vrect() validates all shapes of the figure again
+        # at each call, on the axes of the time-series subplot (its y axis is anchored to its x axis and vice versa)
+        subplot = fig.get_subplot(num_subplots, 1)
+        vrect_lst = [dict(type='rect', \
+                          xref=subplot.yaxis.anchor, \
+                          yref=f'{subplot.xaxis.anchor} domain', \
+                          x0=df_res_label_eval.index[run_start], \
+                          x1=df_res_label_eval.index[run_end], \
+                          y0=0, \
+                          y1=1, \
+                          fillcolor=CONFUSION_COLOR_DIC[confusion_arr[run_start]], \
+                          opacity=0.5, \
+                          layer='below', \
+                          line_width=0) for run_start, run_end in zip(run_starts, run_ends)]
+        fig.update_layout(shapes=list(fig.layout.shapes) + vrect_lst)
 
     fig.update_layout(
         height=height, width=width, title_text=title_text, title_x=0.5
@@ -0,0 +1,222 @@
+"""utility functions to propagate the simulated supply top-down through the topology flow, on sparse matrices"""
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+from scipy.sparse.linalg import splu
+
+
+def get_flow_matrix(topo_df=None, node_lst=None, relationship_to_flow=None) -> sparse.csr_matrix:
+    """
+    Build the sparse flow matrix W, where W[j,i]=1/(number of targets of i) if there is an arc from i to j else 0,
+    i.e. the flow of each node is divided equally amongst its targets.
+
+    Parameters
+    ----------
+    topo_df : topology table containing relationships among nodes, with columns=['relationshipName', 'sourceId', 'targetId'],
+        pd.DataFrame
+    node_lst : ordered list of all nodes in graph, defining the row/column order of the matrix,
+        list of str
+    relationship_to_flow : relationship used for topology top-down flow,
+        str (e.g. 'isParent')
+
+    Return
+    ----------
+    flow_mat : flow matrix of shape (n_nodes, n_nodes) in CSR format,
+        scipy.sparse.csr_matrix
+    """
+    flow_topo_df = topo_df[topo_df['relationshipName'] == relationship_to_flow]
+    node_index = pd.Index(node_lst)
+    indptr, indices = get_adjacency_csr(source_idx=node_index.get_indexer(flow_topo_df['sourceId']), \
+                                        target_idx=node_index.get_indexer(flow_topo_df['targetId']), \
+                                        n_nodes=len(node_lst))
+    return get_flow_matrix_from_adjacency(indptr=indptr, indices=indices)
+
+
+def get_adjacency_csr(source_idx=None, target_idx=None, n_nodes=None) -> tuple:
+    """
+    Build the adjacency of a graph in CSR format from its arcs, i.e. the targets of node i are indices[indptr[i]:indptr[i+1]],
+    sorted and without duplicated arcs.
+
+    Parameters
+    ----------
+    source_idx, target_idx : index of the source and target node of each arc,
+        np.array of int
+    n_nodes : number of nodes in graph,
+        int
+
+    Return
+    ----------
+    indptr : offsets of the targets of each node, of length n_nodes+1,
+        np.array of int
+    indices : targets of all nodes,
+        np.array of int
+    """
+    # 32-bit indices as scipy.sparse, unless the graph is too large
+    index_dtype = np.int32 if max(n_nodes, len(source_idx)) < np.iinfo(np.int32).max else np.int64
+    order = np.lexsort((target_idx, source_idx))
+    source_idx, target_idx = source_idx[order], target_idx[order]
+    is_first = np.ones(len(order), dtype=bool)
+    is_first[1:] = (source_idx[1:] != source_idx[:-1]) | (target_idx[1:] != target_idx[:-1])
+    indptr = np.zeros(n_nodes + 1, dtype=index_dtype)
+    np.cumsum(np.bincount(source_idx[is_first], minlength=n_nodes), out=indptr[1:])
+    return indptr, target_idx[is_first].astype(index_dtype)
+
+
+def get_flow_matrix_from_adjacency(indptr=None, indices=None) -> sparse.csr_matrix:
+    """
+    Build the sparse flow matrix W of function get_flow_matrix() from the adjacency of the flow relationships in CSR format.
+
+    Parameters
+    ----------
+    indptr, indices : adjacency in CSR format from function get_adjacency_csr(),
+        np.array of int
+
+    Return
+    ----------
+    flow_mat : flow matrix of shape (n_nodes, n_nodes) in CSR format,
+        scipy.sparse.csr_matrix
+    """
+    n_nodes = indptr.shape[0] - 1
+    # Divide the flow of each node equally amongst its targets
+    div_factor = np.diff(indptr)
+    adj_mat = sparse.csr_matrix((1 / np.repeat(div_factor, div_factor), indices, indptr), shape=(n_nodes, n_nodes))
+    return adj_mat.T.tocsr()
+
+
+def get_topological_levels(flow_mat=None) -> list:
+    """
+    Group nodes into topological levels, so that every node only receives flow from nodes in earlier levels.
+
+    Parameters
+    ----------
+    flow_mat : flow matrix from function get_flow_matrix(),
+        scipy.sparse.csr_matrix
+
+    Return
+    ----------
+    levels : list of node indices for each level, or None if the flow relationships contain a cycle,
+        list of np.array
+    """
+    n_nodes = flow_mat.shape[0]
+    in_degree = np.diff(flow_mat.indptr)
+    # Rows of the transposed flow matrix hold the targets of each node
+    out_mat = flow_mat.T.tocsr()
+    levels = []
+    frontier = np.flatnonzero(in_degree == 0)
+    num_visited = 0
+    while frontier.shape[0] > 0:
+        levels.append(frontier)
+        num_visited += frontier.shape[0]
+        targets = _gather_csr_rows(out_mat.indptr, out_mat.indices, frontier)
+        in_degree = in_degree - np.bincount(targets, minlength=n_nodes)
+        frontier = np.unique(targets[in_degree[targets] == 0])
+    if num_visited < n_nodes:
+        return None
+    return levels
+
+
+class FlowOperator(object):
+    def __init__(self, \
+                 flow_mat=None) -> None:
+        """
+        Propagation operator solving the linear equations of form: (I-W) x_matrix = supply_matrix, i.e. x[j] = supply[j] + sum_i W[j,i]*x[i].
+        The topological schedule (or, for cyclic flow relationships, the sparse LU factorization) is computed once at initiation
+        and reused by every call of solve().
+
+        Parameters
+        ----------
+        flow_mat : flow matrix from function get_flow_matrix(),
+            scipy.sparse.csr_matrix
+
+        Return
+        ----------
+        None
+        """
+        self.flow_mat = flow_mat
+        self.levels = get_topological_levels(flow_mat)
+        if self.levels is None:
+            self.lu = splu(sparse.identity(flow_mat.shape[0], format='csc') - flow_mat.tocsc())
+            self.level_flow_mats = None
+        else:
+            self.lu = None
+            # Rows of the flow matrix for each level after the first one, i.e. the flow each level receives
+            self.level_flow_mats = [flow_mat[level] for level in self.levels[1:]]
+
+    def solve(self, \
+              supply_mat=None) -> np.array:
+        """
+        With topological levels, the supply is propagated level by level without any factorization,
+        otherwise the cached sparse LU factorization is used.
+
+        Parameters
+        ----------
+        supply_mat : supply matrix of shape (n_nodes, n_timestamps),
+            np.array
+
+        Return
+        ----------
+        sln_mat : solution matrix of shape (n_nodes, n_timestamps),
+            np.array
+        """
+        if self.lu is not None:
+            return self.lu.solve(np.asarray(supply_mat, dtype=float))
+        sln_mat = np.array(supply_mat, dtype=float)
+        for level, level_flow_mat in zip(self.levels[1:], self.level_flow_mats):
+            sln_mat[level] += level_flow_mat @ sln_mat
+        return sln_mat
+
+    def to_arrays(self) -> dict:
+        """
+        Flatten the operator into plain arrays (e.g. to share them with worker processes), to be restored by FlowOperator.from_arrays().
+
+        Return
+        ----------
+        array_dic : CSR arrays of the flow matrix, and the node indices of all topological levels concatenated with the size of each level
+            (no level for cyclic flow relationships),
+            dict of np.array
+        """
+        levels = self.levels or []
+        return {'flow_data': self.flow_mat.data, \
+                'flow_indices': self.flow_mat.indices, \
+                'flow_indptr': self.flow_mat.indptr, \
+                'level_nodes': np.concatenate(levels) if levels else np.zeros(0, dtype=np.int64), \
+                'level_sizes': np.array([level.shape[0] for level in levels], dtype=np.int64)}
+
+    @classmethod
+    def from_arrays(cls, \
+                    array_dic=None) -> 'FlowOperator':
+        """
+        Restore the operator flattened by to_arrays() without recomputing the topological levels,
+        only the sparse LU factorization of cyclic flow relationships has to be computed again.
+
+        Parameters
+        ----------
+        array_dic : arrays from FlowOperator.to_arrays(),
+            dict of np.array
+
+        Return
+        ----------
+        flow_operator : restored operator,
+            FlowOperator
+        """
+        n_nodes = array_dic['flow_indptr'].shape[0] - 1
+        flow_mat = sparse.csr_matrix((array_dic['flow_data'], array_dic['flow_indices'], array_dic['flow_indptr']), \
+                                     shape=(n_nodes, n_nodes))
+        if array_dic['level_sizes'].shape[0] == 0:
+            return cls(flow_mat=flow_mat)
+        flow_operator = cls.__new__(cls)
+        flow_operator.flow_mat = flow_mat
+        flow_operator.levels = np.split(array_dic['level_nodes'], np.cumsum(array_dic['level_sizes'])[:-1])
+        flow_operator.lu = None
+        flow_operator.level_flow_mats = [flow_mat[level] for level in flow_operator.levels[1:]]
+        return flow_operator
+
+
+def _gather_csr_rows(indptr=None, indices=None, rows=None) -> np.array:
+    """Concatenate the column indices of the selected rows of a CSR matrix, without a Python loop over rows"""
+    starts, counts = indptr[rows], indptr[rows + 1] - indptr[rows]
+    if counts.sum() == 0:
+        return np.zeros(0, dtype=indices.dtype)
+    offsets = np.repeat(starts - np.cumsum(counts) + counts, counts)
+    return indices[offsets + np.arange(counts.sum())]
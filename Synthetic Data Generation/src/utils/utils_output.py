@@ -0,0 +1,250 @@
+"""utility functions to write the simulated tables chunk by chunk, as csv files (possibly compressed and sharded) or as Parquet datasets partitioned by date"""
+
+import glob
+import gzip
+import os
+import shutil
+import numpy as np
+import pandas as pd
+
+# Columns with few distinct strings, dictionary-encoded in Parquet
+DICTIONARY_COLUMNS = ['Id', 'Key', 'ModelId', 'ServiceId']
+# File extension of each compression of csv files
+COMPRESSION_SUFFIXES = {None: '', 'gzip': '.gz', 'zstd': '.zst'}
+# Lower than the default of 9, which is several times slower for slightly smaller files
+GZIP_COMPRESSLEVEL = 6
+# Units of timestamps formatted as strings, from the coarsest, with the nanoseconds of each unit
+TIMESTAMP_UNIT_NS = {'D': 86400 * 10**9, 's': 10**9, 'ms': 10**6, 'us': 10**3, 'ns': 1}
+
+
+def write_table_chunk(df=None, \
+                      file_path=None, \
+                      written_file_lst=None, \
+                      output_format='csv', \
+                      timestamp_col='Timestamp', \
+                      partition_by_id=False, \
+                      timestamp_unit='us') -> None:
+    """
+    Write a chunk of a table, overwriting the output the first time it is written during the run and appending to it afterwards.
+
+    Parameters
+    ----------
+    df : chunk of the table to write,
+        pd.DataFrame
+    file_path : path of the output without extension, e.g. '../data/synthetic_data/v1/update_stream_v1',
+        str
+    written_file_lst : outputs written so far during the run, with one entry per chunk written, updated in place,
+        list of str
+    output_format : 'csv' for a csv file '{file_path}.csv', or 'parquet' for a Parquet dataset in the folder '{file_path}/'
+        partitioned as date=YYYY-MM-DD[/Id=...]/part-{chunk}-{i}.parquet,
+        str, default='csv'
+    timestamp_col : timestamp column from which the date partition of Parquet datasets is derived, and formatted with timestamp_unit in csv files,
+        str, default='Timestamp'
+    partition_by_id : whether to partition Parquet datasets by Id after date,
+        bool, default=False
+    timestamp_unit : unit of the timestamps of csv files, shared by all chunks so that the whole file has the same timestamp format
+        (see function format_timestamps()),
+        str, default='us'
+
+    Return
+    ----------
+    None
+    """
+    if output_format == 'csv':
+        if timestamp_col in df.columns:
+            df = df.assign(**{timestamp_col: format_timestamps(df[timestamp_col].values, unit=timestamp_unit)})
+        if file_path in written_file_lst:
+            df.to_csv(file_path + '.csv', mode='a', header=False, index=False)
+        else:
+            df.to_csv(file_path + '.csv', index=False)
+    elif output_format == 'parquet':
+        _write_parquet_chunk(df, file_path, written_file_lst.count(file_path), timestamp_col, partition_by_id)
+    else:
+        raise ValueError(f"Unknown output_format '{output_format}', please use 'csv' or 'parquet'")
+    written_file_lst.append(file_path)
+
+
+def _write_parquet_chunk(df=None, dataset_path=None, chunk_i=0, timestamp_col='Timestamp', partition_by_id=False) -> None:
+    """
+    Helper function to write a chunk of a table into a Parquet dataset, clearing the dataset of a previous run with the first chunk.
+    """
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError as e:
+        raise ImportError("output_format 'parquet' requires pyarrow, please install it with `pip install pyarrow`") from e
+    if chunk_i == 0 and os.path.isdir(dataset_path):
+        shutil.rmtree(dataset_path)
+    table = pa.table({'date': df[timestamp_col].values.astype('datetime64[D]'), \
+                      **{col: _to_arrow_array(df[col], pa) for col in df.columns}})
+    pq.write_to_dataset(table, \
+                        root_path=dataset_path, \
+                        partition_cols=['date', 'Id'] if partition_by_id else ['date'], \
+                        basename_template=f'part-{chunk_i}-{{i}}.parquet')
+
+
+def _to_arrow_array(series=None, pa=None):
+    """
+    Helper function to convert a column into an Arrow array: typed timestamps, dictionary-encoded Id/Key/ModelId and categoricals,
+    and values mixing numbers and strings (e.g. the Value column of the combined stream) as strings.
+    """
+    if pd.api.types.is_datetime64_any_dtype(series):
+        return pa.array(series.values, type=pa.timestamp('ns'))
+    if isinstance(series.dtype, pd.CategoricalDtype):
+        return pa.array(series)
+    if pd.api.types.infer_dtype(series, skipna=True) in ['mixed', 'mixed-integer']:
+        series = series.where(series.isna(), series.astype(str))
+    array = pa.array(series, from_pandas=True)
+    # Only low-cardinality columns, as every file of a partitioned dataset holds the whole dictionary of its columns
+    if series.name in DICTIONARY_COLUMNS and not pa.types.is_null(array.type):
+        array = array.dictionary_encode()
+    return array
+
+
+class ShardedCsvWriter(object):
+    def __init__(self, \
+                 file_path=None, \
+                 compression=None, \
+                 max_shard_mb=None) -> None:
+        """
+        Csv writer appending tables batch by batch to a compressed csv file kept open, or to consecutive csv files (shards)
+        of a bounded size, e.g. the size of files recommended for bulk ingestion. A shard is closed once it holds max_shard_mb of csv text,
+        hence it exceeds this size by at most one batch. Every shard has a header. Outputs of a previous run are removed with the first shard.
+
+        Parameters
+        ----------
+        file_path : path of the output without extension, e.g. '../data/synthetic_data/v1/update_stream_dh_v1',
+            written as '{file_path}.csv[.gz|.zst]' without sharding, or as '{file_path}_{shard:05d}.csv[.gz|.zst]' with sharding,
+            str
+        compression : None, 'gzip' or 'zstd' (requires zstandard),
+            str, default=None
+        max_shard_mb : size of the csv text (before compression) from which to start a new shard, or None to write a single file,
+            float, default=None
+
+        Return
+        ----------
+        None
+        """
+        if compression not in COMPRESSION_SUFFIXES:
+            raise ValueError(f"Unknown compression '{compression}', please use None, 'gzip' or 'zstd'")
+        self.file_path = file_path
+        self.compression = compression
+        self.max_shard_bytes = None if max_shard_mb is None else int(max_shard_mb * 2**20)
+        self.file_path_lst = []
+        self.shard_bytes = 0
+        self._handle = None
+
+    def write(self, \
+              df=None) -> None:
+        """
+        Append a table to the current shard, opening a new shard first if needed.
+
+        Parameters
+        ----------
+        df : table to write,
+            pd.DataFrame
+
+        Return
+        ----------
+        None
+        """
+        is_new_shard = self._handle is None
+        if is_new_shard:
+            self._open_shard()
+        # Format the batch once, to write it and count its size (one byte per character of ascii csv text)
+        csv_text = df.to_csv(index=False, header=is_new_shard)
+        self._handle.write(csv_text)
+        self.shard_bytes += len(csv_text)
+        if self.max_shard_bytes is not None and self.shard_bytes >= self.max_shard_bytes:
+            self._close_shard()
+
+    def close(self) -> None:
+        """Close the current shard"""
+        if self._handle is not None:
+            self._close_shard()
+
+    def _open_shard(self) -> None:
+        """Helper function to open the next shard, removing the outputs of a previous run with the first one"""
+        suffix = COMPRESSION_SUFFIXES[self.compression]
+        if len(self.file_path_lst) == 0:
+            for stale_file_path in glob.glob(glob.escape(self.file_path) + '.csv*') + \
+                                   glob.glob(glob.escape(self.file_path) + '_[0-9][0-9][0-9][0-9][0-9].csv*'):
+                os.remove(stale_file_path)
+        shard_path = f'{self.file_path}.csv{suffix}' if self.max_shard_bytes is None else \
+                     f'{self.file_path}_{len(self.file_path_lst):05d}.csv{suffix}'
+        if self.compression == 'gzip':
+            self._handle = gzip.open(shard_path, 'wt', compresslevel=GZIP_COMPRESSLEVEL, encoding='utf-8', newline='')
+        elif self.compression == 'zstd':
+            try:
+                import zstandard
+            except ImportError as e:
+                raise ImportError("compression 'zstd' requires zstandard, please install it with `pip install zstandard`") from e
+            self._handle = zstandard.open(shard_path, 'wt', encoding='utf-8', newline='')
+        else:
+            self._handle = open(shard_path, 'w', encoding='utf-8', newline='')
+        self.file_path_lst.append(shard_path)
+        self.shard_bytes = 0
+
+    def _close_shard(self) -> None:
+        """Helper function to close the current shard"""
+        self._handle.close()
+        self._handle = None
+
+
+def get_timestamp_unit(timestamps_ns=None) -> str:
+    """
+    Get the coarsest unit representing all timestamps exactly, as pd.DataFrame.to_csv() formats a datetime column written at once:
+    'D' if all timestamps are at midnight, else 's', 'us' or 'ns'.
+
+    Parameters
+    ----------
+    timestamps_ns : timestamps in nanoseconds, without NaT,
+        np.array of int
+
+    Return
+    ----------
+    unit : unit of the timestamps, one of 'D', 's', 'us' or 'ns',
+        str
+    """
+    for unit in ['D', 's', 'us']:
+        if np.all(timestamps_ns % TIMESTAMP_UNIT_NS[unit] == 0):
+            return unit
+    return 'ns'
+
+
+def format_timestamps(timestamps=None, unit=None) -> np.array:
+    """
+    Format timestamps as strings at once, the same as pd.DataFrame.to_csv() writes a datetime column:
+    'YYYY-MM-DD HH:MM:SS' followed by the fraction of seconds of the unit if any, or only 'YYYY-MM-DD' for unit 'D', and empty strings for NaT.
+    To format a table written in several parts, e.g. batch by batch, consistently, pass the same unit for all parts.
+
+    Parameters
+    ----------
+    timestamps : timestamps to format,
+        np.array of datetime64[ns]
+    unit : unit of the formatted timestamps, one of 'D', 's', 'ms', 'us' or 'ns',
+        if not given then the coarsest unit representing all timestamps exactly (see function get_timestamp_unit()),
+        str, default=None
+
+    Return
+    ----------
+    timestamp_strs : formatted timestamps,
+        np.array of str
+    """
+    timestamps = timestamps.astype('datetime64[ns]')
+    is_nat = np.isnat(timestamps)
+    timestamps_ns = timestamps.view(np.int64)[~is_nat]
+    if unit is None:
+        unit = get_timestamp_unit(timestamps_ns)
+    elif unit not in TIMESTAMP_UNIT_NS:
+        raise ValueError(f"Unknown timestamp unit '{unit}', please use one of {list(TIMESTAMP_UNIT_NS)}")
+    elif np.any(timestamps_ns % TIMESTAMP_UNIT_NS[unit] != 0):
+        raise ValueError(f"Timestamps are more precise than the unit '{unit}', please use a finer unit")
+    timestamp_strs = np.datetime_as_string(timestamps, unit=unit)
+    if unit != 'D' and timestamp_strs.size > 0:
+        # Replace the ISO 8601 separator 'T' (11th character) with a space, directly in the fixed-width unicode buffer
+        timestamp_strs.view(np.uint32).reshape(timestamp_strs.size, -1)[:, 10] = ord(' ')
+    if is_nat.any():
+        timestamp_strs = timestamp_strs.astype(object)
+        timestamp_strs[is_nat] = ''
+    return timestamp_strs
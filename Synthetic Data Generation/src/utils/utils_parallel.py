@@ -0,0 +1,67 @@
+"""utility functions to hand numpy arrays over to worker processes through shared memory instead of pickling them per task"""
+
+from multiprocessing import shared_memory
+import numpy as np
+
+
+def share_arrays(array_dic=None) -> tuple:
+    """
+    Copy each array into its own shared memory block, to be attached by worker processes with function attach_arrays().
+
+    Parameters
+    ----------
+    array_dic : arrays to share, keyed by name,
+        dict of np.array
+
+    Return
+    ----------
+    shm_lst : shared memory blocks created, to be released with function release_shared_memory(unlink=True) once all workers are done,
+        list of SharedMemory
+    spec_dic : (shared memory name, shape, dtype) of each array, small enough to be pickled to the workers,
+        dict of tuple
+    """
+    shm_lst, spec_dic = [], {}
+    for name, array in array_dic.items():
+        array = np.ascontiguousarray(array)
+        # Shared memory blocks cannot be empty
+        shm = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+        np.ndarray(array.shape, dtype=array.dtype, buffer=shm.buf)[...] = array
+        shm_lst.append(shm)
+        spec_dic[name] = (shm.name, array.shape, array.dtype.str)
+    return shm_lst, spec_dic
+
+
+def attach_arrays(spec_dic=None) -> tuple:
+    """
+    Attach the arrays shared by function share_arrays() as read-only views, without copying them.
+
+    Parameters
+    ----------
+    spec_dic : (shared memory name, shape, dtype) of each array from function share_arrays(),
+        dict of tuple
+
+    Return
+    ----------
+    shm_lst : shared memory blocks attached, to be kept alive as long as the arrays are in use,
+        list of SharedMemory
+    array_dic : arrays backed by shared memory, keyed by name,
+        dict of np.array
+    """
+    shm_lst, array_dic = [], {}
+    for name, (shm_name, shape, dtype) in spec_dic.items():
+        shm = shared_memory.SharedMemory(name=shm_name)
+        array = np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+        array.flags.writeable = False
+        shm_lst.append(shm)
+        array_dic[name] = array
+    return shm_lst, array_dic
+
+
+def release_shared_memory(shm_lst=None, unlink=False) -> None:
+    """
+    Close the shared memory blocks, and free them if unlink is set (only by the process which created them).
+    """
+    for shm in shm_lst:
+        shm.close()
+        if unlink:
+            shm.unlink()
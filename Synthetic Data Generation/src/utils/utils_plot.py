@@ -1,41 +1,172 @@
 """Function to plot multivariate time-series as line graphs and anomalies as bar area plots"""
+import numpy as np
+import pandas as pd
 import plotly.graph_objects as go
 from plotly.subplots import make_subplots
 
-def plot_ts_anom(df, df_anom, plot_anom=True):
+
+def get_series_blocks(df, sort_series=True):
+    """
+    Order the rows of a long dataframe by series (Id, Key) then Timestamp in one pass, each series holding a contiguous block of rows,
+    instead of filtering or grouping the dataframe once per series.
+
+    Parameters
+    ----------
+    df : long dataframe with columns including ['Id', 'Key', 'Timestamp'],
+        pd.DataFrame
+    sort_series : whether to order the series by (Id, Key), otherwise by first appearance in df,
+        bool, default=True
+
+    Return
+    ----------
+    order : positions of the rows of df ordered by series then Timestamp,
+        np.array of int
+    series_codes : code of the series of each ordered row, non-decreasing,
+        np.array of int
+    series_lst : (Id, Key), start and end positions in order of the block of each series,
+        list of tuple (e.g. [(('A', 'Amps_Ia'), 0, 1440), (('A', 'Amps_Ib'), 1440, 2880)])
+    """
+    # Sorted codes of Id and Key rank the series by (Id, Key), unsorted ones by first appearance
+    id_codes, _ = pd.factorize(df["Id"], sort=sort_series)
+    key_codes, key_uniques = pd.factorize(df["Key"], sort=sort_series)
+    series_codes, _ = pd.factorize(
+        id_codes.astype(np.int64) * len(key_uniques) + key_codes, sort=sort_series
+    )
+    timestamps_ns = pd.to_datetime(df["Timestamp"]).values.view(np.int64)
+    order = np.lexsort((timestamps_ns, series_codes))
+    series_codes = series_codes[order]
+
+    if order.size == 0:
+        return order, series_codes, []
+    block_starts = np.flatnonzero(np.r_[True, series_codes[1:] != series_codes[:-1]])
+    block_ends = np.r_[block_starts[1:], order.size]
+    id_values, key_values = df["Id"].values, df["Key"].values
+    series_lst = [
+        ((id_values[order[start]], key_values[order[start]]), start, end)
+        for start, end in zip(block_starts, block_ends)
+    ]
+    return order, series_codes, series_lst
+
+
+def get_decimated_positions(series_codes, timestamps_ns, values, n_bins=1000):
+    """
+    Decimate series ordered by series then timestamp (see function get_series_blocks()) to the pixel budget of a plot, all series at once.
+    The time range shared by the series is cut into n_bins bins, one per pixel column, and for each series with more than 4 points per bin on average,
+    only the first, last, min and max points of each bin are kept (min/max or M4 decimation), which draws the same lines at the pixel level.
+    Series holding non-numeric values (e.g. categorical ones in a stream merging all data profiles) are told apart series by series,
+    and reduced losslessly instead, to the first and last points of each run of equal values.
+
+    Parameters
+    ----------
+    series_codes : code of the series of each point, non-decreasing,
+        np.array of int
+    timestamps_ns : timestamp of each point in nanoseconds, increasing within each series,
+        np.array of int
+    values : value of each point,
+        np.array
+    n_bins : number of bins, i.e. pixel columns of the time axis,
+        int, default=1000
+
+    Return
+    ----------
+    positions : sorted positions of the points to keep,
+        np.array of int
+    """
+    if series_codes.size == 0:
+        return np.arange(0)
+    is_block_start = np.r_[True, series_codes[1:] != series_codes[:-1]]
+    block_starts = np.flatnonzero(is_block_start)
+    block_sizes = np.diff(np.r_[block_starts, series_codes.size])
+
+    # Series holding any value that is not a number, nor missing
+    numeric_values = np.asarray(pd.to_numeric(values, errors="coerce"), dtype=float)
+    is_text = np.isnan(numeric_values) & ~pd.isna(values)
+    is_text_block = np.repeat(np.logical_or.reduceat(is_text, block_starts), block_sizes)
+
+    t0, t1 = timestamps_ns.min(), timestamps_ns.max()
+    pixel_bins = np.minimum(
+        ((timestamps_ns - t0) / max(t1 - t0, 1) * n_bins).astype(np.int64), n_bins - 1
+    )
+    bin_keys = series_codes.astype(np.int64) * n_bins + pixel_bins
+    is_bin_start = np.r_[True, bin_keys[1:] != bin_keys[:-1]]
+    bin_starts = np.flatnonzero(is_bin_start)
+    bin_sizes = np.diff(np.r_[bin_starts, bin_keys.size])
+    is_kept = is_bin_start | np.r_[is_bin_start[1:], True]
+    # First position of the min and of the max of each bin, ignoring NaN
+    bin_codes = np.cumsum(is_bin_start) - 1
+    for bin_extremes in [np.fmin.reduceat(numeric_values, bin_starts), np.fmax.reduceat(numeric_values, bin_starts)]:
+        extreme_positions = np.flatnonzero(numeric_values == np.repeat(bin_extremes, bin_sizes))
+        extreme_bin_codes = bin_codes[extreme_positions]
+        is_kept[extreme_positions[np.diff(extreme_bin_codes, prepend=-1) != 0]] = True
+    # Keep all points of the series sparse enough to be drawn as they are
+    is_kept |= np.repeat(block_sizes <= 4 * n_bins, block_sizes)
+
+    if is_text_block.any():
+        # Keep the ends of each run of equal values, the points in between lie on the line joining them
+        is_change = values[1:] != values[:-1]
+        is_run_end = is_block_start | np.r_[is_block_start[1:], True] | np.r_[True, is_change] | np.r_[is_change, True]
+        is_kept = np.where(is_text_block, is_run_end, is_kept)
+    return np.flatnonzero(is_kept)
+
+
+def plot_ts_anom(df, df_anom, plot_anom=True, decimate=True):
     """Outputs multivariate Plot, optionally with anomaly as area-plots
     df_plot:df with "timestamp" and time-series as columns
     series_cols: list of columns in df_plot to plot
     plot_cp, boolean: whether to include identified change-points as area-plots
     bkpts, list[int]: list of change-points, i.e. breakpoints to plot as alternating area shadings
     title, str: title for the plot
+    decimate, boolean: whether to decimate the series to the width of the plot (see get_decimated_positions), and the anomalies to their changes
     """
+    width = 1200
 
-    # Make df long to wide
-    df["ts_name"] = df["Id"] + "-" + df["Key"]
-    dict_ts = {}
-    for ts in df["ts_name"].unique():
-        dict_ts[ts] = (
-            df[(df["ts_name"] == ts)][["Timestamp", "Value"]]
-            .reset_index(drop=True)
-            .sort_values(by="Timestamp")
+    # Make df long to wide, grouping the series in one pass
+    order, series_codes, series_lst = get_series_blocks(df, sort_series=False)
+    timestamps = pd.to_datetime(df["Timestamp"]).values[order]
+    values = df["Value"].values[order]
+    dict_ts = {
+        f"{Id}-{Key}": pd.DataFrame(
+            {"Timestamp": timestamps[start:end], "Value": values[start:end]}
+        )
+        for (Id, Key), start, end in series_lst
+    }
+    if decimate:
+        positions = get_decimated_positions(
+            series_codes, timestamps.view(np.int64), values, n_bins=width
         )
+        series_codes, timestamps, values = (
+            series_codes[positions],
+            timestamps[positions],
+            values[positions],
+        )
+        block_bounds = np.searchsorted(
+            series_codes, np.arange(len(series_lst) + 1), side="left"
+        )
+    else:
+        block_bounds = [start for _, start, _ in series_lst] + [order.size]
 
     # TS plots
     subfig = make_subplots(specs=[[{"secondary_y": True}]])
-    for ind, df_ts1 in dict_ts.items():
-        subfig.add_trace(go.Scatter(x=df_ts1["Timestamp"], y=df_ts1["Value"], name=ind))
+    for i, ind in enumerate(dict_ts):
+        start, end = block_bounds[i], block_bounds[i + 1]
+        subfig.add_trace(
+            go.Scatter(x=timestamps[start:end], y=values[start:end], name=ind)
+        )
 
     if plot_anom:
         # Create ts for the change-points
         max_val = df["Value"].max()
-        df_anom["Value"] = df_anom["isAnomaly"].apply(
-            lambda x: max_val if x == 1 else 0
-        )
+        anom_values = np.where(df_anom["isAnomaly"].values == 1, max_val, 0)
+        anom_index = df_anom.index
+        if decimate and anom_values.size > 0:
+            # Drawn as steps (line_shape 'hv'), only the first point of each run of equal values and the last point are needed
+            is_kept = np.r_[True, anom_values[1:] != anom_values[:-1]]
+            is_kept[-1] = True
+            anom_values, anom_index = anom_values[is_kept], anom_index[is_kept]
         subfig.add_trace(
             go.Scatter(
-                x=df_anom.index,
-                y=df_anom["Value"],
+                x=anom_index,
+                y=anom_values,
                 name="anomaly",
                 fill="tonexty",
                 fillcolor="rgba(250, 10, 10, 0.5)",
@@ -58,7 +189,7 @@ def plot_ts_anom(df, df_anom, plot_anom=True):
 
     subfig.update_layout(
         height=600,
-        width=1200,
+        width=width,
         title=title,
         legend=dict(font=dict(size=9), yanchor="top", y=-0.1, x=0.25),
     )
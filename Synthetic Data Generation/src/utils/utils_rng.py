@@ -0,0 +1,62 @@
+"""utility functions to derive an independent random generator for each simulated series from the run seed and a stable series identifier"""
+
+import hashlib
+import numpy as np
+
+
+def get_series_seed_seq(seed=None, profile=None, id_name=None, key_name=None) -> np.random.SeedSequence:
+    """
+    Derive the seed sequence of a series from the run seed and a stable hash of (profile, Id, Key),
+    so that the draws of a series do not depend on which other series are simulated, nor in which order.
+
+    Parameters
+    ----------
+    seed : random seed of the run,
+        int
+    profile : data profile of the series,
+        str (e.g. 'continuous')
+    id_name : Id of the series (e.g. device name),
+        str (e.g. 'A')
+    key_name : Key of the series (e.g. channel of sensor),
+        str (e.g. 'PowerMeter')
+
+    Return
+    ----------
+    seed_seq : seed sequence of the series,
+        np.random.SeedSequence
+    """
+    # hash() of str is salted per process, use a digest instead to be stable across runs and worker processes
+    digest = hashlib.sha256('\x1f'.join([profile, str(id_name), str(key_name)]).encode('utf-8')).digest()
+    return np.random.SeedSequence([seed, *np.frombuffer(digest, dtype=np.uint32).tolist()])
+
+
+class SeriesRng(object):
+    def __init__(self, \
+                 seed=None, \
+                 profile=None) -> None:
+        """
+        Random generators of all series of a data profile, each created on first use from function get_series_seed_seq()
+        and kept so that a series keeps drawing from the same generator across consecutive time chunks.
+        Call with (id_name, key_name) to get the generator of a series.
+
+        Parameters
+        ----------
+        seed : random seed of the run,
+            int
+        profile : data profile of the series,
+            str (e.g. 'continuous')
+
+        Return
+        ----------
+        None
+        """
+        self.seed = seed
+        self.profile = profile
+        self.rng_dic = {}
+
+    def __call__(self, \
+                 id_name=None, \
+                 key_name=None) -> np.random.Generator:
+        if (id_name, key_name) not in self.rng_dic:
+            self.rng_dic[(id_name, key_name)] = np.random.default_rng(get_series_seed_seq(self.seed, self.profile, id_name, key_name))
+        return self.rng_dic[(id_name, key_name)]
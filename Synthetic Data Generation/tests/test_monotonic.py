@@ -0,0 +1,60 @@
+"""
+Tests of the monotonic data profile
+"""
+import json
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+import pytest
+
+SRC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src')
+sys.path.insert(0, SRC_DIR)
+
+from graph_dataset import GraphDataset
+from simulation_anomalylabels import simulate_anomaly_labels
+from simulation_monotonic import get_monotonic_ts_df
+from utils.utils_rng import SeriesRng
+
+
+def get_graph_dataset():
+    with open(os.path.join(SRC_DIR, '..', 'data', 'topology_json', 'topology.json'), 'r') as f:
+        topo_json = json.load(f)
+    topo_df = pd.DataFrame(list(topo_json.values())[0])
+    return GraphDataset(topo_df=topo_df, relationship_to_flow='isParent', simulated_nodes=['A', 'B'])
+
+
+@pytest.mark.parametrize('rng, series_rng', [(None, None), \
+                                             (np.random.default_rng(2022), None), \
+                                             (None, SeriesRng(seed=2022, profile='monotonic'))])
+def test_monotonic_non_decreasing_with_timestamp_noise(rng, series_rng):
+    np.random.seed(2022)
+    gd = get_graph_dataset()
+    anomaly_label_lst, surge_start_end_indices_lst = simulate_anomaly_labels(num_simulated_anomaly_ts=1, \
+                                                                             time_range_lst=[['2022-06-01 08:00:00', '2022-06-01 12:00:00']], \
+                                                                             freq_lst=['1s'], \
+                                                                             start_of_day_range_lst=[['07:00:00', '09:00:00']], \
+                                                                             end_of_day_range_lst=[['16:00:00', '17:00:00']], \
+                                                                             surge_occurrence_range_lst=[[10, 10]], \
+                                                                             surge_length_range_lst=[[20, 20]])
+    ts_df = get_monotonic_ts_df(unique_anomaly_label=True, \
+                                anomaly_label_lst=anomaly_label_lst, \
+                                surge_start_end_indices_lst=surge_start_end_indices_lst, \
+                                simulate_surge_lst=[True, True], \
+                                surge_ratio_range_lst=[[5, 10], [5, 10]], \
+                                normal_mean_range_lst=[[2, 3], [22, 23]], \
+                                normal_std_lst=[0.5, 0.5], \
+                                gd=gd, \
+                                key_name='PowerMeter', \
+                                missing_ratio=0.1, \
+                                value_noise=True, \
+                                timestamp_noise=True, \
+                                rng=rng, \
+                                series_rng=series_rng)
+
+    # The noise is actually there, as fractions of seconds
+    assert (ts_df['Timestamp'].dt.microsecond != 0).any()
+    for node_id, sub_df in ts_df.groupby('Id'):
+        values = sub_df.sort_values('Timestamp', kind='stable')['Value'].values
+        assert (np.diff(values) >= 0).all(), node_id